@@ -0,0 +1,73 @@
+import sys
+import argparse
+import logging
+from core.batch import run_batch, task_workspace, batch_concurrency, batch_model_concurrency
+
+def main():
+    """
+    Batch interface for the MultiAgentCoding system.
+    Runs the coding tasks of a JSONL file concurrently, each in its own copy of the playground,
+    and writes one JSON result per task. Running the same batch again skips finished tasks.
+    """
+    parser = argparse.ArgumentParser(description="Run MultiAgent Coding tasks from a JSONL file")
+    parser.add_argument("tasks", help="JSONL file with one {\"id\", \"prompt\", \"answers\"} object per line")
+    parser.add_argument("--output", help="JSONL file for the results (default: <tasks>.results.jsonl)")
+    parser.add_argument("--workdir", help="directory for the per-task playgrounds, caches and logs")
+    parser.add_argument("--playground", help="playground each task starts from (default: AI_PLAYGROUND_PATH)")
+    parser.add_argument("--concurrency", type=int, default=batch_concurrency,
+                        help="number of tasks run at the same time")
+    parser.add_argument("--model-concurrency", type=int, default=batch_model_concurrency,
+                        help="number of model calls in flight across all tasks")
+    parser.add_argument("--diff", metavar="TASK_ID", help="show the changes a task made to its playground")
+    parser.add_argument("--commit", metavar="TASK_ID", help="apply a task's changes to the playground")
+    parser.add_argument("--discard", metavar="TASK_ID", help="delete a task's playground and changes")
+    parser.add_argument("--profile", action="store_true",
+                        help="sample stacks and time the local hot paths of each task, writing a profile to its directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    if args.diff:
+        print(task_workspace(args.tasks, args.diff, args.workdir).diff_text())
+        return
+    if args.commit:
+        applied, conflicts = task_workspace(args.tasks, args.commit, args.workdir).commit()
+        for change in applied:
+            print(f"{change['status']}: {change['path']}")
+        for path in conflicts:
+            print(f"conflict, not applied: {path} changed in the playground since the task started")
+        sys.exit(1 if conflicts else 0)
+    if args.discard:
+        task_workspace(args.tasks, args.discard, args.workdir).discard()
+        print(f"Discarded the playground of task {args.discard}")
+        return
+
+    def print_result(record):
+        print(f"[{record['status']}] task {record['id']} in {record.get('duration', 0):.0f}s")
+        if record.get("error"):
+            print(f"    {record['error']}")
+
+    try:
+        summary = run_batch(
+            args.tasks,
+            output_path=args.output,
+            workdir=args.workdir,
+            base_playground=args.playground,
+            concurrency=args.concurrency,
+            model_concurrency=args.model_concurrency,
+            on_result=print_result,
+            profile=args.profile,
+        )
+    except KeyboardInterrupt:
+        print("\nBatch interrupted. Run the same command again to continue with the remaining tasks.")
+        sys.exit(1)
+
+    print(f"\n{summary['ok']} succeeded, {summary['error']} failed, "
+          f"{summary['skipped']} already done of {summary['total']} tasks")
+    sys.exit(1 if summary["error"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
+import argparse
 from core.smolagents import MultiAgentCoding
 
 def main():
     """
     Launch the MultiAgent Coding system with Gradio UI interface.
     """
+    parser = argparse.ArgumentParser(description="MultiAgent Coding web interface")
+    parser.add_argument("--profile", action="store_true",
+                        help="sample stacks and time the local hot paths of each request, writing a profile per request")
+    args = parser.parse_args()
+
     coding = MultiAgentCoding()
-    coding.launch_with_ui()
+    coding.launch_with_ui(profile=args.profile)
 
 if __name__ == "__main__":
     main()
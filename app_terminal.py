@@ -1,12 +1,32 @@
 import sys
+import argparse
 import logging
 from core.smolagents import MultiAgentCoding
+from core.profiling import maybe_profile
+
+def print_result(result):
+    print("-" * 50)
+    print("Final AI response to user:")
+    print("-" * 50)
+    print(result)
+    print("-" * 50)
+
+def print_resume_hint(coding):
+    """Tell the user how to continue an interrupted run"""
+    if coding.checkpoint is not None and not coding.checkpoint.finished:
+        print(f"Resume this run with: python app_terminal.py --resume {coding.checkpoint.run_id}")
 
 def main():
     """
     Simple terminal interface for interacting with the MultiAgentCoding system.
     Allows users to input coding requests and displays the generated code responses.
     """
+    parser = argparse.ArgumentParser(description="MultiAgent Coding terminal interface")
+    parser.add_argument("--resume", metavar="RUN_ID", help="continue an interrupted run from its checkpoint")
+    parser.add_argument("--profile", action="store_true",
+                        help="sample stacks and time the local hot paths of each request, writing a profile per request")
+    args = parser.parse_args()
+
     # Set up logging
     logging.basicConfig(
         level=logging.WARNING,  # Changed from INFO to WARNING to disable most logs
@@ -23,6 +43,21 @@ def main():
     print("Enter your coding requests, or type 'exit' to quit.")
     print("-" * 50)
 
+    if args.resume:
+        try:
+            print(f"\nResuming run {args.resume}...\n")
+            with maybe_profile(args.profile, "terminal"):
+                result = coding.resume_terminal(args.resume)
+            print_result(result)
+        except KeyboardInterrupt:
+            print("\n\nOperation cancelled by user.")
+            print_resume_hint(coding)
+            sys.exit(0)
+        except Exception as e:
+            logger.error("Error occurred while resuming run", exc_info=True)
+            print(f"\nAn error occurred: {str(e)}")
+            print_resume_hint(coding)
+
     while True:
         try:
             # Get user input
@@ -44,24 +79,23 @@ def main():
             
             # Process the request
             logger.debug("Calling run_terminal with user input")
-            result = coding.run_terminal(user_input)
+            with maybe_profile(args.profile, "terminal"):
+                result = coding.run_terminal(user_input)
             
             # Display the result
             logger.info("Request processed successfully")
-            print("-" * 50)
-            print("Final AI response to user:")
-            print("-" * 50)
-            print(result)
-            print("-" * 50)
+            print_result(result)
             
         except KeyboardInterrupt:
             logger.warning("Operation cancelled by keyboard interrupt")
             print("\n\nOperation cancelled by user.")
+            print_resume_hint(coding)
             sys.exit(0)
             
         except Exception as e:
             logger.error("Error occurred while processing request", exc_info=True)
             print(f"\nAn error occurred: {str(e)}")
+            print_resume_hint(coding)
             print("Please try again.")
 
 if __name__ == "__main__":
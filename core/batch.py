@@ -0,0 +1,219 @@
+import os
+import re
+import json
+import time
+import logging
+import multiprocessing
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Set
+
+from smolagents.utils import make_json_serializable
+
+from core.model_calls import set_call_limiter, usage_totals
+from core.profiling import maybe_profile
+from core.workspace import Workspace
+
+logger = logging.getLogger(__name__)
+
+batch_concurrency = int(os.getenv('BATCH_CONCURRENCY', '4'))
+batch_model_concurrency = int(os.getenv('BATCH_MODEL_CONCURRENCY', '8'))
+
+
+def load_tasks(path: str) -> List[Dict]:
+    """Read tasks from a JSONL file
+
+    Each line is an object with a "prompt" (or "task"), an optional "id" (the
+    line number by default) and optional "answers" to the clarifying questions.
+    """
+    tasks = []
+    seen = set()
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            prompt = record.get("prompt") or record.get("task")
+            if not prompt:
+                raise ValueError(f"{path}:{line_number}: task has no prompt")
+            task_id = str(record.get("id", line_number))
+            if task_id in seen:
+                raise ValueError(f"{path}:{line_number}: duplicate task id {task_id}")
+            seen.add(task_id)
+            tasks.append({"id": task_id, "prompt": prompt, "answers": record.get("answers")})
+    return tasks
+
+
+def completed_task_ids(output_path: str) -> Set[str]:
+    """Ids of the tasks that already have a successful result in the output file"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Line cut short by an interrupted batch
+                continue
+            if record.get("status") == "ok":
+                done.add(str(record["id"]))
+    return done
+
+
+def _task_dirname(task_id: str) -> str:
+    return re.sub(r'[^\w.-]', '_', task_id)
+
+
+def default_workdir(tasks_path: str) -> str:
+    stem = os.path.splitext(os.path.basename(tasks_path))[0]
+    return os.path.join(os.getenv('CACHE_PATH', ".cache/multiagent_coding/"), "batches", stem)
+
+
+def task_workspace(tasks_path: str, task_id: str, workdir: Optional[str] = None) -> Workspace:
+    """Open the playground workspace of a batch task, e.g. to commit or discard its changes"""
+    playground = os.path.join(workdir or default_workdir(tasks_path), _task_dirname(task_id), "playground")
+    if not Workspace.exists(playground):
+        raise ValueError(f"Task {task_id} has no workspace in {os.path.dirname(playground)}")
+    return Workspace.open(playground)
+
+
+def _init_worker(semaphore) -> None:
+    set_call_limiter(semaphore)
+
+
+def run_task(task: Dict, task_dir: str, base_playground: str, profile: bool = False) -> Dict:
+    """Run one task in its own playground; called in a fresh worker process
+
+    The playground is a copy-on-write workspace of base_playground. It, the
+    cache and the logs of the task live under task_dir, and its console output
+    goes to task_dir/output.log. Running a task again resumes its workspace and
+    its run checkpoint. With profile set, the task's profile is written to
+    task_dir/profile.
+
+    Returns:
+        dict: Result record with status, result, error, changes to the playground, token usage and timings
+    """
+    started = time.time()
+    os.makedirs(task_dir, exist_ok=True)
+    playground = os.path.join(task_dir, "playground")
+    if Workspace.exists(playground):
+        workspace = Workspace.open(playground)
+    else:
+        workspace = Workspace.create(base_playground, playground)
+
+    os.environ["AI_PLAYGROUND_PATH"] = playground + os.sep
+    os.environ["CACHE_PATH"] = os.path.join(task_dir, "cache") + os.sep
+    os.environ["TESTS_PATH"] = os.path.join(task_dir, "logs") + os.sep
+
+    record = {"id": task["id"], "prompt": task["prompt"], "workspace": playground}
+    coding = None
+    with open(os.path.join(task_dir, "output.log"), 'a') as output, redirect_stdout(output):
+        try:
+            # Imported here so the module-level paths pick up the task's directories
+            from core.smolagents import MultiAgentCoding, changed_files
+            coding = MultiAgentCoding()
+            with maybe_profile(profile, "task", os.path.join(task_dir, "profile")):
+                result = coding.run_batch_task(task["prompt"], task.get("answers"), run_id="task")
+            record.update(status="ok", result=make_json_serializable(result), error=None)
+        except Exception as e:
+            logger.error(f"Error running task {task['id']}: {str(e)}", exc_info=True)
+            record.update(status="error", result=None, error=f"{type(e).__name__}: {str(e)}")
+        finally:
+            if coding is not None and coding.sandbox is not None:
+                coding.sandbox.shutdown()
+
+    record["changed_files"] = sorted(changed_files) if coding is not None else []
+    record["changes"] = workspace.diff()
+    record.update(usage_totals())
+    if coding is not None:
+        from core.http_transport import pool_metrics
+        record["http_pool"] = pool_metrics()
+    record["timings"] = coding.timings if coding is not None else {}
+    record["duration"] = round(time.time() - started, 3)
+    return record
+
+
+def run_batch(
+    tasks_path: str,
+    output_path: Optional[str] = None,
+    workdir: Optional[str] = None,
+    base_playground: Optional[str] = None,
+    concurrency: int = batch_concurrency,
+    model_concurrency: int = batch_model_concurrency,
+    on_result: Optional[Callable[[Dict], None]] = None,
+    profile: bool = False,
+) -> Dict[str, int]:
+    """Run the tasks of a JSONL file concurrently, appending one result per line to the output
+
+    Tasks with a successful result in the output file are skipped, so an
+    interrupted batch continues where it stopped when run again.
+
+    Args:
+        tasks_path: JSONL file of tasks, see load_tasks
+        output_path: JSONL file of results, next to the tasks file by default
+        workdir: Directory of the per-task playgrounds, cache and logs
+        base_playground: Playground each task starts from
+        concurrency: Number of tasks run at the same time
+        model_concurrency: Number of model calls in flight across all tasks
+        on_result: Called with each result record as it is written
+        profile: Write a profile of each task to its directory, see core.profiling
+
+    Returns:
+        dict: Number of tasks in total, skipped, ok and failed
+    """
+    if output_path is None:
+        output_path = os.path.splitext(tasks_path)[0] + ".results.jsonl"
+    if workdir is None:
+        workdir = default_workdir(tasks_path)
+    if base_playground is None:
+        base_playground = os.getenv('AI_PLAYGROUND_PATH', "ai_playground/")
+
+    tasks = load_tasks(tasks_path)
+    done = completed_task_ids(output_path)
+    pending = [task for task in tasks if task["id"] not in done]
+    summary = {"total": len(tasks), "skipped": len(tasks) - len(pending), "ok": 0, "error": 0}
+    if not pending:
+        return summary
+
+    # Don't glue the first new record to a line cut short by an interrupted batch
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    else:
+        needs_newline = False
+
+    # A fresh process per task, so module-level playground state is never shared
+    context = multiprocessing.get_context("spawn")
+    semaphore = context.BoundedSemaphore(model_concurrency)
+    pool = ProcessPoolExecutor(max_workers=concurrency, mp_context=context, initializer=_init_worker,
+                               initargs=(semaphore,), max_tasks_per_child=1)
+    try:
+        with open(output_path, 'a') as out:
+            if needs_newline:
+                out.write("\n")
+            futures = {
+                pool.submit(run_task, task, os.path.join(workdir, _task_dirname(task["id"])), base_playground,
+                            profile): task
+                for task in pending
+            }
+            for future in as_completed(futures):
+                task = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    record = {"id": task["id"], "prompt": task["prompt"], "status": "error", "result": None,
+                              "error": f"Worker failed: {type(e).__name__}: {str(e)}"}
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+                summary[record["status"]] += 1
+                if on_result is not None:
+                    on_result(record)
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+    return summary
@@ -0,0 +1,217 @@
+import os
+import gzip
+import json
+import zlib
+import uuid
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from smolagents import utils as smolagents_utils
+from smolagents.memory import ActionStep, PlanningStep, TaskStep, ToolCall
+from smolagents.utils import make_json_serializable
+
+from core.workspace import replace_file
+
+logger = logging.getLogger(__name__)
+
+
+def _restore_error(error: Optional[Dict[str, str]]):
+    """Rebuild an AgentError without logging it again"""
+    if not error:
+        return None
+    cls = getattr(smolagents_utils, error["type"], smolagents_utils.AgentError)
+    restored = cls.__new__(cls)
+    Exception.__init__(restored, error["message"])
+    restored.message = error["message"]
+    return restored
+
+
+def serialize_step(step) -> Optional[Dict[str, Any]]:
+    """Compact JSON form of an agent memory step
+
+    Model input messages are dropped: they are a copy of the earlier steps and
+    the agent rebuilds them from memory. Returns None for steps that never got
+    a model output, such as one interrupted by an API error or Ctrl-C.
+    """
+    if isinstance(step, TaskStep):
+        return {"kind": "task", "task": step.task}
+    if isinstance(step, PlanningStep):
+        return {"kind": "planning", "facts": step.facts, "plan": step.plan}
+    if isinstance(step, ActionStep):
+        if step.model_output is None and step.error is None and step.action_output is None:
+            return None
+        return {
+            "kind": "action",
+            "step_number": step.step_number,
+            "model_output": step.model_output,
+            "tool_calls": [[tc.name, make_json_serializable(tc.arguments), tc.id] for tc in step.tool_calls or []],
+            "observations": step.observations,
+            "error": step.error.dict() if step.error else None,
+            "action_output": make_json_serializable(step.action_output),
+            "start_time": step.start_time,
+            "end_time": step.end_time,
+            "duration": step.duration,
+        }
+    return None
+
+
+def deserialize_step(data: Dict[str, Any]):
+    """Rebuild an agent memory step from its compact JSON form"""
+    if data["kind"] == "task":
+        return TaskStep(task=data["task"])
+    if data["kind"] == "planning":
+        return PlanningStep(model_input_messages=[], model_output_message_facts=None, facts=data["facts"],
+                            model_output_message_plan=None, plan=data["plan"])
+    return ActionStep(
+        step_number=data["step_number"],
+        model_output=data["model_output"],
+        tool_calls=[ToolCall(name=name, arguments=arguments, id=call_id)
+                    for name, arguments, call_id in data["tool_calls"]] or None,
+        observations=data["observations"],
+        error=_restore_error(data["error"]),
+        action_output=data["action_output"],
+        start_time=data["start_time"],
+        end_time=data["end_time"],
+        duration=data["duration"],
+    )
+
+
+class RunCheckpoint:
+    """Incremental on-disk record of one run, used to resume it after a crash
+
+    Records are appended to `events.jsonl.gz` as separate gzip members, so each
+    append is cheap and a write cut short by a crash only loses the last record.
+    Playground files are stored once per content hash under `blobs/`.
+    """
+
+    def __init__(self, base_path: str, run_id: str):
+        self.run_id = run_id
+        self.run_dir = os.path.join(base_path, run_id)
+        self.events_path = os.path.join(self.run_dir, "events.jsonl.gz")
+        self.blobs_dir = os.path.join(self.run_dir, "blobs")
+        self.lock = threading.Lock()
+        os.makedirs(self.blobs_dir, exist_ok=True)
+
+        self.stages: Dict[str, Any] = {}
+        self.answers: List[str] = []
+        self.steps: Dict[str, List[Dict[str, Any]]] = {}
+        self.files: Dict[str, Optional[str]] = {}
+        self.finished = False
+        self._load()
+        # Agent name -> number of memory steps already looked at by record_steps
+        self.cursors = {name: len(steps) for name, steps in self.steps.items()}
+
+    @classmethod
+    def create(cls, base_path: str) -> "RunCheckpoint":
+        run_id = datetime.now().strftime("%Y%m%d_%H%M%S_") + uuid.uuid4().hex[:6]
+        return cls(base_path, run_id)
+
+    @classmethod
+    def load(cls, base_path: str, run_id: str) -> "RunCheckpoint":
+        if not os.path.exists(os.path.join(base_path, run_id, "events.jsonl.gz")):
+            raise ValueError(f"No checkpoint found for run {run_id} in {base_path}")
+        return cls(base_path, run_id)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.events_path):
+            return
+        events = []
+        try:
+            with gzip.open(self.events_path, 'rt') as f:
+                for line in f:
+                    events.append(json.loads(line))
+        except (EOFError, OSError, zlib.error, json.JSONDecodeError):
+            # Rewrite the valid records so later appends are readable again
+            logger.warning(f"Dropping truncated record at the end of {self.events_path}")
+            with gzip.open(self.events_path, 'wt') as f:
+                f.writelines(json.dumps(event) + "\n" for event in events)
+        for event in events:
+            self._apply(event)
+
+    def _apply(self, event: Dict[str, Any]) -> None:
+        if event["type"] == "stage":
+            self.stages[event["name"]] = event["data"]
+        elif event["type"] == "answer":
+            self.answers.append(event["answer"])
+        elif event["type"] == "step":
+            self.steps.setdefault(event["agent"], []).append(event["step"])
+        elif event["type"] == "files":
+            self.files.update(event["files"])
+        elif event["type"] == "finished":
+            self.finished = True
+
+    def _append(self, event: Dict[str, Any]) -> None:
+        with self.lock:
+            with gzip.open(self.events_path, 'at') as f:
+                f.write(json.dumps(event) + "\n")
+            self._apply(event)
+
+    def record_stage(self, name: str, data: Any) -> None:
+        """Record the output of a pipeline stage (enhancement, clarification, plan, ...)"""
+        self._append({"type": "stage", "name": name, "data": data})
+
+    def record_answer(self, answer: str) -> None:
+        """Record one answer to a clarifying question as soon as it is given"""
+        self._append({"type": "answer", "answer": answer})
+
+    def record_steps(self, agent_name: str, steps: List[Any]) -> None:
+        """Record agent memory steps that were not recorded yet
+
+        The memory must start with the steps returned by `restore_steps`.
+        """
+        for step in steps[self.cursors.get(agent_name, 0):]:
+            data = serialize_step(step)
+            if data is not None:
+                self._append({"type": "step", "agent": agent_name, "step": data})
+        self.cursors[agent_name] = len(steps)
+
+    def record_files(self, root: str, rel_paths: Iterable[str]) -> None:
+        """Snapshot playground files whose contents differ from the last snapshot"""
+        changes = {}
+        for rel_path in rel_paths:
+            path = os.path.join(root, rel_path)
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                if self.files.get(rel_path) is not None:
+                    changes[rel_path] = None
+                continue
+            digest = hashlib.sha256(content).hexdigest()
+            if self.files.get(rel_path) == digest:
+                continue
+            blob_path = os.path.join(self.blobs_dir, digest)
+            if not os.path.exists(blob_path):
+                with gzip.open(blob_path, 'wb') as f:
+                    f.write(content)
+            changes[rel_path] = digest
+        if changes:
+            self._append({"type": "files", "files": changes})
+
+    def mark_finished(self) -> None:
+        self._append({"type": "finished"})
+
+    def restore_files(self, root: str) -> List[str]:
+        """Write the last snapshot of every recorded file back to the playground"""
+        restored = []
+        for rel_path, digest in self.files.items():
+            path = os.path.join(root, rel_path)
+            if digest is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            with gzip.open(os.path.join(self.blobs_dir, digest), 'rb') as f:
+                content = f.read()
+            replace_file(path, content)
+            restored.append(rel_path)
+        return restored
+
+    def restore_steps(self, agent_name: str) -> List[Any]:
+        """Rebuild the recorded memory steps of an agent"""
+        return [deserialize_step(data) for data in self.steps.get(agent_name, [])]
+
+    def completed_action_steps(self, agent_name: str) -> int:
+        return sum(1 for data in self.steps.get(agent_name, []) if data["kind"] == "action")
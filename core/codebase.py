@@ -0,0 +1,435 @@
+import os
+import json
+import codecs
+import hashlib
+import logging
+import threading
+import subprocess
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from core.sandbox import SANDBOX_DIRNAME
+from core.git_snapshot import GitTree
+from core.profiling import timed
+
+logger = logging.getLogger(__name__)
+
+codebase_max_file_bytes = int(os.getenv('CODEBASE_MAX_FILE_BYTES', '100000'))
+codebase_max_total_bytes = int(os.getenv('CODEBASE_MAX_TOTAL_BYTES', '2000000'))
+
+# Code file extensions to include
+CODE_EXTENSIONS = {'.py', '.js', '.jsx', '.ts', '.tsx', '.css', '.scss', '.html', '.vue', '.go', '.java', '.cpp', '.c', '.h', '.rs', '.sql', '.md', '.txt', '.json', '.yaml', '.yml', '.toml', '.ini', '.conf', '.cfg', '.properties', '.env', '.lock', '.lockb', '.lock.json', '.lock.yaml', '.lock.yml', '.lock.toml', '.lock.ini', '.lock.conf', '.lock.cfg', '.lock.properties', '.lock.env'}
+
+# Directories of dependencies and build output, never walked
+VENDORED_DIRS = {'node_modules', 'bower_components', 'vendor', 'third_party', 'site-packages', '.venv', 'venv',
+                 '.git', '.tox'}
+GENERATED_DIRS = {'dist', 'build', '.next', 'coverage', '__pycache__', '.mypy_cache', '.pytest_cache'}
+
+# Files written by tools rather than people
+GENERATED_NAMES = {'package-lock.json', 'yarn.lock', 'pnpm-lock.yaml', 'poetry.lock', 'Pipfile.lock', 'Cargo.lock',
+                   'composer.lock', 'Gemfile.lock', 'go.sum', 'bun.lockb', 'uv.lock'}
+GENERATED_SUFFIXES = ('.min.js', '.min.css', '.bundle.js', '.map', '_pb2.py', '_pb2_grpc.py', '.pb.go',
+                      '.generated.ts', '.lock', '.lockb')
+GENERATED_MARKERS = ('@generated', 'do not edit', 'code generated by', 'auto-generated', 'autogenerated')
+
+# Bytes read to decide whether a file is binary, minified or generated
+SNIFF_BYTES = 8192
+
+# Characters at the top of a file searched for generated-file markers
+HEADER_CHARS = 1024
+
+# Average line length in the first block above which code is taken to be minified or a data dump
+MINIFIED_LINE_CHARS = 500
+
+# Prose files legitimately have long lines
+PROSE_EXTENSIONS = {'.md', '.txt'}
+
+# Skipped files listed in the codebase prompt; the manifest file has all of them
+MAX_MANIFEST_LINES = 50
+
+
+def path_skip_reason(rel_path: str, size: Optional[int] = None,
+                     max_file_bytes: int = codebase_max_file_bytes) -> Optional[str]:
+    """Why a file is left out of the codebase judging by its path and size, or None to include it"""
+    parts = os.path.normpath(rel_path).split(os.sep)
+    if any(part in VENDORED_DIRS for part in parts[:-1]):
+        return "vendored"
+    if any(part in GENERATED_DIRS for part in parts[:-1]):
+        return "generated"
+    name = parts[-1]
+    if name in GENERATED_NAMES or name.endswith(GENERATED_SUFFIXES):
+        return "generated"
+    if size is not None and size > max_file_bytes:
+        return f"too large ({size} bytes)"
+    return None
+
+
+def sniff_skip_reason(block: bytes, file_ext: str) -> Optional[str]:
+    """Why a file is left out of the codebase judging by its first block, or None to include it"""
+    if b"\0" in block:
+        return "binary"
+    try:
+        # The block may end in the middle of a character
+        text = codecs.getincrementaldecoder('utf-8')().decode(block, final=False)
+    except UnicodeDecodeError:
+        return "not UTF-8 text"
+    if any(marker in text[:HEADER_CHARS].lower() for marker in GENERATED_MARKERS):
+        return "generated"
+    if file_ext not in PROSE_EXTENSIONS and len(text) >= SNIFF_BYTES // 4:
+        if len(text) / (text.count("\n") + 1) > MINIFIED_LINE_CHARS:
+            return "minified"
+    return None
+
+
+def read_source(path: str, file_ext: str, max_file_bytes: int = codebase_max_file_bytes
+                ) -> Tuple[Optional[str], Optional[str]]:
+    """Read a file for the codebase unless the ingestion policy skips it
+
+    Only the first block is read before deciding, so binary, minified and
+    generated files cost one small read.
+
+    Returns:
+        (content, None) for an included file, or (None, reason it was skipped)
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size > max_file_bytes:
+            return None, f"too large ({size} bytes)"
+        block = f.read(SNIFF_BYTES)
+        reason = sniff_skip_reason(block, file_ext)
+        if reason is not None:
+            return None, reason
+        data = block + f.read(max_file_bytes + 1 - len(block))
+    if len(data) > max_file_bytes:
+        # Grew since the stat
+        return None, f"too large (over {max_file_bytes} bytes)"
+    return data.decode('utf-8', errors='replace'), None
+
+
+def load_gitignore_patterns(directory: str) -> List[str]:
+    """Load gitignore patterns from a directory's .gitignore file if it exists"""
+    gitignore_path = os.path.join(directory, '.gitignore')
+    if os.path.exists(gitignore_path):
+        try:
+            with open(gitignore_path, 'r') as f:
+                return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        except Exception as e:
+            logger.error(f"Error reading {gitignore_path}: {str(e)}")
+    return []
+
+
+class GitignoreMatcher:
+    """Matches paths against the .gitignore files found in a directory tree"""
+
+    def __init__(self, root: str):
+        self.root = os.path.normpath(root)
+        # Directory -> patterns of the .gitignore file in it
+        self.patterns: Dict[str, List[str]] = {}
+        self.reload()
+
+    def reload(self) -> None:
+        """Collect the patterns of every .gitignore file under the root"""
+        self.patterns = {}
+        for directory, dirs, _ in os.walk(self.root):
+            dirs[:] = [d for d in dirs if d != SANDBOX_DIRNAME]
+            self.reload_directory(directory)
+
+    def reload_directory(self, directory: str) -> None:
+        """Re-read the .gitignore file of a single directory"""
+        directory = os.path.normpath(directory)
+        patterns = load_gitignore_patterns(directory)
+        if patterns:
+            self.patterns[directory] = patterns
+        else:
+            self.patterns.pop(directory, None)
+
+    def on_change(self, kind: str, rel_path: Optional[str]) -> None:
+        """Watcher callback: re-read .gitignore files when they change"""
+        if rel_path is None:
+            self.reload()
+        elif os.path.basename(rel_path) == '.gitignore':
+            self.reload_directory(os.path.join(self.root, os.path.dirname(rel_path)))
+
+    @timed("gitignore.is_ignored")
+    def is_ignored(self, path: str) -> bool:
+        """Check if path matches any gitignore pattern from parent directories"""
+        path = os.path.normpath(path)
+        rel_path = os.path.relpath(path, self.root)
+        current_dir = os.path.dirname(path)
+
+        # Check patterns from current and all parent directories
+        while True:
+            for pattern in self.patterns.get(current_dir, ()):
+                if pattern.endswith('/'):
+                    if rel_path.startswith(pattern):
+                        return True
+                elif pattern.startswith('*'):
+                    if rel_path.endswith(pattern[1:]):
+                        return True
+                elif pattern in rel_path:
+                    return True
+            if current_dir == self.root or len(current_dir) < len(self.root):
+                return False
+            current_dir = os.path.dirname(current_dir)
+
+
+def iter_code_files(root: str, matcher: Optional[GitignoreMatcher] = None,
+                    skipped: Optional[Dict[str, str]] = None) -> Iterator[Tuple[str, str, str]]:
+    """Yield (path, path relative to root, extension) of every code file that is not ignored
+
+    Vendored and generated directories are not walked, and generated files
+    such as lockfiles are left out.
+
+    Args:
+        root: Directory to walk
+        matcher: Gitignore matcher for root; built from scratch if not given
+        skipped: Filled with path relative to root -> reason for the files and directories left out
+    """
+    if matcher is None:
+        matcher = GitignoreMatcher(root)
+    for directory, dirs, files in os.walk(root):
+        # Skip the working directories of sandbox workers
+        kept = []
+        for d in dirs:
+            if d == SANDBOX_DIRNAME:
+                continue
+            if d in VENDORED_DIRS or d in GENERATED_DIRS:
+                dir_path = os.path.join(directory, d)
+                if skipped is not None and not matcher.is_ignored(dir_path):
+                    skipped[os.path.relpath(dir_path, root) + os.sep] = "vendored" if d in VENDORED_DIRS else "generated"
+                continue
+            kept.append(d)
+        dirs[:] = kept
+        for file in files:
+            file_ext = os.path.splitext(file)[1]
+            if file_ext not in CODE_EXTENSIONS:
+                continue
+            file_path = os.path.join(directory, file)
+            if matcher.is_ignored(file_path):
+                continue
+            rel_path = os.path.relpath(file_path, root)
+            reason = path_skip_reason(rel_path)
+            if reason is not None:
+                if skipped is not None:
+                    skipped[rel_path] = reason
+                continue
+            yield file_path, rel_path, file_ext
+
+
+def git_code_files(tree: GitTree, skipped: Optional[Dict[str, str]] = None) -> Iterator[Tuple[str, str, str, str]]:
+    """Yield (path, path relative to root, extension, blob id) of every code file git lists
+
+    The git counterpart of iter_code_files: git's own ignore rules apply, and
+    no directory is walked.
+
+    Raises:
+        subprocess.CalledProcessError: If git fails
+    """
+    for rel_path, blob in sorted(tree.files().items()):
+        parts = rel_path.split(os.sep)
+        file_ext = os.path.splitext(rel_path)[1]
+        if file_ext not in CODE_EXTENSIONS or SANDBOX_DIRNAME in parts[:-1]:
+            continue
+        reason = path_skip_reason(rel_path)
+        if reason is not None:
+            if skipped is not None:
+                # One entry for a whole vendored or generated directory
+                skipped_dirs = [i for i, part in enumerate(parts[:-1]) if part in VENDORED_DIRS | GENERATED_DIRS]
+                key = os.sep.join(parts[:skipped_dirs[0] + 1]) + os.sep if skipped_dirs else rel_path
+                skipped[key] = reason
+            continue
+        yield os.path.join(tree.root, rel_path), rel_path, file_ext, blob
+
+
+def render_fragment(relative_path: str, file_ext: str, content: str) -> str:
+    """Format one file for the codebase prompt"""
+    # Detect file type for syntax highlighting
+    ext = file_ext[1:]  # Remove the dot
+    return f"\n### {relative_path}\n```{ext}\n{content}\n```\n"
+
+
+class CodebaseSnapshot:
+    """Codebase prompt cached per file
+
+    Each file's rendered fragment is kept until the file changes. When a watcher
+    feeds `on_change` (and `watched` is set) rendering costs only as much as the
+    files that changed; otherwise every file is stat-ed on each render to find
+    stale fragments. Given the root's GitTree, files are listed from the git
+    index instead and fragments are keyed by blob id, so a render of a clean
+    checkout reads the index and no files.
+
+    Files over the per-file byte cap and binary, minified, generated and
+    vendored files are left out (see path_skip_reason and sniff_skip_reason),
+    as are the files past the total byte cap. The prompt ends with a list of
+    the skipped files, and the full list is written to the manifest file.
+    """
+
+    def __init__(self, root: str, matcher: Optional[GitignoreMatcher] = None, manifest_path: Optional[str] = None,
+                 max_file_bytes: int = codebase_max_file_bytes, max_total_bytes: int = codebase_max_total_bytes,
+                 git: Optional[GitTree] = None):
+        self.root = root
+        self.matcher = matcher or GitignoreMatcher(root)
+        self.git = git
+        self.manifest_path = manifest_path
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.lock = threading.Lock()
+        # rel_path -> (file extension, stat key or blob id, rendered fragment or None if not rendered yet)
+        self.files: Dict[str, Tuple[str, Any, Optional[str]]] = {}
+        # rel_path -> reason, for paths skipped while listing and for files skipped after sniffing
+        self.listing_skipped: Dict[str, str] = {}
+        self.rejected: Dict[str, str] = {}
+        self.over_limit: List[str] = []
+        self.written_manifest: Optional[Dict[str, str]] = None
+        self.listed = False
+        self.watched = False
+
+    def _list_git_files(self) -> bool:
+        """Re-list the files from the git index, keeping fragments of unchanged blobs; False if git failed"""
+        files = {}
+        skipped = {}
+        try:
+            for _, rel_path, file_ext, blob in git_code_files(self.git, skipped):
+                cached = self.files.get(rel_path)
+                fragment = cached[2] if cached is not None and cached[1] == blob else None
+                files[rel_path] = (file_ext, blob, fragment)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.error(f"Error listing files with git, walking the tree instead: {str(e)}")
+            return False
+        self._set_listing(files, skipped)
+        return True
+
+    def _set_listing(self, files, skipped) -> None:
+        self.rejected = {rel_path: reason for rel_path, reason in self.rejected.items()
+                         if rel_path in files and files[rel_path][2] is not None}
+        self.files = files
+        self.listing_skipped = skipped
+        self.listed = True
+
+    @timed("codebase.list_files")
+    def _list_files(self) -> None:
+        """Re-walk the tree, keeping fragments of files that did not change"""
+        if self.git is not None and self._list_git_files():
+            return
+        files = {}
+        skipped = {}
+        for file_path, rel_path, file_ext in iter_code_files(self.root, self.matcher, skipped):
+            try:
+                stat = os.stat(file_path)
+                key = (stat.st_mtime, stat.st_size)
+            except OSError:
+                continue
+            if stat.st_size > self.max_file_bytes:
+                # Never opened
+                skipped[rel_path] = f"too large ({stat.st_size} bytes)"
+                continue
+            cached = self.files.get(rel_path)
+            fragment = cached[2] if cached is not None and cached[1] == key else None
+            files[rel_path] = (file_ext, key, fragment)
+        self._set_listing(files, skipped)
+
+    def _render_file(self, rel_path: str, file_ext: str) -> str:
+        file_path = os.path.join(self.root, rel_path)
+        self.rejected.pop(rel_path, None)
+        try:
+            content, reason = read_source(file_path, file_ext, self.max_file_bytes)
+        except Exception as e:
+            logger.error(f"Error reading {file_path}: {str(e)}")
+            return ""
+        if reason is not None:
+            logger.debug(f"Skipping {rel_path}: {reason}")
+            self.rejected[rel_path] = reason
+            return ""
+        return render_fragment(rel_path, file_ext, content)
+
+    def manifest(self) -> Dict[str, str]:
+        """Every file and directory left out of the codebase prompt, with the reason"""
+        with self.lock:
+            skipped = {**self.listing_skipped, **self.rejected}
+            skipped.update((rel_path, f"over the total limit of {self.max_total_bytes} bytes")
+                           for rel_path in self.over_limit)
+            return dict(sorted(skipped.items()))
+
+    def _write_manifest(self, manifest: Dict[str, str]) -> None:
+        if self.manifest_path is None or manifest == self.written_manifest:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"root": self.root, "skipped": manifest}, f, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+            self.written_manifest = manifest
+        except OSError as e:
+            logger.error(f"Error writing codebase manifest {self.manifest_path}: {str(e)}")
+
+    @timed("codebase.render")
+    def render(self) -> str:
+        """Return the codebase prompt, re-reading only files that changed"""
+        with self.lock:
+            if not self.listed or not self.watched:
+                self._list_files()
+            fragments = []
+            total = 0
+            self.over_limit = []
+            for rel_path, (file_ext, key, fragment) in self.files.items():
+                if fragment is None:
+                    fragment = self._render_file(rel_path, file_ext)
+                    self.files[rel_path] = (file_ext, key, fragment)
+                if not fragment:
+                    continue
+                if total + len(fragment) > self.max_total_bytes:
+                    self.over_limit.append(rel_path)
+                    continue
+                total += len(fragment)
+                fragments.append(fragment)
+        manifest = self.manifest()
+        self._write_manifest(manifest)
+        if manifest:
+            lines = [f"- {rel_path}: {reason}" for rel_path, reason in list(manifest.items())[:MAX_MANIFEST_LINES]]
+            if len(manifest) > MAX_MANIFEST_LINES:
+                lines.append(f"- ... and {len(manifest) - MAX_MANIFEST_LINES} more")
+            fragments.append("\n### Files left out of the codebase\n" + "\n".join(lines) + "\n")
+        return "\n".join(fragments)
+
+    def digest(self) -> str:
+        """Compact summary of the codebase: one line per file with a content hash and line count"""
+        self.render()
+        with self.lock:
+            lines = []
+            for rel_path, (_, _, fragment) in sorted(self.files.items()):
+                if fragment:
+                    sha = hashlib.sha256(fragment.encode('utf-8', 'replace')).hexdigest()[:12]
+                    # The fragment wraps the content in a header and a code fence
+                    line_count = max(0, fragment.count("\n") - 5)
+                    lines.append(f"{rel_path} {sha} {line_count} lines")
+            return "\n".join(lines)
+
+    def on_change(self, kind: str, rel_path: Optional[str]) -> None:
+        """Watcher callback: drop fragments of changed files"""
+        with self.lock:
+            if rel_path is None or os.path.basename(rel_path) == '.gitignore':
+                # Ignore rules changed or events were lost: re-list on the next render
+                self.listed = False
+                return
+            if kind == "deleted":
+                prefix = rel_path + os.sep
+                for cached in [p for p in self.files if p == rel_path or p.startswith(prefix)]:
+                    del self.files[cached]
+                    self.rejected.pop(cached, None)
+                for skipped in [p for p in self.listing_skipped if p == rel_path or p.startswith(prefix)]:
+                    del self.listing_skipped[skipped]
+                return
+            file_ext = os.path.splitext(rel_path)[1]
+            file_path = os.path.join(self.root, rel_path)
+            self.rejected.pop(rel_path, None)
+            self.listing_skipped.pop(rel_path, None)
+            if file_ext in CODE_EXTENSIONS and os.path.isfile(file_path) and not self.matcher.is_ignored(file_path):
+                reason = path_skip_reason(rel_path)
+                if reason is not None:
+                    self.listing_skipped[rel_path] = reason
+                    self.files.pop(rel_path, None)
+                else:
+                    # Re-render in place so the file keeps its position in the prompt
+                    self.files[rel_path] = (file_ext, None, None)
+            else:
+                self.files.pop(rel_path, None)
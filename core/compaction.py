@@ -0,0 +1,227 @@
+import os
+import re
+import ast
+import json
+import logging
+from dataclasses import replace
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from smolagents.memory import ActionStep, PlanningStep, TaskStep, ToolCall
+from smolagents.models import MessageRole
+
+logger = logging.getLogger(__name__)
+
+memory_token_ceiling = int(os.getenv('MEMORY_TOKEN_CEILING', '60000'))
+compaction_keep_recent_steps = int(os.getenv('COMPACTION_KEEP_RECENT_STEPS', '2'))
+compaction_max_output_chars = int(os.getenv('COMPACTION_MAX_OUTPUT_CHARS', '2000'))
+
+# Rough token estimate used for the ceiling; good enough without a tokenizer
+CHARS_PER_TOKEN = 4
+
+# Written contents shorter than this stay in old steps even when superseded
+MIN_ELIDED_CONTENT_CHARS = 200
+
+CODE_BLOCK_PATTERN = re.compile(r"(```(?:py|python)?\n)(.*?)(\n```)", re.DOTALL)
+
+
+def _path_argument(node: ast.Call, keyword: str) -> Optional[str]:
+    """The constant path passed to a file tool call, if any"""
+    value = node.args[0] if node.args else next((k.value for k in node.keywords if k.arg == keyword), None)
+    if isinstance(value, ast.Constant) and isinstance(value.value, str):
+        return os.path.normpath(value.value)
+    return None
+
+
+@lru_cache(maxsize=1024)
+def _parse(code: str) -> Optional[ast.Module]:
+    try:
+        return ast.parse(code)
+    except SyntaxError:
+        return None
+
+
+@lru_cache(maxsize=1024)
+def file_accesses(code: str) -> Tuple[FrozenSet[str], FrozenSet[str], bool]:
+    """Files read and written by a code snippet through the file tools
+
+    Returns:
+        (paths passed to read_file, paths passed to write_file, whether get_codebase was called)
+    """
+    tree = _parse(code)
+    if tree is None:
+        return frozenset(), frozenset(), False
+    reads, writes, codebase = set(), set(), False
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)):
+            continue
+        if node.func.id == 'get_codebase':
+            codebase = True
+        elif node.func.id == 'read_file':
+            path = _path_argument(node, 'filepath')
+            if path is not None:
+                reads.add(path)
+        elif node.func.id == 'write_file':
+            path = _path_argument(node, 'filepath')
+            if path is not None:
+                writes.add(path)
+    return frozenset(reads), frozenset(writes), codebase
+
+
+def elide_written_contents(code: str, paths: FrozenSet[str]) -> str:
+    """Replace the content literals of write_file calls to the given paths with a reference"""
+    tree = _parse(code)
+    if tree is None or not paths:
+        return code
+    # ast offsets are in utf-8 bytes
+    data = code.encode('utf-8')
+    line_starts = [0]
+    for line in data.splitlines(keepends=True):
+        line_starts.append(line_starts[-1] + len(line))
+
+    spans = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'write_file'):
+            continue
+        path = _path_argument(node, 'filepath')
+        if path not in paths:
+            continue
+        content = node.args[1] if len(node.args) > 1 else next(
+            (k.value for k in node.keywords if k.arg == 'content'), None)
+        if content is None or content.end_lineno is None:
+            continue
+        start = line_starts[content.lineno - 1] + content.col_offset
+        end = line_starts[content.end_lineno - 1] + content.end_col_offset
+        if end - start < MIN_ELIDED_CONTENT_CHARS:
+            continue
+        reference = f"<{end - start} characters written to {path}, since changed; use read_file to see them>"
+        spans.append((start, end, repr(reference).encode('utf-8')))
+
+    for start, end, reference in sorted(spans, reverse=True):
+        data = data[:start] + reference + data[end:]
+    return data.decode('utf-8')
+
+
+def truncate_middle(text: str, limit: int) -> str:
+    """Keep the beginning and end of a long text"""
+    if len(text) <= limit:
+        return text
+    half = limit // 2
+    return f"{text[:half]}\n[... {len(text) - 2 * half} characters elided ...]\n{text[-half:]}"
+
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    return sum(len(json.dumps(message["content"], default=str)) for message in messages) // CHARS_PER_TOKEN
+
+
+class MemoryCompactor:
+    """Builds compact model input from an agent's memory
+
+    The most recent action steps are sent verbatim. In older steps:
+    - code that writes a file later rewritten or re-read has the written
+      contents replaced by a reference,
+    - outputs that showed file contents a later step re-read or changed, and
+      get_codebase dumps, are replaced by a note,
+    - other long outputs keep only their beginning and end,
+    - the code is not repeated in the tool call message,
+    - only the latest planning step is kept.
+    If the result is still over the token ceiling the oldest action steps are
+    dropped. The memory itself is left untouched, so logs and checkpoints keep
+    every step in full.
+    """
+
+    def __init__(self, token_ceiling: int = memory_token_ceiling,
+                 keep_recent_steps: int = compaction_keep_recent_steps,
+                 max_output_chars: int = compaction_max_output_chars):
+        self.token_ceiling = token_ceiling
+        self.keep_recent_steps = keep_recent_steps
+        self.max_output_chars = max_output_chars
+
+    def _compact_step(self, step: ActionStep, later_touched: FrozenSet[str], codebase_later: bool,
+                      summary_mode: bool) -> ActionStep:
+        code = step.tool_calls[0].arguments if step.tool_calls and isinstance(step.tool_calls[0].arguments, str) else ""
+        reads, writes, codebase = file_accesses(code)
+
+        model_output = step.model_output
+        superseded_writes = writes & later_touched
+        if superseded_writes and model_output:
+            model_output = CODE_BLOCK_PATTERN.sub(
+                lambda m: m.group(1) + elide_written_contents(m.group(2), superseded_writes) + m.group(3),
+                model_output)
+
+        tool_calls = step.tool_calls
+        if tool_calls:
+            # In full mode the code is already in the assistant message
+            arguments = (elide_written_contents(code, superseded_writes) if summary_mode
+                         else "<code shown in the previous message>")
+            tool_calls = [ToolCall(name=tool_calls[0].name, arguments=arguments, id=tool_calls[0].id)] + tool_calls[1:]
+
+        observations = step.observations
+        if observations and len(observations) > self.max_output_chars:
+            # A later get_codebase call shows every file again
+            stale_reads = reads if codebase_later else reads & later_touched
+            if codebase or stale_reads:
+                shown = "the codebase" if codebase else ", ".join(sorted(stale_reads))
+                observations = (f"[Output elided: it showed the contents of {shown}, which later steps re-read "
+                                f"or changed. Use read_file to see the current contents.]")
+            else:
+                observations = truncate_middle(observations, self.max_output_chars)
+
+        return replace(step, model_output=model_output, tool_calls=tool_calls, observations=observations)
+
+    def write_messages(self, memory, summary_mode: bool = False) -> List[Dict]:
+        """Drop-in replacement for MultiStepAgent.write_memory_to_messages"""
+        steps = memory.steps
+        action_indices = [i for i, step in enumerate(steps) if isinstance(step, ActionStep)]
+        recent = set(action_indices[-self.keep_recent_steps:]) if self.keep_recent_steps > 0 else set()
+        last_planning = max((i for i, step in enumerate(steps) if isinstance(step, PlanningStep)), default=None)
+
+        # Walk backwards to know which files later steps touch
+        compacted: List[Tuple[int, object]] = []
+        later_touched = frozenset()
+        codebase_later = False
+        for i in range(len(steps) - 1, -1, -1):
+            step = steps[i]
+            if isinstance(step, PlanningStep) and i != last_planning:
+                continue
+            if isinstance(step, ActionStep):
+                code = step.tool_calls[0].arguments if step.tool_calls and isinstance(
+                    step.tool_calls[0].arguments, str) else ""
+                if i not in recent:
+                    step = self._compact_step(step, later_touched, codebase_later, summary_mode)
+                reads, writes, codebase = file_accesses(code)
+                later_touched = later_touched | reads | writes
+                codebase_later = codebase_later or codebase
+            compacted.append((i, step))
+        compacted.reverse()
+
+        messages = memory.system_prompt.to_messages(summary_mode=summary_mode)
+        rendered = [(i, step, step.to_messages(summary_mode=summary_mode)) for i, step in compacted]
+        total = estimate_tokens(messages) + sum(estimate_tokens(step_messages) for _, _, step_messages in rendered)
+
+        # Over the ceiling: drop the oldest action steps, never the task, plan or recent steps
+        dropped = 0
+        for index, (i, step, step_messages) in enumerate(rendered):
+            if total <= self.token_ceiling:
+                break
+            if isinstance(step, ActionStep) and i not in recent:
+                total -= estimate_tokens(step_messages)
+                rendered[index] = (i, step, [])
+                dropped += 1
+
+        note_added = dropped == 0
+        for i, step, step_messages in rendered:
+            messages.extend(step_messages)
+            if not note_added and isinstance(step, TaskStep):
+                messages.append({"role": MessageRole.USER, "content": [{"type": "text", "text": (
+                    f"[{dropped} earlier step(s) were omitted to keep the conversation short. Files they wrote "
+                    f"are on disk; use read_file to inspect them.]")}]})
+                note_added = True
+
+        logger.debug(f"Compacted memory of {len(steps)} steps to ~{total} tokens, dropped {dropped} step(s)")
+        return messages
+
+
+def use_compaction(agent, compactor: MemoryCompactor) -> None:
+    """Make a CodeAgent send compacted memory to its model"""
+    agent.write_memory_to_messages = lambda summary_mode=False: compactor.write_messages(agent.memory, summary_mode)
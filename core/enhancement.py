@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import uuid
+import logging
+import importlib
+import threading
+from typing import Any, Dict, List, Optional
+
+from core.compaction import truncate_middle
+from core.task_cache import embed, cosine
+
+logger = logging.getLogger(__name__)
+
+enhancement_backend = os.getenv('ENHANCEMENT_BACKEND', 'osmosis')
+enhancement_top_k = int(os.getenv('ENHANCEMENT_TOP_K', '3'))
+enhancement_min_similarity = float(os.getenv('ENHANCEMENT_MIN_SIMILARITY', '0.3'))
+knowledge_store_max_entries = int(os.getenv('KNOWLEDGE_STORE_MAX_ENTRIES', '500'))
+
+# Length of the summary kept per stored task
+SUMMARY_CHARS = 2000
+
+# Bump when the on-disk layout of the store changes
+STORE_VERSION = 1
+
+
+def summarize_turns(turns: List[Dict[str, Any]], max_chars: int = SUMMARY_CHARS) -> str:
+    """Short account of a task's turns: what each turn did and what came out of it"""
+    lines = []
+    for turn in turns:
+        if turn.get("result") is None:
+            continue
+        lines.append(f"{turn.get('memory', 'Turn')}: {truncate_middle(str(turn['result']), max_chars // 4)}")
+    return truncate_middle("\n".join(lines), max_chars)
+
+
+class KnowledgeStore:
+    """On-disk store of past tasks, searched by similarity of their queries
+
+    Holds a summary of each task's turns rather than the turns themselves, so
+    the store stays small. The oldest entries are dropped beyond max_entries.
+    """
+
+    def __init__(self, path: str, max_entries: int = knowledge_store_max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.RLock()
+        self.entries: List[Dict] = []
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get("version") == STORE_VERSION:
+                self.entries = data["entries"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error loading knowledge store {self.path}: {str(e)}")
+
+    def save(self) -> None:
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"version": STORE_VERSION, "entries": self.entries}, f)
+            os.replace(tmp_path, self.path)
+
+    def add(self, query: str, turns: List[Dict[str, Any]], success: Optional[bool] = None,
+            agent_type: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> str:
+        entry = {
+            "id": uuid.uuid4().hex[:12],
+            "query": query,
+            "vector": embed(query),
+            "summary": summarize_turns(turns),
+            "success": success,
+            "agent_type": agent_type,
+            "timestamp": time.time(),
+            "metadata": metadata or {},
+        }
+        with self.lock:
+            self.entries.append(entry)
+            del self.entries[:-max(1, self.max_entries)]
+            self.save()
+        return entry["id"]
+
+    def search(self, text: str, agent_type: Optional[str] = None, top_k: int = enhancement_top_k,
+               min_similarity: float = enhancement_min_similarity) -> List[Dict]:
+        """Most similar successful past tasks, best first, each with its "similarity" """
+        vector = embed(text)
+        with self.lock:
+            scored = [
+                (cosine(vector, entry["vector"]), entry) for entry in self.entries
+                if entry["success"] is not False and (agent_type is None or entry["agent_type"] == agent_type)
+            ]
+        scored = sorted((item for item in scored if item[0] >= min_similarity), key=lambda item: -item[0])
+        return [{**{k: v for k, v in entry.items() if k != "vector"}, "similarity": similarity}
+                for similarity, entry in scored[:top_k]]
+
+    def delete_by_intent(self, intent: str, similarity_threshold: float = 0.5) -> int:
+        vector = embed(intent)
+        with self.lock:
+            kept = [entry for entry in self.entries if cosine(vector, entry["vector"]) < similarity_threshold]
+            deleted = len(self.entries) - len(kept)
+            if deleted:
+                self.entries = kept
+                self.save()
+        return deleted
+
+
+def format_retrieved(entries: List[Dict]) -> str:
+    parts = []
+    for i, entry in enumerate(entries, 1):
+        parts.append(f"{i}. Past task ({entry['similarity']:.0%} similar): {entry['query']}\n{entry['summary']}")
+    return "\n\n".join(parts)
+
+
+class LocalEnhancer:
+    """Enhancement backend that works offline from the local knowledge store
+
+    Has the same methods and response format as OsmosisAPI.
+    """
+
+    def __init__(self, store: KnowledgeStore):
+        self.store = store
+
+    def enhance_task(self, input_text: str, context: Optional[Dict[str, str]] = None,
+                     agent_type: Optional[str] = None) -> Dict[str, Any]:
+        retrieved = self.store.search(input_text, agent_type)
+        if not retrieved:
+            return {"enhanced_response": input_text, "retrieved": []}
+        enhanced = f"{input_text}\n\nRelevant experience from similar past tasks:\n\n{format_retrieved(retrieved)}"
+        return {"enhanced_response": enhanced, "retrieved": [entry["id"] for entry in retrieved]}
+
+    def store_knowledge(self, query: str, turns: List[Dict[str, Any]], success: Optional[bool] = None,
+                        agent_type: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return {"status": "stored", "id": self.store.add(query, turns, success, agent_type, metadata)}
+
+    def delete_by_intent(self, intent: str, similarity_threshold: float = 0.5) -> Dict[str, Any]:
+        return {"deleted": self.store.delete_by_intent(intent, similarity_threshold)}
+
+
+class OsmosisEnhancer(LocalEnhancer):
+    """Enhancement backend using the remote Osmosis API, falling back to the local store
+
+    Every task is also kept in the local store. Osmosis gets the locally
+    retrieved summaries in the context next to what the caller sends, and when
+    Osmosis cannot be reached the local enhancement is used instead.
+    """
+
+    def __init__(self, store: KnowledgeStore, api=None):
+        super().__init__(store)
+        if api is None:
+            from core.osmosis_api import OsmosisAPI
+            api = OsmosisAPI()
+        self.api = api
+
+    def enhance_task(self, input_text: str, context: Optional[Dict[str, str]] = None,
+                     agent_type: Optional[str] = None) -> Dict[str, Any]:
+        retrieved = self.store.search(input_text, agent_type)
+        context = dict(context or {})
+        if retrieved:
+            context["retrieved"] = format_retrieved(retrieved)
+        try:
+            return self.api.enhance_task(input_text=input_text, context=context, agent_type=agent_type)
+        except Exception as e:
+            logger.error(f"Error enhancing task with Osmosis, using the local store: {str(e)}")
+            return super().enhance_task(input_text, context, agent_type)
+
+    def store_knowledge(self, query: str, turns: List[Dict[str, Any]], success: Optional[bool] = None,
+                        agent_type: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        stored = super().store_knowledge(query, turns, success, agent_type, metadata)
+        try:
+            return self.api.store_knowledge(query=query, turns=turns, success=success,
+                                            agent_type=agent_type, metadata=metadata)
+        except Exception as e:
+            logger.error(f"Error storing knowledge in Osmosis, kept locally only: {str(e)}")
+            return stored
+
+    def delete_by_intent(self, intent: str, similarity_threshold: float = 0.5) -> Dict[str, Any]:
+        super().delete_by_intent(intent, similarity_threshold)
+        return self.api.delete_by_intent(intent=intent, similarity_threshold=similarity_threshold)
+
+
+ENHANCEMENT_BACKENDS = {
+    "local": LocalEnhancer,
+    "osmosis": OsmosisEnhancer,
+}
+
+
+def make_enhancer(backend: str, store: KnowledgeStore):
+    """Create the enhancement backend named by ENHANCEMENT_BACKEND
+
+    Args:
+        backend: "local", "osmosis" or "package.module:ClassName" of a class taking the store
+        store: Local knowledge store
+
+    Returns:
+        Object with enhance_task, store_knowledge and delete_by_intent
+    """
+    if backend in ENHANCEMENT_BACKENDS:
+        cls = ENHANCEMENT_BACKENDS[backend]
+    else:
+        module_name, _, class_name = backend.partition(":")
+        cls = getattr(importlib.import_module(module_name), class_name)
+    if cls is OsmosisEnhancer and not os.getenv('OSMOSIS_API_KEY'):
+        logger.warning("OSMOSIS_API_KEY is not set, using the local enhancement backend")
+        cls = LocalEnhancer
+    return cls(store)
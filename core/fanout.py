@@ -0,0 +1,179 @@
+import os
+import re
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Set
+
+from core.workspace import Workspace
+
+logger = logging.getLogger(__name__)
+
+fanout_workers = int(os.getenv('FANOUT_WORKERS', '4'))
+fanout_max_items = int(os.getenv('FANOUT_MAX_ITEMS', '8'))
+fanout_max_steps = int(os.getenv('FANOUT_MAX_STEPS', '10'))
+
+SPLIT_PROMPT = """
+Split this implementation plan into work items that different developers can implement at the same time.
+
+Rules:
+- Each work item owns a set of files; every file that is created or changed belongs to exactly one work item.
+- Files that need each other's new code to be written go into the same work item.
+- Use at most {max_items} work items, and a single work item if the plan cannot be split.
+- The instructions of a work item must be complete on their own: the developer only sees the overall plan and their item.
+
+Respond with only a JSON array, no other text:
+[{{"files": ["path/relative/to/project.py"], "instructions": "what to implement in these files"}}]
+
+Plan:
+{plan}
+
+Project files:
+{files}
+"""
+
+
+def parse_work_items(text: str) -> List[Dict]:
+    """Read the JSON array of work items from a model response, dropping malformed items"""
+    match = re.search(r"\[.*\]", text, re.DOTALL)
+    if match is None:
+        return []
+    try:
+        raw_items = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return []
+    items = []
+    for raw in raw_items if isinstance(raw_items, list) else []:
+        if not isinstance(raw, dict):
+            continue
+        files = [os.path.normpath(f) for f in raw.get("files", []) if isinstance(f, str) and f.strip()]
+        instructions = raw.get("instructions")
+        if files and isinstance(instructions, str) and instructions.strip():
+            items.append({"files": files, "instructions": instructions.strip()})
+    return items
+
+
+def merge_overlapping(items: List[Dict], max_items: int = fanout_max_items) -> List[Dict]:
+    """Combine work items that share files, then the smallest ones until at most max_items remain"""
+    merged = []
+    for item in items:
+        files = set(item["files"])
+        instructions = [item["instructions"]]
+        for other in [m for m in merged if m["files"] & files]:
+            files |= other["files"]
+            instructions = other["instructions"] + instructions
+            merged.remove(other)
+        merged.append({"files": files, "instructions": instructions})
+    while len(merged) > max(1, max_items):
+        merged.sort(key=lambda m: len(m["files"]))
+        first, second = merged.pop(0), merged.pop(0)
+        merged.append({"files": first["files"] | second["files"],
+                       "instructions": first["instructions"] + second["instructions"]})
+    return [{"files": sorted(m["files"]), "instructions": "\n\n".join(m["instructions"])} for m in merged]
+
+
+def split_plan(plan: str, files: List[str], model: Callable[[str], str],
+               max_items: int = fanout_max_items) -> List[Dict]:
+    """Ask the model to split a plan into independent file-level work items
+
+    Args:
+        plan: Implementation plan from generate_plan
+        files: Paths of the project's files, relative to the playground
+        model: Function taking a prompt and returning the model's text response
+        max_items: Maximum number of work items
+
+    Returns:
+        List of {"files", "instructions"} with no file in two items
+    """
+    response = model(SPLIT_PROMPT.format(plan=plan, files="\n".join(files), max_items=max_items))
+    return merge_overlapping(parse_work_items(response), max_items)
+
+
+def run_work_items(items: List[Dict], base: str, workdir: str,
+                   run_item: Callable[[Dict, Workspace, Set[str]], str], workers: int = fanout_workers) -> List[Dict]:
+    """Run every work item on its own workspace of base, in parallel
+
+    Args:
+        items: Work items from split_plan
+        base: Playground the workspaces are created from
+        workdir: Directory for the workspaces
+        run_item: Implements one item in the given workspace, adding the paths it writes to the given set,
+            and returns a summary
+        workers: Number of items run at the same time
+
+    Returns:
+        One outcome per item with its workspace, the paths written, output, error and duration
+    """
+    outcomes = [{"item": item, "workspace": Workspace.create(base, os.path.join(workdir, f"item_{i}")),
+                 "written": set()}
+                for i, item in enumerate(items)]
+
+    def run(outcome):
+        started = time.time()
+        try:
+            outcome["output"] = run_item(outcome["item"], outcome["workspace"], outcome["written"])
+            outcome["error"] = None
+        except Exception as e:
+            logger.error(f"Error implementing {outcome['item']['files']}: {str(e)}")
+            outcome["output"] = None
+            outcome["error"] = f"{type(e).__name__}: {str(e)}"
+        outcome["duration"] = round(time.time() - started, 3)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="fanout") as executor:
+        list(executor.map(run, outcomes))
+    return outcomes
+
+
+def merge_workspaces(outcomes: List[Dict], discard: bool = True) -> Dict:
+    """Commit the workspaces of the work items back to their base
+
+    Only the paths an item wrote through its tools are merged, when the
+    outcome records them ("written"); other changes in its workspace are
+    left out and reported as stray. Paths written outside an item's own
+    files are merged but reported as unplanned. A file changed by more than
+    one item, or changed in the base while the items ran, is a conflict: it
+    is left out of the merge and reported with the diff of each competing
+    version.
+
+    Returns:
+        dict: "applied" changes ({"path", "status", "item"}), "conflicts" ({"path", "items", "diff"}),
+        "unplanned" and "stray" paths ({"path", "item"})
+    """
+    owners: Dict[str, List[int]] = {}
+    unplanned = []
+    stray = []
+    for i, outcome in enumerate(outcomes):
+        changes = outcome["workspace"].diff()
+        written = outcome.get("written")
+        if written is not None:
+            stray.extend({"path": change["path"], "item": i} for change in changes if change["path"] not in written)
+            changes = [change for change in changes if change["path"] in written]
+            own_files = set(outcome["item"]["files"])
+            unplanned.extend({"path": path, "item": i} for path in sorted(written - own_files))
+        outcome["changes"] = changes
+        for change in outcome["changes"]:
+            owners.setdefault(change["path"], []).append(i)
+    for entry in stray:
+        logger.warning(f"Work item {entry['item']} changed {entry['path']} without its tools; not merged")
+    contested = {path for path, items in owners.items() if len(items) > 1}
+
+    applied = []
+    conflicts = []
+    for i, outcome in enumerate(outcomes):
+        workspace = outcome["workspace"]
+        paths = [change["path"] for change in outcome["changes"] if change["path"] not in contested]
+        if paths:
+            committed, base_conflicts = workspace.commit(paths=paths)
+            applied.extend({**change, "item": i} for change in committed)
+            conflicts.extend({"path": path, "items": [i], "diff": workspace.diff_text([path])}
+                             for path in base_conflicts)
+    for path in sorted(contested):
+        conflicts.append({"path": path, "items": owners[path],
+                          "diff": "".join(outcomes[i]["workspace"].diff_text([path]) for i in owners[path])})
+
+    if discard:
+        for outcome in outcomes:
+            outcome["workspace"].discard()
+    logger.info(f"Merged {len(applied)} change(s) from {len(outcomes)} work items, {len(conflicts)} conflict(s)")
+    return {"applied": applied, "conflicts": conflicts, "unplanned": unplanned, "stray": stray}
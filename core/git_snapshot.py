@@ -0,0 +1,143 @@
+import os
+import hashlib
+import logging
+import subprocess
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+use_git_snapshots = os.getenv('USE_GIT_SNAPSHOTS', 'true').lower() == 'true'
+
+# Seconds before a git command is given up on
+GIT_TIMEOUT = 30
+
+# Length of the diff shown in the changed-since-HEAD view
+MAX_CHANGES_CHARS = 20000
+
+# Index entries that are not regular files: symlinks and submodules
+SKIPPED_MODES = {"120000", "160000"}
+
+
+def git_blob_id(data: bytes) -> str:
+    """Object id git gives a blob with this content"""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def file_blob_id(path: str) -> Optional[str]:
+    """Git blob id of a file's current content, None if it cannot be read"""
+    try:
+        with open(path, 'rb') as f:
+            return git_blob_id(f.read())
+    except OSError:
+        return None
+
+
+def _split(output: bytes) -> list:
+    return [item.decode('utf-8', 'surrogateescape') for item in output.split(b"\0") if item]
+
+
+class GitTree:
+    """Files of a git checkout, listed from the git index and keyed by blob id
+
+    Tracked files that are unchanged since they were staged take their blob id
+    from the index without being read; only modified and untracked files are
+    hashed. Untracked files are listed unless git ignores them, so the
+    checkout's own ignore rules apply.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @staticmethod
+    def is_checkout(root: str) -> bool:
+        """Whether the root is the top of a git work tree
+
+        A directory inside some other repository does not count: that
+        repository may ignore it (the playground usually sits ignored in the
+        app's own checkout), and its index would then list none of its files.
+        """
+        try:
+            result = subprocess.run(["git", "-C", root, "rev-parse", "--show-toplevel"],
+                                    capture_output=True, timeout=GIT_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired):
+            return False
+        if result.returncode != 0:
+            return False
+        top_level = result.stdout.decode('utf-8', 'surrogateescape').strip()
+        return os.path.realpath(top_level) == os.path.realpath(root)
+
+    def _git(self, *args: str) -> bytes:
+        return subprocess.run(["git", "-C", self.root, *args], capture_output=True, check=True,
+                              timeout=GIT_TIMEOUT).stdout
+
+    def files(self) -> Dict[str, str]:
+        """Path relative to the root -> blob id, for every tracked or untracked file that is not ignored
+
+        Raises:
+            subprocess.CalledProcessError: If git fails
+        """
+        blobs = {}
+        for entry in _split(self._git("ls-files", "-z", "--stage")):
+            info, _, rel_path = entry.partition("\t")
+            mode, sha, _ = info.split(" ")
+            if mode not in SKIPPED_MODES:
+                # During a merge the last stage listed wins; the file is hashed below anyway
+                blobs[os.path.normpath(rel_path)] = sha
+
+        modified, deleted = set(), set()
+        for entry in _split(self._git("ls-files", "-z", "-t", "--modified", "--deleted", "--others",
+                                      "--exclude-standard")):
+            tag, rel_path = entry[:1], os.path.normpath(entry[2:])
+            if tag == "R":
+                deleted.add(rel_path)
+            else:
+                # "C" for modified, "?" for untracked
+                modified.add(rel_path)
+        for rel_path in deleted:
+            blobs.pop(rel_path, None)
+        for rel_path in modified - deleted:
+            sha = file_blob_id(os.path.join(self.root, rel_path))
+            if sha is not None:
+                blobs[rel_path] = sha
+            else:
+                blobs.pop(rel_path, None)
+        return blobs
+
+    def blob_ids(self, rel_paths: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Current blob id of some files, None for missing ones, hashing them directly"""
+        return {rel_path: file_blob_id(os.path.join(self.root, rel_path)) for rel_path in rel_paths}
+
+    def has_head(self) -> bool:
+        try:
+            self._git("rev-parse", "--verify", "--quiet", "HEAD")
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def changes_since_head(self, max_chars: int = MAX_CHANGES_CHARS) -> str:
+        """Files changed since the last commit, staged or not, with their diff
+
+        Raises:
+            subprocess.CalledProcessError: If git fails
+        """
+        untracked = _split(self._git("ls-files", "-z", "--others", "--exclude-standard"))
+        if not self.has_head():
+            tracked = _split(self._git("ls-files", "-z"))
+            lines = [f"A\t{path}" for path in tracked] + [f"?\t{path}" for path in untracked]
+            return "No commits yet; every file is new.\n" + "\n".join(lines)
+
+        status = _split(self._git("diff", "--relative", "-z", "--name-status", "HEAD"))
+        # -z output alternates status and path
+        lines = [f"{status[i]}\t{status[i + 1]}" for i in range(0, len(status) - 1, 2)]
+        lines.extend(f"?\t{path}" for path in untracked)
+        if not lines:
+            return "No changes since HEAD."
+        diff = self._git("diff", "--relative", "HEAD").decode('utf-8', 'replace')
+        if len(diff) > max_chars:
+            diff = diff[:max_chars] + "\n... (diff cut off)\n"
+        text = "Changed since HEAD (A added, M modified, D deleted, ? untracked):\n" + "\n".join(lines)
+        if diff:
+            text += f"\n\n```diff\n{diff}```"
+        if untracked:
+            text += "\n\nUntracked files are not in the diff; use read_file to see them."
+        return text
@@ -0,0 +1,190 @@
+import os
+import logging
+import functools
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from portkey_ai import Portkey
+
+logger = logging.getLogger(__name__)
+
+use_shared_http_client = os.getenv('USE_SHARED_HTTP_CLIENT', 'true').lower() == 'true'
+use_http2 = os.getenv('USE_HTTP2', 'true').lower() == 'true'
+http_max_connections = int(os.getenv('HTTP_MAX_CONNECTIONS', '20'))
+http_keepalive_seconds = float(os.getenv('HTTP_KEEPALIVE_SECONDS', '120'))
+use_connection_prewarm = os.getenv('USE_CONNECTION_PREWARM', 'true').lower() == 'true'
+prewarm_connections = int(os.getenv('PREWARM_CONNECTIONS', '2'))
+portkey_base_url = os.getenv('PORTKEY_BASE_URL', "https://api.portkey.ai/v1")
+
+# Seconds to set up a connection; reading a completion may take minutes and is bounded per call by the SDK
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 600
+
+# httpcore trace events marking a new connection and a TLS handshake
+NEW_CONNECTION_EVENT = "connection.connect_tcp.complete"
+TLS_HANDSHAKE_EVENT = "connection.start_tls.complete"
+
+# Request extensions marking the pre-warming requests, which are kept out of the request counters,
+# and holding the trace events seen by a request until its response arrives
+PREWARM_EXTENSION = "multiagent_prewarm"
+TRACE_STATE_EXTENSION = "multiagent_trace_state"
+
+
+class PoolMetrics:
+    """Counters of the shared client's requests and the connections they opened
+
+    Requests are counted when their response arrives, so failed attempts
+    are left out. Pre-warming requests only count as prewarmed_connections,
+    so reused_connections is the number of model calls that found a
+    connection in the pool, pre-warmed or left by an earlier call.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "new_connections": 0, "tls_handshakes": 0, "http2_responses": 0,
+                       "prewarmed_connections": 0}
+
+    def add(self, name: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counts[name] += amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            counts = dict(self.counts)
+        counts["reused_connections"] = max(0, counts["requests"] - counts["new_connections"])
+        return counts
+
+
+_metrics = PoolMetrics()
+_client: Optional[httpx.Client] = None
+_portkey_clients: Dict[Tuple[Optional[str], Optional[str]], Portkey] = {}
+_lock = threading.Lock()
+
+
+def _trace(state: Dict, event_name: str, info: Dict) -> None:
+    if event_name == NEW_CONNECTION_EVENT:
+        state["new_connection"] = True
+    elif event_name == TLS_HANDSHAKE_EVENT:
+        state["tls_handshake"] = True
+
+
+def _on_request(request: httpx.Request) -> None:
+    # What happened on the way to this request's response; counted once the response arrives
+    state = {"new_connection": False, "tls_handshake": False}
+    request.extensions[TRACE_STATE_EXTENSION] = state
+    request.extensions["trace"] = functools.partial(_trace, state)
+
+
+def _on_response(response: httpx.Response) -> None:
+    state = response.request.extensions.get(TRACE_STATE_EXTENSION, {})
+    if response.request.extensions.get(PREWARM_EXTENSION):
+        if state.get("new_connection"):
+            _metrics.add("prewarmed_connections")
+        return
+    _metrics.add("requests")
+    if state.get("new_connection"):
+        _metrics.add("new_connections")
+    if state.get("tls_handshake"):
+        _metrics.add("tls_handshakes")
+    if response.http_version == "HTTP/2":
+        _metrics.add("http2_responses")
+
+
+@functools.lru_cache(maxsize=None)
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("h2 is not installed, the shared HTTP client falls back to HTTP/1.1")
+        return False
+
+
+def get_http_client() -> Optional[httpx.Client]:
+    """The process's HTTP client shared by all Portkey clients, or None if sharing is disabled
+
+    One connection pool with keep-alive serves every Portkey client, so a
+    connection opened for one stage or provider is reused by the next call
+    instead of paying DNS, TCP and TLS setup again. With HTTP/2 (which needs
+    the h2 package) concurrent calls are multiplexed over one connection.
+    """
+    global _client
+    if not use_shared_http_client:
+        return None
+    with _lock:
+        if _client is None:
+            _client = httpx.Client(
+                http2=use_http2 and _http2_available(),
+                limits=httpx.Limits(max_connections=http_max_connections,
+                                    max_keepalive_connections=http_max_connections,
+                                    keepalive_expiry=http_keepalive_seconds),
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                event_hooks={"request": [_on_request], "response": [_on_response]},
+            )
+        return _client
+
+
+def portkey_client(api_key: Optional[str] = None, virtual_key: Optional[str] = None) -> Portkey:
+    """Portkey client for a virtual key, shared by every caller and using the shared HTTP client
+
+    Args:
+        api_key: Portkey API key; PORTKEY_API_KEY by default
+        virtual_key: Portkey virtual key of the provider account
+
+    Returns:
+        The same client for the same keys on every call
+    """
+    api_key = api_key if api_key is not None else os.getenv("PORTKEY_API_KEY")
+    http_client = get_http_client()
+    with _lock:
+        client = _portkey_clients.get((api_key, virtual_key))
+        if client is None:
+            if http_client is not None:
+                client = Portkey(api_key=api_key, virtual_key=virtual_key, http_client=http_client)
+            else:
+                client = Portkey(api_key=api_key, virtual_key=virtual_key)
+            _portkey_clients[(api_key, virtual_key)] = client
+        return client
+
+
+def _open_connection(client: httpx.Client, url: str) -> None:
+    try:
+        # Any answer will do; the point is the connection left in the pool
+        client.head(url, extensions={PREWARM_EXTENSION: True})
+    except httpx.HTTPError as e:
+        logger.debug(f"Pre-warming a connection to {url} failed: {str(e)}")
+
+
+def prewarm(url: str = portkey_base_url, connections: int = prewarm_connections) -> None:
+    """Open connections to the gateway in the background so the first model call finds one ready
+
+    Returns at once; DNS, TCP and TLS setup happen while the user is still
+    typing. One connection is enough with HTTP/2, which multiplexes calls.
+
+    Args:
+        url: URL on the host to connect to
+        connections: Connections to open with HTTP/1.1
+    """
+    client = get_http_client()
+    if client is None or not use_connection_prewarm:
+        return
+    if use_http2 and _http2_available():
+        connections = 1
+    for index in range(max(1, min(connections, http_max_connections))):
+        threading.Thread(target=_open_connection, args=(client, url), name=f"http-prewarm-{index}",
+                         daemon=True).start()
+
+
+def pool_metrics() -> Dict[str, int]:
+    """Requests sent through the shared client and how many of them needed a new connection
+
+    reused_connections counts requests served by a connection already in the
+    pool; open_connections is the pool's current size when it can be read.
+    """
+    counts = _metrics.snapshot()
+    pool = getattr(getattr(_client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is not None:
+        counts["open_connections"] = len(connections)
+    return counts
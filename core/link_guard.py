@@ -0,0 +1,92 @@
+import io
+import os
+import sys
+import stat
+import uuid
+import runpy
+import shutil
+import logging
+import builtins
+import threading
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# Write access flags of os.open
+WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_APPEND | os.O_TRUNC
+
+# Project roots whose hardlinked files are copied up before being written, as real paths
+_roots: List[str] = []
+_lock = threading.Lock()
+_original_open = builtins.open
+_original_os_open = os.open
+
+
+def copy_up(path: str) -> os.stat_result:
+    """Replace a hardlinked file by a private copy with the same contents and times"""
+    temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        shutil.copy2(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return os.stat(path)
+
+
+def _break_link(file) -> None:
+    if not isinstance(file, (str, bytes, os.PathLike)):
+        # A file descriptor
+        return
+    path = os.path.realpath(os.fsdecode(file))
+    if not any(path.startswith(root + os.sep) for root in _roots):
+        return
+    try:
+        info = os.stat(path)
+    except OSError:
+        return
+    if stat.S_ISREG(info.st_mode) and info.st_nlink > 1:
+        try:
+            copy_up(path)
+        except OSError as e:
+            logger.warning(f"Could not copy up {path} before writing it: {str(e)}")
+
+
+def _open(file, mode='r', *args, **kwargs):
+    if any(char in mode for char in "wax+"):
+        _break_link(file)
+    return _original_open(file, mode, *args, **kwargs)
+
+
+def _os_open(path, flags, *args, **kwargs):
+    if flags & WRITE_FLAGS and kwargs.get("dir_fd") is None:
+        _break_link(path)
+    return _original_os_open(path, flags, *args, **kwargs)
+
+
+def guard_links(root: str) -> None:
+    """Copy hardlinked files under root up before this process opens them for writing
+
+    A copy-on-write workspace shares its unchanged files with its base
+    through hardlinks, so writing one in place would change both. Once
+    guarded, a write through open, io.open (and so pathlib) or os.open first
+    gives the file its own copy; only the files actually written are copied.
+    Applies to the base as much as to its workspaces.
+    """
+    root = os.path.realpath(root)
+    with _lock:
+        if root not in _roots:
+            _roots.append(root)
+        builtins.open = io.open = _open
+        os.open = _os_open
+
+
+if __name__ == "__main__":
+    # python link_guard.py <root> -m <module> [args]: run a module, such as pytest, with root guarded
+    guarded_root, _, module, *module_args = sys.argv[1:]
+    guard_links(guarded_root)
+    # As with python -m, imports start from the working directory rather than this file's
+    sys.path[0] = os.getcwd()
+    sys.argv = [module, *module_args]
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
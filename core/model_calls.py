@@ -0,0 +1,145 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+from core.rate_limit import get_rate_limiter
+from core.profiling import timer
+
+# Bounds the number of model calls in flight. Batch workers install a
+# semaphore shared by all worker processes; otherwise calls are not limited.
+_call_limiter = None
+
+# Set to abandon the model calls of the current run; see call_model
+_cancel_event = None
+_cancellable_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="model-call")
+
+# Seconds between checks of the cancel event while a call is in flight
+CANCEL_POLL_SECONDS = 0.2
+
+# Totals for this process
+_usage_lock = threading.Lock()
+_usage = {"model_calls": 0, "input_tokens": 0, "output_tokens": 0}
+
+
+def set_call_limiter(semaphore) -> None:
+    """Limit concurrent model calls with a threading or multiprocessing semaphore (None to disable)"""
+    global _call_limiter
+    _call_limiter = semaphore
+
+
+@contextmanager
+def model_call_slot():
+    """Hold one of the limited model call slots for the duration of a call"""
+    limiter = _call_limiter
+    if limiter is None:
+        yield
+        return
+    limiter.acquire()
+    try:
+        yield
+    finally:
+        limiter.release()
+
+
+class RunCancelled(Exception):
+    """Raised in place of a model call's result once the run has been cancelled"""
+
+
+def set_cancel_event(event) -> None:
+    """Make model calls cancellable through a threading.Event (None to disable)"""
+    global _cancel_event
+    _cancel_event = event
+
+
+def check_cancelled() -> None:
+    if _cancel_event is not None and _cancel_event.is_set():
+        raise RunCancelled("The run was cancelled")
+
+
+def _wait_or_cancel(seconds: float) -> None:
+    event = _cancel_event
+    if event is None:
+        time.sleep(seconds)
+    else:
+        event.wait(seconds)
+        check_cancelled()
+
+
+def _used_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    return (usage.prompt_tokens or 0) + (usage.completion_tokens or 0)
+
+
+def call_model(fn: Callable[[], Any], model: Optional[str] = None, virtual_key: Optional[str] = None,
+               provider: Optional[str] = None, tokens: int = 0) -> Any:
+    """Make a model call in one of the limited slots
+
+    With a model given, the call first waits for budget from the host-wide
+    rate limiter (see core.rate_limit), before taking a slot so waiting calls
+    don't hold one; the reserved tokens are corrected with the response's usage.
+
+    With a cancel event installed the call runs in a helper thread and the
+    caller returns with RunCancelled as soon as the event is set. Python threads
+    cannot be interrupted, so the abandoned request finishes in the background
+    and its result is discarded. Its reserved tokens stay taken from the rate
+    limit buckets, but its model call slot is freed at once, so the limit on
+    calls in flight may briefly be exceeded by abandoned requests.
+
+    Args:
+        fn: Makes the request and returns the response
+        model: Model id of the request, for rate limiting
+        virtual_key: Portkey virtual key the request is made with
+        provider: Provider of the model
+        tokens: Estimated tokens of the request, see core.rate_limit.estimate_tokens
+    """
+    limiter = get_rate_limiter() if model else None
+    with timer("model_call.rate_limit"):
+        reservation = limiter.acquire(model, virtual_key, provider, tokens, wait=_wait_or_cancel) if limiter else None
+    used_tokens = 0
+    try:
+        with timer("model_call"):
+            response = _call_in_slot(fn)
+        used_tokens = _used_tokens(response)
+        return response
+    except RunCancelled:
+        # The abandoned request is still running and will use its tokens; keep them reserved
+        used_tokens = None
+        raise
+    finally:
+        if reservation is not None:
+            reservation.settle(used_tokens)
+
+
+def _call_in_slot(fn: Callable[[], Any]) -> Any:
+    with model_call_slot():
+        event = _cancel_event
+        if event is None:
+            return fn()
+        check_cancelled()
+        future = _cancellable_executor.submit(fn)
+        while True:
+            try:
+                return future.result(timeout=CANCEL_POLL_SECONDS)
+            except FutureTimeoutError:
+                if event.is_set():
+                    future.cancel()
+                    raise RunCancelled("The run was cancelled")
+
+
+def record_usage(response) -> None:
+    """Add the token usage of a chat completion response to the process totals"""
+    usage = getattr(response, "usage", None)
+    with _usage_lock:
+        _usage["model_calls"] += 1
+        if usage is not None:
+            _usage["input_tokens"] += usage.prompt_tokens or 0
+            _usage["output_tokens"] += usage.completion_tokens or 0
+
+
+def usage_totals() -> Dict[str, int]:
+    with _usage_lock:
+        return dict(_usage)
@@ -4,17 +4,21 @@ import requests
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 from dotenv import load_dotenv
+from core.payloads import compress_body, encode_turns, default_registry, payload_compression, use_delta_payloads
 # Load environment variables
 load_dotenv()
 
 class OsmosisAPI:
     """Client for interacting with the Osmosis Agent Improvement API"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, compression: str = payload_compression,
+                 delta_encoding: bool = use_delta_payloads):
         """Initialize the Osmosis API client
         
         Args:
             api_key: Optional API key. If not provided, will look for OSMOSIS_API_KEY env var
+            compression: Request body compression, "gzip", "zstd" or "none"
+            delta_encoding: Whether to delta-encode stored turns and upload large texts once by hash
         """
         self.api_key = api_key or os.getenv('OSMOSIS_API_KEY')
         if not self.api_key:
@@ -25,6 +29,19 @@ class OsmosisAPI:
             "Content-Type": "application/json",
             "x-api-key": self.api_key
         }
+        self.compression = compression
+        self.delta_encoding = delta_encoding
+        self.blob_registry = default_registry() if delta_encoding else None
+
+    def _post_json(self, path: str, payload: Dict[str, Any]) -> requests.Response:
+        """POST a JSON payload, compressing the body if configured"""
+        body, encoding = compress_body(json.dumps(payload).encode('utf-8'), self.compression)
+        headers = dict(self.headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        response = requests.post(f"{self.base_url}{path}", headers=headers, data=body)
+        response.raise_for_status()
+        return response
 
     def enhance_task(self, input_text: str, context: Optional[Dict[str, str]] = None, 
                     agent_type: Optional[str] = None) -> Dict[str, Any]:
@@ -45,12 +62,7 @@ class OsmosisAPI:
             "agent_type": agent_type
         }
         
-        response = requests.post(
-            f"{self.base_url}/enhance_task",
-            headers=self.headers,
-            json=payload
-        )
-        response.raise_for_status()
+        response = self._post_json("/enhance_task", payload)
         result = response.json()['response']
         return result
 
@@ -79,13 +91,16 @@ class OsmosisAPI:
             "timestamp": datetime.utcnow().isoformat() + "Z",
             "metadata": metadata or {}
         }
+        blobs = {}
+        if self.delta_encoding:
+            # Turn inputs repeat the system prompt and history; send each large text once
+            payload["turns"], blobs = encode_turns(turns, self.blob_registry, self.base_url)
+            payload["turn_encoding"] = "delta"
+            payload["blobs"] = blobs
         
-        response = requests.post(
-            f"{self.base_url}/store_knowledge",
-            headers=self.headers,
-            json=payload
-        )
-        response.raise_for_status()
+        response = self._post_json("/store_knowledge", payload)
+        if blobs:
+            self.blob_registry.mark_uploaded(self.base_url, list(blobs))
         return response.json()
 
     def delete_by_intent(self, intent: str, 
@@ -0,0 +1,185 @@
+import os
+import gzip
+import json
+import zlib
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+payload_compression = os.getenv('PAYLOAD_COMPRESSION', 'none').lower()
+use_delta_payloads = os.getenv('USE_DELTA_PAYLOADS', 'false').lower() == 'true'
+blob_min_chars = int(os.getenv('BLOB_MIN_CHARS', '4096'))
+
+# Hashes remembered per destination; the oldest are forgotten and simply uploaded again
+MAX_REGISTERED_BLOBS = 10000
+
+BLOB_PREFIX = "blob:sha256:"
+
+
+def compress_body(body: bytes, method: str = payload_compression) -> Tuple[bytes, Optional[str]]:
+    """Compress a request body
+
+    Args:
+        body: Encoded request body
+        method: "gzip", "zstd" or "none"; zstd needs the zstandard package and falls back to gzip
+
+    Returns:
+        (body, value for the Content-Encoding header or None if not compressed)
+    """
+    if method == "zstd":
+        try:
+            import zstandard
+            return zstandard.ZstdCompressor(level=3).compress(body), "zstd"
+        except ImportError:
+            logger.warning("zstandard is not installed, compressing with gzip")
+            method = "gzip"
+    if method == "gzip":
+        return gzip.compress(body, compresslevel=6), "gzip"
+    return body, None
+
+
+def blob_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8', 'replace')).hexdigest()
+
+
+class BlobRegistry:
+    """Hashes of the blobs already uploaded to each destination, kept on disk"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.uploaded: Dict[str, List[str]] = {}
+        try:
+            with open(path, 'r') as f:
+                self.uploaded = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error loading blob registry {path}: {str(e)}")
+
+    def is_uploaded(self, destination: str, sha: str) -> bool:
+        return sha in self.uploaded.get(destination, ())
+
+    def mark_uploaded(self, destination: str, hashes: List[str]) -> None:
+        if not hashes:
+            return
+        with self.lock:
+            known = self.uploaded.setdefault(destination, [])
+            known.extend(sha for sha in hashes if sha not in known)
+            del known[:-MAX_REGISTERED_BLOBS]
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.uploaded, f)
+            os.replace(tmp_path, self.path)
+
+
+# One registry per file, so clients in the same process don't overwrite each other's hashes
+_registries: Dict[str, BlobRegistry] = {}
+
+
+def default_registry() -> BlobRegistry:
+    """Blob registry in the cache directory"""
+    path = os.path.join(os.getenv('CACHE_PATH', ".cache/multiagent_coding/"), "uploaded_blobs.json")
+    if path not in _registries:
+        _registries[path] = BlobRegistry(path)
+    return _registries[path]
+
+
+def _common_prefix_length(a: str, b: str) -> int:
+    limit = min(len(a), len(b))
+    low, high = 0, limit
+    # Binary search on slice equality is far faster than a per-character loop in Python
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def split_blobs(text: str, target_chars: int) -> List[str]:
+    """Split a text into pieces of roughly target_chars at content-defined line boundaries
+
+    A piece ends after a line whose checksum hits a fixed pattern, so the same
+    content is cut in the same places wherever it appears in a text, and the
+    pieces of a repeated system prompt or codebase get the same hashes.
+    """
+    pieces = []
+    current = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        current.append(line)
+        size += len(line)
+        boundary = size >= target_chars // 4 and zlib.crc32(line.encode('utf-8', 'replace')) % 8 == 0
+        if boundary or size >= target_chars * 4:
+            pieces.append("".join(current))
+            current, size = [], 0
+    if current:
+        pieces.append("".join(current))
+    return pieces
+
+
+def encode_turns(turns: List[Dict[str, Any]], registry: BlobRegistry, destination: str,
+                 min_blob_chars: int = blob_min_chars) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+    """Delta-encode turn inputs and replace large texts with content hashes
+
+    The "inputs" of each turn become {"prefix": n, "text": rest}: the first n
+    characters are the same as the previous turn's inputs. Any remaining text
+    of at least min_blob_chars is split into blobs (see split_blobs) and
+    replaced by "blob:sha256:<hash>,<hash>,...". Only blobs the destination
+    has not received yet are returned for upload.
+
+    Returns:
+        (encoded turns, {hash: text} of the blobs to upload with them)
+    """
+    blobs: Dict[str, str] = {}
+
+    def intern(value: Any) -> Any:
+        if not isinstance(value, str) or len(value) < min_blob_chars:
+            return value
+        hashes = []
+        for piece in split_blobs(value, min_blob_chars):
+            sha = blob_hash(piece)
+            if not registry.is_uploaded(destination, sha):
+                blobs[sha] = piece
+            hashes.append(sha)
+        return BLOB_PREFIX + ",".join(hashes)
+
+    encoded = []
+    previous = ""
+    for turn in turns:
+        turn = dict(turn)
+        inputs = turn.get("inputs")
+        if isinstance(inputs, str):
+            prefix = _common_prefix_length(previous, inputs)
+            turn["inputs"] = {"prefix": prefix, "text": intern(inputs[prefix:])}
+            previous = inputs
+        for key in ("decision", "result"):
+            turn[key] = intern(turn.get(key))
+        encoded.append(turn)
+    return encoded, blobs
+
+
+def decode_turns(encoded: List[Dict[str, Any]], blobs: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Reverse encode_turns, given every blob the turns refer to"""
+    def resolve(value: Any) -> Any:
+        if isinstance(value, str) and value.startswith(BLOB_PREFIX):
+            return "".join(blobs[sha] for sha in value[len(BLOB_PREFIX):].split(","))
+        return value
+
+    turns = []
+    previous = ""
+    for turn in encoded:
+        turn = dict(turn)
+        if isinstance(turn.get("inputs"), dict):
+            previous = previous[:turn["inputs"]["prefix"]] + resolve(turn["inputs"]["text"])
+            turn["inputs"] = previous
+        for key in ("decision", "result"):
+            turn[key] = resolve(turn.get(key))
+        turns.append(turn)
+    return turns
@@ -1,69 +1,81 @@
 import os
 from dotenv import load_dotenv
-from portkey_ai import Portkey
+from core.http_transport import portkey_client
+from core.model_calls import call_model, record_usage
+from core.portkey_failover import provider_for_model
+from core.rate_limit import estimate_tokens
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Portkey clients
-portkey_anthropic = Portkey(
+# Initialize Portkey clients; they share one HTTP connection pool with PortkeyModel
+portkey_anthropic = portkey_client(
     api_key=os.getenv("PORTKEY_API_KEY"),
     virtual_key=os.getenv("PORTKEY_VIRTUAL_KEY_ANTHROPIC")
 )
 
-portkey_openai = Portkey(
+portkey_openai = portkey_client(
     api_key=os.getenv("PORTKEY_API_KEY"),
     virtual_key=os.getenv("PORTKEY_VIRTUAL_KEY_OPENAI")
 )
 
-portkey_google = Portkey(
+portkey_google = portkey_client(
     api_key=os.getenv("PORTKEY_API_KEY"),
     virtual_key=os.getenv("PORTKEY_VIRTUAL_KEY_GOOGLE")
 )
 
+def _complete(client, **kwargs):
+    """Run a chat completion within the model concurrency and rate limits and return the message text"""
+    completion = call_model(lambda: client.chat.completions.create(**kwargs),
+                            model=kwargs["model"], virtual_key=getattr(client, "virtual_key", None),
+                            provider=provider_for_model(kwargs["model"]),
+                            tokens=estimate_tokens(kwargs["messages"], kwargs.get("max_tokens")))
+    record_usage(completion)
+    return completion.choices[0].message.content
+
 def claude35sonnet(prompt):
     """Wrapper function for Claude 3.5 Sonnet"""
-    completion = portkey_anthropic.chat.completions.create(
+    return _complete(
+        portkey_anthropic,
         messages=[{"role": "user", "content": prompt}],
         model="claude-3-5-sonnet-latest",
         max_tokens=8192
     )
-    return completion.choices[0].message.content
 
 def gpt4o(prompt):
     """Wrapper function for GPT-4"""
-    completion = portkey_openai.chat.completions.create(
+    return _complete(
+        portkey_openai,
         messages=[{"role": "user", "content": prompt}],
         model="gpt-4o",
         max_tokens=8192
     )
-    return completion.choices[0].message.content
 
 def gemini2pro(prompt):
     """Wrapper function for Gemini 2 Pro"""
-    completion = portkey_google.chat.completions.create(
+    return _complete(
+        portkey_google,
         messages=[{"role": "user", "content": prompt}],
         model="gemini-2.0-pro-exp-02-05",
         max_tokens=8192
     )
-    return completion.choices[0].message.content
 
 def gemini2flashthinking(prompt):
     """Wrapper function for Gemini 2 Flash Thinking"""
-    completion = portkey_google.chat.completions.create(
+    return _complete(
+        portkey_google,
         messages=[{"role": "user", "content": prompt}],
         model="gemini-2.0-flash-thinking-exp-01-21",
         max_tokens=8192
     )
-    return completion.choices[0].message.content
 
 def o3minihigh(prompt):
     """Wrapper function for o3-mini-high model"""
-    completion = portkey_openai.chat.completions.create(
+    return _complete(
+        portkey_openai,
         messages=[{"role": "user", "content": prompt}],
         model="o3-mini-2025-01-31"
     )
-    return completion.choices[0].message.content
 
 def test():
     # Test Claude 3.5 Sonnet
@@ -0,0 +1,311 @@
+import os
+import time
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from core.model_calls import RunCancelled
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Environment variables holding the Portkey virtual key of each provider
+PROVIDER_VIRTUAL_KEY_ENV = {
+    "anthropic": "PORTKEY_VIRTUAL_KEY_ANTHROPIC",
+    "openai": "PORTKEY_VIRTUAL_KEY_OPENAI",
+    "google": "PORTKEY_VIRTUAL_KEY_GOOGLE",
+}
+
+use_hedged_requests = os.getenv('PORTKEY_HEDGE_REQUESTS', 'false').lower() == 'true'
+hedge_percentile = float(os.getenv('PORTKEY_HEDGE_PERCENTILE', '0.95'))
+hedge_default_delay = float(os.getenv('PORTKEY_HEDGE_DEFAULT_DELAY', '60'))
+hedge_min_samples = int(os.getenv('PORTKEY_HEDGE_MIN_SAMPLES', '5'))
+hedge_workers = int(os.getenv('PORTKEY_HEDGE_WORKERS', '32'))
+circuit_failure_threshold = int(os.getenv('PORTKEY_CIRCUIT_FAILURES', '3'))
+circuit_reset_seconds = float(os.getenv('PORTKEY_CIRCUIT_RESET_SECONDS', '60'))
+
+
+def provider_for_model(model_id: str) -> Optional[str]:
+    """Guess the provider behind a model id from substrings of its name
+
+    Args:
+        model_id: Model identifier, e.g. "claude-3-5-sonnet-latest" or "gpt-4o"
+
+    Returns:
+        Provider name ("anthropic", "openai" or "google") or None if unknown
+    """
+    model_id = model_id.lower()
+    if "claude" in model_id:
+        return "anthropic"
+    if "gpt" in model_id or model_id.startswith(("o1", "o3")):
+        return "openai"
+    if "gemini" in model_id:
+        return "google"
+    return None
+
+
+def virtual_key_for_model(model_id: str) -> Optional[str]:
+    """Return the Portkey virtual key configured for the provider of a model"""
+    provider = provider_for_model(model_id)
+    if provider is None:
+        return None
+    return os.getenv(PROVIDER_VIRTUAL_KEY_ENV[provider])
+
+
+def fallback_models_from_env() -> List[str]:
+    """Read the fallback chain from PORTKEY_FALLBACK_MODELS (comma separated model ids)"""
+    return [m.strip() for m in os.getenv('PORTKEY_FALLBACK_MODELS', '').split(',') if m.strip()]
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies for one provider"""
+
+    def __init__(self, window: int = 100):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Return the q-th percentile latency or None if there are too few samples"""
+        with self.lock:
+            if len(self.samples) < hedge_min_samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[index]
+
+
+class CircuitBreaker:
+    """Per-provider circuit breaker
+
+    After `failure_threshold` consecutive failures the circuit opens and calls to
+    the provider are skipped for `reset_seconds`. After that a single trial call
+    is let through (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = circuit_failure_threshold,
+                 reset_seconds: float = circuit_reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Whether acquire would let a call through now, without taking the half-open trial"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            return self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds
+
+    def acquire(self) -> Optional[bool]:
+        """Let a call through if allowed
+
+        Returns:
+            None if no call may be attempted now, else whether the call is the
+            half-open trial, which must end in record_success, record_failure
+            or release_trial
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                return True
+            # Open, or half-open with a trial call already in flight
+            return None
+
+    def release_trial(self) -> None:
+        """Give back a trial call that was not made or whose outcome was discarded
+
+        The circuit returns to open with its original opening time, so the
+        next call may take the trial straight away.
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Opening circuit after %d failures", self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+# Shared across all PortkeyModel instances so every agent sees the same provider health
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[str, LatencyTracker] = {}
+_registry_lock = threading.Lock()
+# Only hedged calls run here; the others run in the caller's thread
+_executor = ThreadPoolExecutor(max_workers=max(2, hedge_workers), thread_name_prefix="portkey-hedge")
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    with _registry_lock:
+        return _breakers.setdefault(provider, CircuitBreaker())
+
+
+def get_latency_tracker(provider: str) -> LatencyTracker:
+    with _registry_lock:
+        return _latencies.setdefault(provider, LatencyTracker())
+
+
+def hedge_delay(provider: str) -> float:
+    """Seconds to wait on a call to `provider` before firing a backup request"""
+    delay = get_latency_tracker(provider).percentile(hedge_percentile)
+    return hedge_default_delay if delay is None else delay
+
+
+def _attempt(provider: str, fn: Callable[[], Any], trial: bool) -> Any:
+    """Make one call in this thread, recording its outcome on the provider's breaker"""
+    start = time.monotonic()
+    try:
+        result = fn()
+    except RunCancelled:
+        # Not the provider's fault; don't count it
+        if trial:
+            get_breaker(provider).release_trial()
+        raise
+    except Exception as e:
+        logger.warning(f"Call to {provider} failed: {str(e)}")
+        get_breaker(provider).record_failure()
+        raise
+    get_latency_tracker(provider).record(time.monotonic() - start)
+    get_breaker(provider).record_success()
+    return result
+
+
+def call_with_failover(targets: List[Tuple[str, Callable[[], Any]]],
+                       hedge: bool = use_hedged_requests) -> Tuple[Any, int]:
+    """Call the first healthy target, failing over (and optionally hedging) down the chain
+
+    Targets whose provider circuit is open are skipped. When a call fails the next
+    target is tried. With hedging enabled, a backup call to the next target is also
+    fired once the running call exceeds its provider's p95 latency; whichever call
+    finishes first wins. Python threads cannot be interrupted, so the losing call is
+    cancelled if it has not started yet and otherwise left to finish in the background
+    with its result discarded. Without hedging every call runs in the caller's thread,
+    so only the caller's own concurrency limits apply.
+
+    Args:
+        targets: Ordered list of (provider, zero-argument call) pairs
+        hedge: Whether to fire backup requests for slow calls
+
+    Returns:
+        Tuple of the winning call's result and the index of the target that produced it
+    """
+    # Breakers are only acquired for targets actually fired, so a half-open trial is never taken and left unused
+    chain = [(i, provider, fn) for i, (provider, fn) in enumerate(targets) if get_breaker(provider).available()]
+    forced = not chain
+    if forced:
+        # Every circuit is open; trying the primary beats failing without a request
+        logger.warning("All provider circuits are open, trying the primary model anyway")
+        chain = [(0, targets[0][0], targets[0][1])]
+
+    last_error = None
+    if not hedge:
+        for index, provider, fn in chain:
+            trial = False if forced else get_breaker(provider).acquire()
+            if trial is None:
+                continue
+            try:
+                return _attempt(provider, fn, trial), index
+            except RunCancelled:
+                raise
+            except Exception as e:
+                last_error = e
+        if last_error is None:
+            # The circuits opened between the check and the call; try the primary anyway
+            return _attempt(targets[0][0], targets[0][1], False), 0
+        raise last_error
+
+    pending = {}
+    next_index = 0
+
+    def launch() -> bool:
+        """Fire the next target whose circuit lets it through; False if none is left"""
+        nonlocal next_index
+        while next_index < len(chain):
+            index, provider, fn = chain[next_index]
+            next_index += 1
+            trial = False if forced else get_breaker(provider).acquire()
+            if trial is None:
+                continue
+
+            def timed_call(provider=provider, fn=fn):
+                start = time.monotonic()
+                result = fn()
+                get_latency_tracker(provider).record(time.monotonic() - start)
+                return result
+
+            pending[_executor.submit(timed_call)] = (index, provider, trial)
+            return True
+        return False
+
+    def discard_pending() -> None:
+        """Cancel the calls still running; their outcome is never recorded, so trials are given back"""
+        for loser, (_, provider, trial) in pending.items():
+            loser.cancel()
+            if trial:
+                get_breaker(provider).release_trial()
+        pending.clear()
+
+    if not launch():
+        # The circuits closed between the check and the launch; try the primary anyway
+        forced = True
+        chain, next_index = [(0, targets[0][0], targets[0][1])], 0
+        launch()
+    while pending:
+        can_hedge = hedge and next_index < len(chain)
+        timeout = min(hedge_delay(p) for _, p, _ in pending.values()) if can_hedge else None
+        done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+        if not done:
+            logger.info("Call exceeded hedge delay, firing backup request")
+            launch()
+            continue
+
+        for future in done:
+            index, provider, trial = pending.pop(future)
+            try:
+                result = future.result()
+            except RunCancelled:
+                # Not the provider's fault; don't fail over
+                if trial:
+                    get_breaker(provider).release_trial()
+                discard_pending()
+                raise
+            except Exception as e:
+                logger.warning(f"Call to {provider} failed: {str(e)}")
+                get_breaker(provider).record_failure()
+                last_error = e
+                continue
+            get_breaker(provider).record_success()
+            discard_pending()
+            return result, index
+
+        if not pending:
+            launch()
+
+    raise last_error
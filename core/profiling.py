@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import time
+import html
+import logging
+import functools
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+profile_interval_ms = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+profile_path = os.getenv('PROFILE_PATH', "profiles/")
+
+# Timers record only while a profiled run is active, so instrumented code costs one check otherwise
+_active = False
+_timers_lock = threading.Lock()
+_timers: Dict[str, Dict[str, float]] = {}
+
+# Layout of the flame graph
+SVG_WIDTH = 1200
+FRAME_HEIGHT = 16
+MIN_FRAME_WIDTH = 0.5
+
+
+def _record(name: str, seconds: float) -> None:
+    with _timers_lock:
+        stats = _timers.setdefault(name, {"calls": 0, "total": 0.0, "max": 0.0})
+        stats["calls"] += 1
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+
+
+@contextmanager
+def timer(name: str):
+    """Time a block under a name while a profiled run is active"""
+    if not _active:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+
+def timed(name: str) -> Callable:
+    """Decorator timing every call of a function under a name while a profiled run is active"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _active:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+class StackSampler:
+    """Wall-clock sampling profiler over all threads of the process
+
+    A background thread records the stack of every other thread at a fixed
+    interval. Threads waiting on the network are sampled too, so the share of
+    samples inside model calls shows how local work compares to network time.
+    Stacks are kept in the collapsed format of flame graph tools: frames from
+    the outermost, separated by semicolons, with a sample count.
+    """
+
+    def __init__(self, interval: float = profile_interval_ms / 1000):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                    frames.append(f"{module}:{code.co_name}")
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(frames))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def flame_graph_svg(stacks: Counter, title: str) -> str:
+    """Render collapsed stacks as a self-contained SVG flame graph, callers at the bottom"""
+    root: Dict = {"count": 0, "children": {}}
+    for stack, count in stacks.items():
+        node = root
+        node["count"] += count
+        for frame in stack.split(";"):
+            node = node["children"].setdefault(frame, {"count": 0, "children": {}})
+            node["count"] += count
+
+    def depth(node) -> int:
+        return 1 + max((depth(child) for child in node["children"].values()), default=0)
+
+    levels = depth(root) - 1
+    height = (levels + 2) * FRAME_HEIGHT
+    scale = SVG_WIDTH / max(1, root["count"])
+    rects: List[str] = []
+
+    def draw(node, name: str, x: float, level: int) -> None:
+        width = node["count"] * scale
+        if width < MIN_FRAME_WIDTH:
+            return
+        y = height - (level + 1) * FRAME_HEIGHT
+        share = node["count"] / max(1, root["count"])
+        # Warm colours varied by name, as in the usual flame graphs
+        hue = sum(map(ord, name)) % 60
+        label = html.escape(name)
+        if width > 7 * len(name):
+            text = label
+        else:
+            text = html.escape(name[:max(0, int(width / 7) - 2)]) + ".." if width > 21 else ""
+        rects.append(f'<g><title>{label} ({node["count"]} samples, {share:.1%})</title>'
+                     f'<rect x="{x:.2f}" y="{y}" width="{width:.2f}" height="{FRAME_HEIGHT - 1}" '
+                     f'fill="hsl({hue},85%,60%)"/>'
+                     f'<text x="{x + 3:.2f}" y="{y + FRAME_HEIGHT - 4}">{text}</text></g>')
+        child_x = x
+        for child_name, child in sorted(node["children"].items()):
+            draw(child, child_name, child_x, level + 1)
+            child_x += child["count"] * scale
+
+    x = 0.0
+    for name, child in sorted(root["children"].items()):
+        draw(child, name, x, 0)
+        x += child["count"] * scale
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{SVG_WIDTH}" height="{height + FRAME_HEIGHT}" '
+            f'font-family="monospace" font-size="11">'
+            f'<text x="4" y="{FRAME_HEIGHT - 4}">{html.escape(title)}</text>'
+            + "".join(rects) + "</svg>\n")
+
+
+def timer_totals() -> Dict[str, Dict[str, float]]:
+    with _timers_lock:
+        return {name: dict(stats) for name, stats in _timers.items()}
+
+
+def format_timers(timers: Dict[str, Dict[str, float]], wall_time: float) -> str:
+    """Timer table, slowest first, with each timer's share of the run's wall time"""
+    lines = [f"{'timer':<32} {'calls':>7} {'total s':>9} {'max s':>8} {'of run':>7}"]
+    for name, stats in sorted(timers.items(), key=lambda item: -item[1]["total"]):
+        share = stats["total"] / wall_time if wall_time else 0
+        lines.append(f"{name:<32} {stats['calls']:>7} {stats['total']:>9.3f} {stats['max']:>8.3f} {share:>7.1%}")
+    return "\n".join(lines)
+
+
+@contextmanager
+def profile_run(name: str, output_dir: Optional[str] = None):
+    """Sample stacks and record timers for the duration of a run, then write its profile
+
+    Writes <name>_<time>.collapsed (collapsed stacks), .svg (flame graph) and
+    .timers.json (timer totals) to output_dir and prints the timer table.
+    Timers are inclusive: a timed block inside another counts in both.
+    """
+    global _active
+    output_dir = output_dir or profile_path
+    with _timers_lock:
+        _timers.clear()
+    sampler = StackSampler()
+    started = time.time()
+    _active = True
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        _active = False
+        wall_time = time.time() - started
+        try:
+            _write_profile(name, output_dir, sampler, wall_time)
+        except Exception as e:
+            logger.error(f"Error writing profile: {str(e)}")
+
+
+def maybe_profile(enabled: bool, name: str, output_dir: Optional[str] = None):
+    """profile_run if enabled, else a context that does nothing"""
+    return profile_run(name, output_dir) if enabled else nullcontext()
+
+
+def _write_profile(name: str, output_dir: str, sampler: StackSampler, wall_time: float) -> None:
+    os.makedirs(output_dir, exist_ok=True)
+    base = os.path.join(output_dir, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}")
+    timers = timer_totals()
+    with open(base + ".collapsed", 'w') as f:
+        f.write(sampler.collapsed())
+    with open(base + ".svg", 'w') as f:
+        f.write(flame_graph_svg(sampler.stacks, f"{name}: {sampler.samples} samples over {wall_time:.1f}s"))
+    with open(base + ".timers.json", 'w') as f:
+        json.dump({"wall_time": wall_time, "samples": sampler.samples, "interval": sampler.interval,
+                   "timers": timers}, f, indent=2)
+    print(f"\nProfile of {name} ({wall_time:.1f}s, {sampler.samples} samples) written to {base}.*")
+    if timers:
+        print(format_timers(timers, wall_time))
@@ -0,0 +1,271 @@
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+use_rate_limiter = os.getenv('USE_RATE_LIMITER', 'true').lower() == 'true'
+rate_limit_db = os.path.expanduser(os.getenv('RATE_LIMIT_DB', "~/.cache/multiagent_coding/rate_limits.sqlite"))
+rate_limit_output_estimate = int(os.getenv('RATE_LIMIT_OUTPUT_ESTIMATE', '1000'))
+rate_limit_max_wait = float(os.getenv('RATE_LIMIT_MAX_WAIT', '300'))
+
+# Longest single sleep while waiting for budget, so cancellation and other processes are noticed
+MAX_SLEEP_SECONDS = 1.0
+
+# A call holding a concurrency lease longer than this is assumed to have crashed
+LEASE_SECONDS = 600
+
+# Rough token estimate for requests; good enough for budgeting without a tokenizer
+CHARS_PER_TOKEN = 4
+
+
+def _env_name(scope: str, name: str) -> str:
+    return f"RATE_LIMIT_{re.sub(r'[^A-Z0-9]+', '_', scope.upper())}_{name}"
+
+
+def _scoped(scope: Optional[str]) -> bool:
+    """Whether any limit is set specifically for a provider or model"""
+    return bool(scope) and any(os.getenv(_env_name(scope, name)) is not None for name in ("RPM", "TPM"))
+
+
+def _limit(name: str, scope: Optional[str] = None) -> float:
+    """Limit from RATE_LIMIT_<SCOPE>_<NAME>, falling back to RATE_LIMIT_<NAME>; 0 means unlimited"""
+    if scope:
+        value = os.getenv(_env_name(scope, name))
+        if value is not None:
+            return float(value)
+    return float(os.getenv(f"RATE_LIMIT_{name}", '0'))
+
+
+def estimate_tokens(messages, max_tokens: Optional[int] = None) -> int:
+    """Tokens a request will count against a TPM limit: its input plus the expected output"""
+    input_tokens = len(json.dumps(messages, default=str)) // CHARS_PER_TOKEN
+    return input_tokens + min(max_tokens or rate_limit_output_estimate, rate_limit_output_estimate)
+
+
+def _key_id(virtual_key: Optional[str]) -> str:
+    # Never store the key itself
+    return hashlib.sha256((virtual_key or "default").encode()).hexdigest()[:16]
+
+
+class Reservation:
+    """Budget taken for one call; settle it with the call's real token usage"""
+
+    def __init__(self, limiter: "RateLimiter", token_buckets: List[str], reserved_tokens: int,
+                 lease: Optional[str] = None):
+        self.limiter = limiter
+        self.token_buckets = token_buckets
+        self.reserved_tokens = reserved_tokens
+        self.lease = lease
+
+    def settle(self, used_tokens: Optional[int]) -> None:
+        """Correct the token buckets by the difference between the estimate and the real usage
+
+        Args:
+            used_tokens: Tokens the call used, 0 for a failed call, None if unknown
+        """
+        if self.lease is not None:
+            self.limiter.release(self.lease)
+            self.lease = None
+        if used_tokens is not None and self.token_buckets:
+            self.limiter.adjust(self.token_buckets, self.reserved_tokens - used_tokens)
+            self.token_buckets = []
+
+
+class RateLimiter:
+    """Host-wide token buckets for model calls, shared by all processes through SQLite
+
+    Every call takes one request from the requests-per-minute buckets and its
+    estimated tokens from the tokens-per-minute buckets of both its provider
+    account (the Portkey virtual key) and its model; when any bucket is short
+    the call waits until all of them have refilled. Buckets refill
+    continuously at their per-minute rate up to one minute's worth. Once the
+    call returns, the token estimate is corrected with the real usage, which
+    may leave a bucket in debt that later calls wait out.
+
+    Limits come from the environment: RATE_LIMIT_RPM and RATE_LIMIT_TPM per
+    virtual key, overridden per provider by e.g. RATE_LIMIT_ANTHROPIC_RPM, and
+    RATE_LIMIT_MODEL_RPM / RATE_LIMIT_MODEL_TPM per model, overridden by e.g.
+    RATE_LIMIT_GPT_4O_TPM. RATE_LIMIT_MAX_CONCURRENT caps the calls in flight
+    per virtual key across processes. Unset or 0 means unlimited.
+    """
+
+    def __init__(self, path: str = rate_limit_db):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS leases (id TEXT PRIMARY KEY, key TEXT, expires REAL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections are not shared across threads
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.local.connection = connection
+        return connection
+
+    def _buckets(self, provider: Optional[str], model: str, virtual_key: Optional[str],
+                 tokens: int) -> List[Tuple[str, float, float]]:
+        """(bucket key, per-minute limit, amount) for every limited bucket of a call"""
+        key_id = _key_id(virtual_key)
+        limits = [
+            (f"rpm:{key_id}", _limit("RPM", provider), 1),
+            (f"tpm:{key_id}", _limit("TPM", provider), tokens),
+            (f"rpm:{key_id}:{model}", _limit("RPM", model) if _scoped(model) else _limit("MODEL_RPM"), 1),
+            (f"tpm:{key_id}:{model}", _limit("TPM", model) if _scoped(model) else _limit("MODEL_TPM"), tokens),
+        ]
+        # A request larger than a whole minute's budget waits for a full bucket instead of forever
+        return [(key, limit, min(amount, limit)) for key, limit, amount in limits if limit > 0]
+
+    def _try_take(self, buckets: List[Tuple[str, float, float]]) -> float:
+        """Take from all buckets or none; returns 0 on success, else the seconds to wait"""
+        db = self._connect()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            levels = {}
+            wait = 0.0
+            for key, limit, amount in buckets:
+                row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                rate = limit / 60
+                tokens = limit if row is None else min(limit, row[0] + (now - row[1]) * rate)
+                levels[key] = tokens
+                if tokens < amount:
+                    wait = max(wait, (amount - tokens) / rate)
+            if wait == 0:
+                for key, _, amount in buckets:
+                    levels[key] -= amount
+            for key, level in levels.items():
+                db.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, level, now))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return wait
+
+    def _try_lease(self, key: str, max_concurrent: int) -> Optional[str]:
+        db = self._connect()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM leases WHERE expires < ?", (now,))
+            in_flight = db.execute("SELECT COUNT(*) FROM leases WHERE key = ?", (key,)).fetchone()[0]
+            lease = None
+            if in_flight < max_concurrent:
+                lease = uuid.uuid4().hex
+                db.execute("INSERT INTO leases (id, key, expires) VALUES (?, ?, ?)", (lease, key, now + LEASE_SECONDS))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return lease
+
+    def acquire(self, model: str, virtual_key: Optional[str] = None, provider: Optional[str] = None,
+                tokens: int = 0, wait=time.sleep) -> Reservation:
+        """Wait until a call fits within every limit and take its budget
+
+        Args:
+            model: Model id of the call
+            virtual_key: Portkey virtual key the call is made with
+            provider: Provider of the model, for provider-specific limits
+            tokens: Estimated tokens of the call, see estimate_tokens
+            wait: Sleeps for the given seconds; may raise to abandon the wait, which gives back
+                any budget already taken
+
+        Returns:
+            Reservation to settle once the call returns
+        """
+        buckets = self._buckets(provider, model, virtual_key, tokens)
+        max_concurrent = int(_limit("MAX_CONCURRENT", provider))
+        # Bounds the wait for budget and for a concurrency lease together
+        deadline = time.time() + rate_limit_max_wait
+        taken = False
+        while True:
+            delay = self._try_take(buckets) if buckets else 0
+            if delay == 0:
+                taken = bool(buckets)
+                break
+            if time.time() + delay > deadline:
+                logger.warning(f"Rate limit wait for {model} exceeds {rate_limit_max_wait}s, calling anyway")
+                break
+            logger.debug(f"Rate limited on {model}, waiting {delay:.1f}s")
+            wait(min(delay, MAX_SLEEP_SECONDS))
+
+        lease = None
+        if max_concurrent > 0:
+            lease_key = f"concurrent:{_key_id(virtual_key)}"
+            try:
+                while lease is None:
+                    lease = self._try_lease(lease_key, max_concurrent)
+                    if lease is not None:
+                        break
+                    if time.time() >= deadline:
+                        # A crashed holder keeps its lease for LEASE_SECONDS; don't wait that out
+                        logger.warning(f"Concurrency limit wait for {model} exceeds {rate_limit_max_wait}s, "
+                                       f"calling anyway")
+                        break
+                    wait(min(0.1, max(0.0, deadline - time.time())))
+            except BaseException:
+                if taken:
+                    self._give_back(buckets)
+                raise
+        token_buckets = [key for key, _, _ in buckets if key.startswith("tpm:")]
+        return Reservation(self, token_buckets, tokens, lease)
+
+    def adjust(self, keys: List[str], amount: float) -> None:
+        """Give tokens back to buckets (or take more, with a negative amount)"""
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for key in keys:
+                db.execute("UPDATE buckets SET tokens = tokens + ? WHERE key = ?", (amount, key))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _give_back(self, buckets: List[Tuple[str, float, float]]) -> None:
+        """Return the budget taken for a call that was never made"""
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for key, _, amount in buckets:
+                db.execute("UPDATE buckets SET tokens = tokens + ? WHERE key = ?", (amount, key))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def release(self, lease: str) -> None:
+        db = self._connect()
+        db.execute("DELETE FROM leases WHERE id = ?", (lease,))
+
+    def levels(self) -> Dict[str, float]:
+        """Current bucket levels, for inspection"""
+        rows = self._connect().execute("SELECT key, tokens FROM buckets").fetchall()
+        return dict(rows)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """The process's limiter on the shared database, or None if rate limiting is disabled"""
+    global _limiter
+    if not use_rate_limiter:
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
@@ -0,0 +1,153 @@
+import os
+import re
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List
+
+from smolagents import ManagedAgent
+
+from core.static_check import check_files, format_diagnostics
+
+logger = logging.getLogger(__name__)
+
+review_shards = int(os.getenv('REVIEW_SHARDS', '4'))
+review_max_steps = int(os.getenv('REVIEW_MAX_STEPS', '6'))
+
+REVIEWER_TASK = """
+Review these changed files: {files}
+
+They were changed for this request:
+{request}
+
+Static check results:
+{diagnostics}
+
+Read the files, and whatever they use, and look for bugs, missing pieces and code that cannot work. Do not change any files.
+Return your findings with final_answer as a JSON list, or [] if the files are fine:
+[{{"file": "path.py", "line": 1, "severity": "error or warning", "issue": "what is wrong", "fix": "how to fix it"}}]
+"""
+
+
+def shard_files(root: str, paths: Iterable[str], shards: int) -> List[List[str]]:
+    """Split files into at most `shards` groups of similar total size"""
+    sizes = []
+    for rel_path in sorted(set(paths)):
+        try:
+            sizes.append((os.path.getsize(os.path.join(root, rel_path)), rel_path))
+        except OSError:
+            # Deleted files have nothing to review
+            continue
+    bins = [[0, []] for _ in range(min(max(1, shards), len(sizes)))]
+    # Largest first, each into the lightest group
+    for size, rel_path in sorted(sizes, reverse=True):
+        lightest = min(bins, key=lambda b: b[0])
+        lightest[0] += size
+        lightest[1].append(rel_path)
+    return [sorted(files) for _, files in bins]
+
+
+def parse_findings(output: Any) -> List[Dict]:
+    """Read a reviewer's findings from its final answer"""
+    if isinstance(output, str):
+        match = re.search(r"\[.*\]", output, re.DOTALL)
+        try:
+            output = json.loads(match.group(0)) if match else []
+        except json.JSONDecodeError:
+            # Keep unstructured feedback rather than losing it
+            return [{"file": "", "line": 0, "severity": "warning", "issue": output.strip(), "fix": ""}]
+    if not isinstance(output, list):
+        return []
+    findings = []
+    for raw in output:
+        if isinstance(raw, dict) and raw.get("issue"):
+            findings.append({
+                "file": str(raw.get("file", "")),
+                "line": raw.get("line") if isinstance(raw.get("line"), int) else 0,
+                "severity": str(raw.get("severity", "warning")),
+                "issue": str(raw["issue"]),
+                "fix": str(raw.get("fix", "")),
+            })
+    return findings
+
+
+def aggregate_findings(findings: List[Dict]) -> List[Dict]:
+    """Drop duplicate findings and order them by file and line"""
+    unique = {}
+    for finding in findings:
+        unique.setdefault((finding["file"], finding["line"], finding["issue"].lower()), finding)
+    return sorted(unique.values(), key=lambda f: (f["severity"] != "error", f["file"], f["line"]))
+
+
+def format_findings(findings: List[Dict]) -> str:
+    lines = []
+    for i, finding in enumerate(findings, 1):
+        location = f"{finding['file']}:{finding['line']}" if finding["file"] else "general"
+        lines.append(f"{i}. [{finding['severity']}] {location}: {finding['issue']}")
+        if finding["fix"]:
+            lines.append(f"   Fix: {finding['fix']}")
+    return "\n".join(lines)
+
+
+class ShardedReviewAgent(ManagedAgent):
+    """Managed code review agent that reviews changed files in parallel shards
+
+    The changed files are split into groups of similar size and each group is
+    reviewed by its own read-only reviewer at the same time. Their findings
+    are merged into one request for the wrapped review agent, which fixes
+    them in a single pass. A change of a single file goes straight to the
+    wrapped agent.
+    """
+
+    def __init__(self, agent, name: str, description: str, make_reviewer: Callable[[], Any],
+                 changed_files: Callable[[], Iterable[str]], root: str,
+                 shards: int = review_shards, static_checks: bool = True, **kwargs):
+        super().__init__(agent, name, description, **kwargs)
+        self.make_reviewer = make_reviewer
+        self.changed_files = changed_files
+        self.root = root
+        self.shards = shards
+        self.static_checks = static_checks
+
+    def _review_shard(self, request: str, files: List[str]) -> List[Dict]:
+        diagnostics = check_files(self.root, files) if self.static_checks else []
+        task = REVIEWER_TASK.format(
+            files=", ".join(files),
+            request=request,
+            diagnostics=format_diagnostics(diagnostics) if diagnostics else "no problems found",
+        )
+        try:
+            return parse_findings(self.make_reviewer().run(task))
+        except Exception as e:
+            logger.error(f"Error reviewing {files}: {str(e)}")
+            return [{"file": "", "line": 0, "severity": "warning", "fix": "",
+                     "issue": f"Review of {', '.join(files)} failed ({str(e)}); check these files yourself"}]
+
+    def review(self, request: str, run: Callable[[str], Any]) -> Any:
+        """Review the changed files in parallel shards, then fix the findings in one pass
+
+        Args:
+            request: What the changes were made for
+            run: Runs the fix pass on a task, e.g. the wrapped agent's run
+
+        Returns:
+            The result of the fix pass, or a note when the reviewers found nothing
+        """
+        shards = shard_files(self.root, self.changed_files(), self.shards)
+        reviewed = [rel_path for files in shards for rel_path in files]
+        if len(shards) < 2:
+            # Nothing to split: a single reviewer that can also fix
+            return run(request)
+
+        logger.info(f"Reviewing {len(reviewed)} files in {len(shards)} shards")
+        with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="review") as executor:
+            results = list(executor.map(lambda files: self._review_shard(request, files), shards))
+        findings = aggregate_findings([finding for result in results for finding in result])
+        if not findings:
+            return f"The reviewers found no problems in {', '.join(reviewed)}."
+
+        return run(f"{request}\n\nParallel reviewers checked {', '.join(reviewed)} and found these problems:\n"
+                   f"{format_findings(findings)}\n\nFix them in one pass, then send back the final code.")
+
+    def __call__(self, request, **kwargs):
+        return self.review(request, lambda task: super(ShardedReviewAgent, self).__call__(task, **kwargs))
@@ -0,0 +1,459 @@
+import os
+import time
+import types
+import queue
+import pickle
+import signal
+import sys
+import logging
+import importlib
+import itertools
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; only the wall-clock limit applies there
+    resource = None
+
+from dotenv import load_dotenv
+# Load environment variables
+load_dotenv()
+
+from core.model_calls import RunCancelled
+from core.link_guard import guard_links
+
+logger = logging.getLogger(__name__)
+
+# Name of the directory under the playground that holds the worker working directories
+SANDBOX_DIRNAME = ".sandbox"
+
+sandbox_workers = int(os.getenv('SANDBOX_WORKERS', '4'))
+sandbox_cpu_seconds = int(os.getenv('SANDBOX_CPU_SECONDS', '30'))
+sandbox_memory_mb = int(os.getenv('SANDBOX_MEMORY_MB', '1024'))
+sandbox_timeout = float(os.getenv('SANDBOX_TIMEOUT', '60'))
+sandbox_max_extra_workers = int(os.getenv('SANDBOX_MAX_EXTRA_WORKERS', '8'))
+
+# Custom functions defined by agent code are kept per session in the worker
+MAX_SESSIONS_PER_WORKER = 16
+
+
+class SandboxError(Exception):
+    """Raised when sandboxed code runs out of time or its worker dies"""
+
+
+class CPUTimeExceeded(Exception):
+    """Raised inside a worker when a snippet uses up its CPU-time budget"""
+
+
+def _on_cpu_limit(signum, frame):
+    raise CPUTimeExceeded("CPU time limit exceeded")
+
+
+def _picklable(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the part of an interpreter state that can cross a process boundary"""
+    result = {}
+    for key, value in state.items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        result[key] = value
+    return result
+
+
+def _module_names(state: Dict[str, Any]) -> Dict[str, str]:
+    """Variables of an interpreter state bound to modules, by the name of their module
+
+    Modules cannot be pickled, so they travel by name and are imported again
+    by the worker running the next snippet.
+    """
+    return {key: value.__name__ for key, value in state.items() if isinstance(value, types.ModuleType)}
+
+
+def _import_modules(state: Dict[str, Any], modules: Dict[str, str]) -> None:
+    for key, name in modules.items():
+        if key in state:
+            continue
+        try:
+            state[key] = importlib.import_module(name)
+        except Exception as e:
+            logger.warning(f"Could not import {name} again in the sandbox: {str(e)}")
+
+
+class _ToolProxy:
+    """Callable standing in for a parent-process tool inside a worker"""
+
+    def __init__(self, conn, name: str):
+        self.conn = conn
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        self.conn.send(("tool", self.name, args, kwargs))
+        status, value = self.conn.recv()
+        if status == "error":
+            raise RuntimeError(value)
+        return value
+
+
+def _enter_root(root: str, previous: Optional[str], worker_id: int) -> None:
+    """Make root the project of the next snippets: working directory, imports and link guard"""
+    if previous is not None:
+        # Project modules imported from the previous root would shadow this root's
+        if previous in sys.path:
+            sys.path.remove(previous)
+        for name, module in list(sys.modules.items()):
+            if (getattr(module, "__file__", None) or "").startswith(previous + os.sep):
+                del sys.modules[name]
+    workdir = os.path.join(root, SANDBOX_DIRNAME, f"worker_{worker_id}")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    sys.path.insert(0, root)
+    # Project files may be hardlinked to a workspace or its base; writing one copies it first
+    guard_links(root)
+
+
+def _worker_main(conn, worker_id: int, cpu_seconds: int, memory_mb: int) -> None:
+    """Worker loop: evaluate snippets sent by the parent until told to stop"""
+    from smolagents.local_python_executor import evaluate_python_code, BASE_PYTHON_TOOLS
+
+    # Imports of playground modules leave no bytecode in the playground
+    sys.dont_write_bytecode = True
+    if resource is not None:
+        memory = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+        signal.signal(signal.SIGXCPU, _on_cpu_limit)
+
+    sessions = OrderedDict()
+    current_root = None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        _, root, session_id, code, state, modules, tool_names, authorized_imports, max_print_outputs_length = message
+        if root != current_root:
+            _enter_root(root, current_root, worker_id)
+            current_root = root
+        # Modules imported by earlier snippets of the session, possibly in another worker
+        _import_modules(state, modules)
+        custom_tools = sessions.pop(session_id, {})
+        sessions[session_id] = custom_tools
+        while len(sessions) > MAX_SESSIONS_PER_WORKER:
+            sessions.popitem(last=False)
+
+        static_tools = {name: _ToolProxy(conn, name) for name in tool_names}
+        static_tools.update(BASE_PYTHON_TOOLS)
+
+        if resource is not None:
+            # CPU time is cumulative per process, so move the soft limit along for each snippet
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            used = int(usage.ru_utime + usage.ru_stime)
+            resource.setrlimit(resource.RLIMIT_CPU, (used + cpu_seconds, resource.RLIM_INFINITY))
+        try:
+            output, is_final_answer = evaluate_python_code(
+                code,
+                static_tools=static_tools,
+                custom_tools=custom_tools,
+                state=state,
+                authorized_imports=authorized_imports,
+                max_print_outputs_length=max_print_outputs_length,
+            )
+            reply = ("result", output, is_final_answer)
+        except BaseException as e:
+            reply = ("error", str(e), False)
+        finally:
+            if resource is not None:
+                resource.setrlimit(resource.RLIMIT_CPU, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+
+        try:
+            conn.send(reply + (_picklable(state), _module_names(state)))
+        except Exception as e:
+            conn.send(("error", f"Could not return result from sandbox: {str(e)}", False, _picklable(state),
+                       _module_names(state)))
+
+
+class _Worker:
+    """Handle on one worker process and its pipe"""
+
+    def __init__(self, context, worker_id: int, cpu_seconds: int, memory_mb: int):
+        self.worker_id = worker_id
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, worker_id, cpu_seconds, memory_mb),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def kill(self) -> None:
+        try:
+            self.process.kill()
+            self.process.join(1)
+        except Exception:
+            pass
+        self.conn.close()
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+            self.process.join(1)
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.kill()
+
+
+class SandboxPool:
+    """Pool of pre-forked worker processes that evaluate agent-generated code
+
+    Each worker runs with a CPU-time and address-space limit. A snippet runs in
+    a project root, `base_dir` unless it names another (such as a fan-out
+    workspace): the worker's working directory is under the root's `.sandbox`
+    directory and the root comes first on its import path. Snippets are
+    additionally bounded by a wall-clock timeout; a worker that exceeds it is
+    killed and replaced. Tool calls made by the code are forwarded to the
+    parent process, so tools and managed agents keep running in-process. Time
+    spent inside tool calls does not count towards the wall-clock limit.
+
+    When every idle worker is busy (for example while a writer agent waits on its
+    reviewer) up to `max_extra` extra workers are forked rather than blocking,
+    and only `size` workers are kept around once they are released. Beyond
+    that, a snippet waits for a worker to come free.
+    """
+
+    def __init__(self, base_dir: str, size: int = sandbox_workers, cpu_seconds: int = sandbox_cpu_seconds,
+                 memory_mb: int = sandbox_memory_mb, timeout: float = sandbox_timeout,
+                 max_extra: int = sandbox_max_extra_workers):
+        self.root = os.path.abspath(base_dir)
+        self.size = size
+        self.max_extra = max_extra
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.timeout = timeout
+
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        if "forkserver" in methods:
+            self.context.set_forkserver_preload(["smolagents.local_python_executor"])
+
+        self.idle = queue.LifoQueue()
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        # Workers alive, idle or busy
+        self.alive = 0
+        for _ in range(size):
+            self._release(self._spawn())
+
+    def _spawn(self) -> _Worker:
+        with self.lock:
+            self.alive += 1
+        worker_id = next(self.ids)
+        try:
+            return _Worker(self.context, worker_id, self.cpu_seconds, self.memory_mb)
+        except BaseException:
+            with self.lock:
+                self.alive -= 1
+            raise
+
+    def _acquire(self, preferred: Optional[int] = None) -> _Worker:
+        with self.lock:
+            workers = []
+            while True:
+                try:
+                    workers.append(self.idle.get_nowait())
+                except queue.Empty:
+                    break
+            if workers:
+                chosen = next((w for w in workers if w.worker_id == preferred), workers[0])
+                for worker in reversed(workers):
+                    if worker is not chosen:
+                        self.idle.put(worker)
+                return chosen
+            spawn = self.alive < self.size + self.max_extra
+        if spawn:
+            return self._spawn()
+        try:
+            return self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise SandboxError(f"No sandbox worker came free within {self.timeout} seconds")
+
+    def _release(self, worker: _Worker) -> None:
+        with self.lock:
+            keep = self.idle.qsize() < self.size
+            if keep:
+                self.idle.put(worker)
+            else:
+                self.alive -= 1
+        if not keep:
+            worker.stop()
+
+    def _discard(self, worker: _Worker) -> None:
+        worker.kill()
+        with self.lock:
+            self.alive -= 1
+            replace = self.alive < self.size
+        if replace:
+            self._release(self._spawn())
+
+    def execute(self, code: str, state: Dict[str, Any], tools: Dict[str, Callable],
+                authorized_imports: List[str], max_print_outputs_length: int,
+                session_id: str = "default", preferred_worker: Optional[int] = None,
+                modules: Optional[Dict[str, str]] = None, root: Optional[str] = None
+                ) -> Tuple[Any, bool, Dict[str, Any], int]:
+        """Evaluate a code snippet in a worker
+
+        A worker is only reused after it replied normally; one left behind by
+        a timeout, a dead pipe or an exception raised while forwarding a tool
+        call (including KeyboardInterrupt and RunCancelled) may still be
+        running the snippet and is killed.
+
+        Args:
+            code: Python code to evaluate
+            state: Interpreter variables; only picklable values are sent
+            tools: Tools the code may call, executed in this process
+            authorized_imports: Modules the code may import
+            max_print_outputs_length: Truncation length of the print outputs
+            session_id: Key under which the worker keeps functions the code defines
+            preferred_worker: Worker to reuse if it is idle, so defined functions persist
+            modules: Variables bound to modules by earlier snippets, by module name; updated in place
+            root: Project root to run the snippet in; base_dir by default
+
+        Returns:
+            Tuple of the output, whether it is a final answer, the new state and the worker id
+
+        Raises:
+            SandboxError: If the snippet timed out or the worker died
+            Exception: Any error raised while evaluating the code
+        """
+        modules = modules if modules is not None else {}
+        root = os.path.abspath(root) if root is not None else self.root
+        worker = self._acquire(preferred_worker)
+        worker_id = worker.worker_id
+        replied = False
+        try:
+            worker.conn.send(("run", root, session_id, code, _picklable(state), dict(modules), list(tools),
+                              authorized_imports, max_print_outputs_length))
+            deadline = time.monotonic() + self.timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not worker.conn.poll(remaining):
+                    raise SandboxError(f"Code execution timed out after {self.timeout} seconds")
+                message = worker.conn.recv()
+                if message[0] != "tool":
+                    replied = True
+                    break
+                _, name, args, kwargs = message
+                tool_start = time.monotonic()
+                try:
+                    worker.conn.send(("ok", tools[name](*args, **kwargs)))
+                except RunCancelled:
+                    raise
+                except Exception as e:
+                    worker.conn.send(("error", str(e)))
+                deadline += time.monotonic() - tool_start
+        except (EOFError, OSError, BrokenPipeError):
+            raise SandboxError("Sandbox worker died, probably by exceeding its memory limit")
+        finally:
+            if replied:
+                self._release(worker)
+            else:
+                self._discard(worker)
+
+        status, value, is_final_answer, new_state, new_modules = message
+        state.update(new_state)
+        for key in new_modules:
+            state.pop(key, None)
+        modules.clear()
+        modules.update(new_modules)
+        if status == "error":
+            raise Exception(value)
+        return value, is_final_answer, state, worker_id
+
+    def map(self, snippets: List[str], authorized_imports: List[str],
+            max_print_outputs_length: int = 50000) -> List[Tuple[Any, str]]:
+        """Evaluate independent snippets in parallel, each with a fresh state
+
+        Returns:
+            List of (output or error message, print outputs) in the order of `snippets`
+        """
+        def run(snippet):
+            state = {}
+            try:
+                output, _, state, _ = self.execute(snippet, state, {}, authorized_imports,
+                                                   max_print_outputs_length, session_id=f"map_{id(state)}")
+            except Exception as e:
+                output = f"Error: {str(e)}"
+            return output, state.get("print_outputs", "")
+
+        with ThreadPoolExecutor(max_workers=max(1, self.size)) as executor:
+            return list(executor.map(run, snippets))
+
+    def shutdown(self) -> None:
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.alive -= 1
+            worker.stop()
+
+
+class SandboxedPythonExecutor:
+    """Drop-in replacement for smolagents' LocalPythonInterpreter backed by a SandboxPool
+
+    Keeps the interpreter state in this process and sends it along with every
+    snippet. Imported modules are imported again by the worker running the
+    next snippet; other values that cannot be pickled (open files, sockets,
+    ...) do not survive between steps.
+    """
+
+    def __init__(self, pool: SandboxPool, additional_authorized_imports: List[str], tools: Dict,
+                 max_print_outputs_length: Optional[int] = None, root: Optional[str] = None):
+        from smolagents.utils import BASE_BUILTIN_MODULES
+        from smolagents.local_python_executor import DEFAULT_MAX_LEN_OUTPUT
+
+        self.pool = pool
+        self.tools = tools
+        self.root = root
+        self.state = {}
+        # Variables bound to imported modules, by module name
+        self.modules = {}
+        self.authorized_imports = list(set(BASE_BUILTIN_MODULES) | set(additional_authorized_imports))
+        self.max_print_outputs_length = max_print_outputs_length or DEFAULT_MAX_LEN_OUTPUT
+        self.session_id = f"executor_{id(self)}"
+        self.worker_id = None
+
+    def __call__(self, code_action: str, additional_variables: Dict) -> Tuple[Any, str, bool]:
+        self.state.update(additional_variables)
+        self.state["print_outputs"] = ""
+        output, is_final_answer, self.state, self.worker_id = self.pool.execute(
+            code_action,
+            self.state,
+            self.tools,
+            self.authorized_imports,
+            self.max_print_outputs_length,
+            session_id=self.session_id,
+            preferred_worker=self.worker_id,
+            modules=self.modules,
+            root=self.root,
+        )
+        return output, self.state.get("print_outputs", ""), is_final_answer
+
+
+def use_sandbox(agent, pool: SandboxPool, root: Optional[str] = None) -> None:
+    """Route a CodeAgent's code execution through the sandbox pool, in root if given instead of the pool's"""
+    agent.python_executor = SandboxedPythonExecutor(
+        pool,
+        agent.additional_authorized_imports,
+        {**agent.tools, **agent.managed_agents},
+        root=root,
+    )
@@ -1,4 +1,5 @@
 import os
+import time
 import logging
 import json
 from datetime import datetime
@@ -10,20 +11,42 @@ from smolagents import (
     ToolCallingAgent,
     tool,
     ManagedAgent,
-    GradioUI,
     DuckDuckGoSearchTool
 )
 from smolagents.prompts import CODE_SYSTEM_PROMPT
 from smolagents.memory import TaskStep, ActionStep
+from smolagents.utils import make_json_serializable
 
 from core.smolagents_portkey_support import PortkeyModel
 from core.portkey_api import o3minihigh, claude35sonnet
 from core.zep_api import ZepAPI
-
-from core.osmosis_api import OsmosisAPI
-store_knowledge = OsmosisAPI().store_knowledge
-delete_by_intent = OsmosisAPI().delete_by_intent
-enhance_task = OsmosisAPI().enhance_task
+from core.sandbox import SandboxPool, use_sandbox
+from core.link_guard import guard_links
+from core.codebase import GitignoreMatcher, CodebaseSnapshot, iter_code_files
+from core.watcher import PlaygroundWatcher
+from core.symbol_index import SymbolIndex, format_matches
+from core.test_runner import run_affected_tests
+from core.static_check import check_source, check_files, format_diagnostics
+from core.checkpoint import RunCheckpoint
+from core.compaction import MemoryCompactor, use_compaction
+from core.workspace import Workspace, replace_file
+from core.fanout import split_plan, merge_overlapping, run_work_items, merge_workspaces, fanout_max_steps
+from core.watcher import DELETED
+from core.review import ShardedReviewAgent, review_max_steps
+from core.task_cache import (TaskCache, diff_files, format_cached_task, task_cache_reuse_threshold,
+                             base_blob_ids, plan_still_applies)
+from core.enhancement import KnowledgeStore, make_enhancer, enhancement_backend
+from core.step_control import StepController
+from core.model_calls import check_cancelled
+from core.web_ui import launch_web_ui
+from core.payloads import BLOB_PREFIX, encode_turns, default_registry, use_delta_payloads
+from core.step_store import use_step_store, input_deltas
+from core.git_snapshot import GitTree, file_blob_id, use_git_snapshots
+from core.profiling import timer, timed
+from core.http_transport import prewarm
+from core.structured_output import (use_structured_outputs, structured_output_model, structured_call, message_text,
+                                    QUESTIONS_SCHEMA, PLAN_SCHEMA, coerce_questions, coerce_plan,
+                                    fallback_questions, fallback_plan, render_plan, plan_work_items)
 
 from dotenv import load_dotenv
 # Load environment variables
@@ -40,10 +63,21 @@ logger.disabled = True  # Disable this logger
 # Base paths from environment variables with defaults
 AI_PLAYGROUND_PATH = os.getenv('AI_PLAYGROUND_PATH', "ai_playground/")
 TESTS_PATH = os.getenv('TESTS_PATH', "tests/tests_multiagent_coding/")
+CACHE_PATH = os.getenv('CACHE_PATH', ".cache/multiagent_coding/")
 
 # Create directories if they don't exist
 os.makedirs(AI_PLAYGROUND_PATH, exist_ok=True)
 os.makedirs(TESTS_PATH, exist_ok=True)
+os.makedirs(CACHE_PATH, exist_ok=True)
+
+# Checkpoints of terminal runs, one directory per run id
+RUNS_PATH = os.path.join(CACHE_PATH, "runs")
+
+# Task enhancement: local knowledge store, optionally with the remote Osmosis API
+enhancer = make_enhancer(enhancement_backend, KnowledgeStore(os.path.join(CACHE_PATH, "knowledge.json")))
+store_knowledge = enhancer.store_knowledge
+delete_by_intent = enhancer.delete_by_intent
+enhance_task = enhancer.enhance_task
 
 # Model configuration from environment variables
 openrouter_api_key = os.getenv('OPENROUTER_API_KEY')
@@ -53,9 +87,23 @@ planning_interval = int(os.getenv('PLANNING_INTERVAL', '3'))
 use_planning = os.getenv('USE_O3_PLANNING', 'true').lower() == 'true'
 use_clarifying_questions = os.getenv('USE_CLARIFYING_QUESTIONS', 'true').lower() == 'true'
 use_web_search = os.getenv('USE_WEB_SEARCH', 'false').lower() == 'true'
+use_sandboxed_execution = os.getenv('USE_SANDBOXED_EXECUTION', 'true').lower() == 'true'
+use_test_runner = os.getenv('USE_TEST_RUNNER', 'true').lower() == 'true'
+use_static_checks = os.getenv('USE_STATIC_CHECKS', 'true').lower() == 'true'
+use_code_search = os.getenv('USE_CODE_SEARCH', 'true').lower() == 'true'
+use_file_watcher = os.getenv('USE_FILE_WATCHER', 'true').lower() == 'true'
+use_checkpoints = os.getenv('USE_CHECKPOINTS', 'true').lower() == 'true'
+use_memory_compaction = os.getenv('USE_MEMORY_COMPACTION', 'true').lower() == 'true'
+use_parallel_implementation = os.getenv('USE_PARALLEL_IMPLEMENTATION', 'false').lower() == 'true'
+use_sharded_review = os.getenv('USE_SHARDED_REVIEW', 'true').lower() == 'true'
+use_task_cache = os.getenv('USE_TASK_CACHE', 'true').lower() == 'true'
+use_step_controller = os.getenv('USE_STEP_CONTROLLER', 'true').lower() == 'true'
+use_step_spilling = os.getenv('USE_STEP_SPILLING', 'true').lower() == 'true'
 
 planning_model = o3minihigh 
 clarifying_model = o3minihigh 
+# Planner and clarifier calls asking for JSON replies, in the structured output mode of each provider
+structured_model = PortkeyModel(structured_output_model) if use_structured_outputs else None
 
 planning_agent_system_prompt = os.getenv('PLANNING_AGENT_SYSTEM_PROMPT', """
 Given a coding task, generate a clear, step-by-step plan that outlines:
@@ -71,6 +119,12 @@ Remember to:
 You're not making production level code, you're just making minimal changes to get the code to work.
 """)
 
+plan_format_instructions = """
+Respond with only a JSON object, no other text:
+{"summary": "what the change does", "steps": [{"title": "short name of the step", "files": ["path/relative/to/project.py"], "instructions": "what to do in these files"}]}
+List in "files" every file the step creates or changes, relative to the project root.
+"""
+
 # Authorized imports from environment variable, falling back to default list
 default_imports = ["streamlit", "portkey", "smolagents", "stat", "statistics", "random", "queue", "time", "datetime", "math", "re",
             'unicodedata', 'itertools', 'collections', 'json', 'csv', 'os', 'sys', 'pathlib', 'typing',
@@ -87,6 +141,69 @@ default_imports = ["streamlit", "portkey", "smolagents", "stat", "statistics", "
 
 authorized_imports = default_imports + os.getenv('MORE_AUTHORIZED_IMPORTS', '').split(',')
 
+# Playground files written by the agents during the current run
+changed_files = set()
+# Contents of those files before the run, None for new files
+original_contents = {}
+
+# A playground created as a copy-on-write workspace is filled in the background;
+# reads fall through to its base until then
+workspace = Workspace.open(AI_PLAYGROUND_PATH) if Workspace.exists(AI_PLAYGROUND_PATH) else None
+
+# A playground that is a git checkout is listed from its index, with files keyed by blob id
+playground_git = (GitTree(AI_PLAYGROUND_PATH)
+                  if use_git_snapshots and GitTree.is_checkout(AI_PLAYGROUND_PATH) else None)
+
+# Caches over the playground, kept up to date by change events
+gitignore_matcher = GitignoreMatcher(AI_PLAYGROUND_PATH)
+codebase_snapshot = CodebaseSnapshot(AI_PLAYGROUND_PATH, gitignore_matcher,
+                                     os.path.join(CACHE_PATH, "codebase_manifest.json"), git=playground_git)
+symbol_index = SymbolIndex(AI_PLAYGROUND_PATH, os.path.join(CACHE_PATH, "symbol_index.json"), gitignore_matcher,
+                           git=playground_git)
+
+# The matcher subscribes first so the others see updated ignore rules
+playground_watcher = PlaygroundWatcher(AI_PLAYGROUND_PATH)
+playground_watcher.subscribe(gitignore_matcher.on_change)
+playground_watcher.subscribe(codebase_snapshot.on_change)
+if use_code_search:
+    playground_watcher.subscribe(symbol_index.on_change)
+
+# Completed tasks, looked up by similarity to skip the expensive stages of repeated requests
+task_cache = TaskCache(os.path.join(CACHE_PATH, "task_cache.json"))
+if use_file_watcher:
+    playground_watcher.start()
+    codebase_snapshot.watched = symbol_index.watched = playground_watcher.active
+
+
+def remember_original(rel_path):
+    """Keep the contents of a playground file before the run first changes it"""
+    rel_path = os.path.normpath(rel_path)
+    if rel_path in original_contents:
+        return
+    try:
+        with open(os.path.join(AI_PLAYGROUND_PATH, rel_path), 'r') as f:
+            original_contents[rel_path] = f.read()
+    except (OSError, UnicodeDecodeError):
+        original_contents[rel_path] = None
+
+def current_blob_ids(rel_paths):
+    """Git blob ids of playground files as they are now, None for missing ones"""
+    return {rel_path: file_blob_id(os.path.join(AI_PLAYGROUND_PATH, rel_path)) for rel_path in rel_paths}
+
+def cache_playground() -> str:
+    """Playground the task cache keys entries by: the base of a workspace playground, whose files it shares"""
+    return workspace.base if workspace is not None else AI_PLAYGROUND_PATH
+
+def wait_for_playground():
+    """Block until a workspace playground holds every file; needed before walking the tree"""
+    if workspace is None or workspace.materialized.is_set():
+        return
+    workspace.wait()
+    # Caches built while the workspace was filling may have missed files
+    gitignore_matcher.reload()
+    codebase_snapshot.listed = False
+    symbol_index.synced = False
+
 @tool
 def read_file(filepath: str) -> str:
     """
@@ -97,7 +214,7 @@ def read_file(filepath: str) -> str:
         str: Contents of the file if successful, error message if failed
     """
     logger.debug(f"Reading file: {filepath}")
-    path = os.path.join(AI_PLAYGROUND_PATH, filepath)
+    path = workspace.resolve(filepath) if workspace is not None else os.path.join(AI_PLAYGROUND_PATH, filepath)
     try:
         with open(path, 'r') as f:
             content = f.read()
@@ -117,6 +234,7 @@ def read_directory(dirpath: str = "") -> str:
         str: List of files and folders in the directory if successful, error message if failed
     """
     logger.debug(f"Reading directory: {dirpath}")
+    wait_for_playground()
     path = os.path.join(AI_PLAYGROUND_PATH, dirpath)
     try:
         contents = os.listdir(path)
@@ -139,95 +257,178 @@ def write_file(filepath: str, content: str) -> str:
     logger.debug(f"Writing to file: {filepath}")
     path = os.path.join(AI_PLAYGROUND_PATH, filepath)
     try:
-        # Create parent directories if they don't exist
-        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
-        with open(path, 'w') as f:
-            f.write(content)
+        remember_original(filepath)
+        # Creates parent directories; replacing the file keeps hardlinked workspaces apart
+        replace_file(path, content)
+        changed_files.add(os.path.normpath(filepath))
+        playground_watcher.notify(filepath)
         logger.debug(f"Successfully wrote to file: {filepath}")
-        return f"Successfully wrote to {path}"
+        message = f"Successfully wrote to {path}"
+        if use_static_checks:
+            diagnostics = check_source(filepath, content)
+            if diagnostics:
+                message += f"\nStatic check found {len(diagnostics)} problem(s):\n"
+                message += format_diagnostics(diagnostics)
+        return message
     except Exception as e:
         logger.error(f"Error writing to file {filepath}: {str(e)}")
         return f"Error writing file: {str(e)}"
 
+@tool
+def run_tests(run_all: bool = False) -> str:
+    """
+    Runs the project's tests that are affected by the files changed in this run and summarises the failures.
+    Tests are selected by following imports from the changed files to the test files.
+    Args:
+        run_all: Run every test in the project instead of only the affected ones
+    Returns:
+        str: Number of test files run and the errors of the failing ones
+    """
+    logger.debug("Running tests")
+    try:
+        wait_for_playground()
+        summary = run_affected_tests(AI_PLAYGROUND_PATH, None if run_all else set(changed_files))
+        logger.debug("Successfully ran tests")
+        return summary
+    except Exception as e:
+        logger.error(f"Error running tests: {str(e)}")
+        return f"Error running tests: {str(e)}"
+
+@tool
+def check_code(filepath: str = "") -> str:
+    """
+    Statically checks files for syntax errors, undefined names, unused imports and calls with wrong argument counts.
+    Args:
+        filepath: Path to the file to check. If empty, checks every file changed in this run.
+    Returns:
+        str: JSON list of diagnostics with file, line, col, severity, code and message; empty list if clean
+    """
+    logger.debug(f"Checking code: {filepath}")
+    try:
+        wait_for_playground()
+        paths = [os.path.normpath(filepath)] if filepath else changed_files
+        diagnostics = check_files(AI_PLAYGROUND_PATH, paths)
+        logger.debug("Successfully checked code")
+        return json.dumps(diagnostics)
+    except Exception as e:
+        logger.error(f"Error checking code: {str(e)}")
+        return f"Error checking code: {str(e)}"
+
+@tool
+def find_symbol(name: str) -> str:
+    """
+    Finds where a function, class, method, type or variable is defined in the project and shows its source.
+    Use this instead of reading whole files when you know the name you are looking for.
+    Args:
+        name: Exact name of the symbol, e.g. "MultiAgentCoding" or "run_terminal"
+    Returns:
+        str: Definitions with file path, line number and source snippet
+    """
+    logger.debug(f"Finding symbol: {name}")
+    try:
+        wait_for_playground()
+        symbol_index.ensure_fresh()
+        return format_matches(symbol_index.find_symbol(name))
+    except Exception as e:
+        logger.error(f"Error finding symbol {name}: {str(e)}")
+        return f"Error finding symbol: {str(e)}"
+
+@tool
+def find_references(name: str) -> str:
+    """
+    Finds the lines in the project that use a name, excluding its definitions.
+    Args:
+        name: Exact name of the symbol to look up
+    Returns:
+        str: Matching lines with file path and line number
+    """
+    logger.debug(f"Finding references: {name}")
+    try:
+        wait_for_playground()
+        symbol_index.ensure_fresh()
+        return format_matches(symbol_index.find_references(name))
+    except Exception as e:
+        logger.error(f"Error finding references to {name}: {str(e)}")
+        return f"Error finding references: {str(e)}"
+
+@tool
+def grep(pattern: str, path_glob: str = "") -> str:
+    """
+    Searches the project's code files for lines matching a regular expression.
+    Args:
+        pattern: Python regular expression to search for
+        path_glob: Optional glob restricting the searched files, e.g. "src/*.py"
+    Returns:
+        str: Matching lines with file path and line number
+    """
+    logger.debug(f"Grepping for: {pattern}")
+    try:
+        wait_for_playground()
+        symbol_index.ensure_fresh()
+        return format_matches(symbol_index.grep(pattern, path_glob))
+    except Exception as e:
+        logger.error(f"Error searching for {pattern}: {str(e)}")
+        return f"Error searching: {str(e)}"
+
+@tool
+def get_changes_since_head() -> str:
+    """
+    Shows the files changed since the last git commit of the project, staged or not, with their diff.
+    Returns:
+        str: The changed files with their status and the diff against HEAD
+    """
+    logger.debug("Getting changes since HEAD")
+    if playground_git is None:
+        return "The project is not a git checkout; use read_directory and read_file instead."
+    try:
+        wait_for_playground()
+        return playground_git.changes_since_head()
+    except Exception as e:
+        logger.error(f"Error getting changes since HEAD: {str(e)}")
+        return f"Error getting changes since HEAD: {str(e)}"
+
+def run_checks():
+    """Static checks and affected tests on the files changed in this run
+
+    Returns:
+        tuple: (whether there are changes and they pass, report)
+    """
+    if not changed_files:
+        return False, "No files changed yet."
+    wait_for_playground()
+    if use_static_checks:
+        errors = [d for d in check_files(AI_PLAYGROUND_PATH, changed_files) if d["severity"] == "error"]
+        if errors:
+            return False, format_diagnostics(errors)
+    if use_test_runner:
+        summary = run_affected_tests(AI_PLAYGROUND_PATH, set(changed_files))
+        passed = summary.startswith("No tests") or summary.split("\n", 1)[0].endswith(" 0 failed.")
+        return passed, summary
+    return True, "Static checks pass."
+
 @tool
 def get_codebase() -> str:
     """
     Generates a prompt containing the entire codebase by recursively reading all code files (.py, .js, .css, .html, .ts, etc.)
-    except those in .gitignore. Checks for .gitignore files in root and subfolders.
+    except those in .gitignore. Checks for .gitignore files in root and subfolders. Large, binary, minified, generated
+    and vendored files are left out and listed at the end; use read_file to look at one of them if needed.
     
     Returns:
         str: A formatted string containing all code with file paths as headers
     """
     logger.debug("Getting codebase")
-    codebase_prompt = []
-    
-    # Code file extensions to include
-    CODE_EXTENSIONS = {'.py', '.js', '.jsx', '.ts', '.tsx', '.css', '.scss', '.html', '.vue', '.go', '.java', '.cpp', '.c', '.h', '.rs', '.sql', '.md', '.txt', '.json', '.yaml', '.yml', '.toml', '.ini', '.conf', '.cfg', '.properties', '.env', '.lock', '.lockb', '.lock.json', '.lock.yaml', '.lock.yml', '.lock.toml', '.lock.ini', '.lock.conf', '.lock.cfg', '.lock.properties', '.lock.env'}
-    
-    # Store gitignore patterns from all .gitignore files
-    gitignore_patterns = {}
-    
-    def load_gitignore_patterns(directory):
-        """Load gitignore patterns from a directory's .gitignore file if it exists"""
-        gitignore_path = os.path.join(directory, '.gitignore')
-        if os.path.exists(gitignore_path):
-            try:
-                with open(gitignore_path, 'r') as f:
-                    return [line.strip() for line in f if line.strip() and not line.startswith('#')]
-            except Exception as e:
-                logger.error(f"Error reading {gitignore_path}: {str(e)}")
-        return []
-
-    def is_ignored(path):
-        """Check if path matches any gitignore pattern from parent directories"""
-        rel_path = os.path.relpath(path, AI_PLAYGROUND_PATH)
-        current_dir = os.path.dirname(path)
-        
-        # Check patterns from current and all parent directories
-        while current_dir >= AI_PLAYGROUND_PATH:
-            if current_dir in gitignore_patterns:
-                for pattern in gitignore_patterns[current_dir]:
-                    if pattern.endswith('/'):
-                        if rel_path.startswith(pattern):
-                            return True
-                    elif pattern.startswith('*'):
-                        if rel_path.endswith(pattern[1:]):
-                            return True
-                    elif pattern in rel_path:
-                        return True
-            current_dir = os.path.dirname(current_dir)
-        return False
-
-    # First pass: collect all gitignore patterns
-    logger.debug("Collecting gitignore patterns")
-    for root, _, _ in os.walk(AI_PLAYGROUND_PATH):
-        patterns = load_gitignore_patterns(root)
-        if patterns:
-            gitignore_patterns[root] = patterns
-
-    # Second pass: read files
-    logger.debug("Reading files for codebase")
-    for root, _, files in os.walk(AI_PLAYGROUND_PATH):
-        for file in files:
-            file_path = os.path.join(root, file)
-            file_ext = os.path.splitext(file)[1]
-            
-            if file_ext not in CODE_EXTENSIONS:
-                continue
-                
-            if not is_ignored(file_path):
-                try:
-                    with open(file_path, 'r') as f:
-                        content = f.read()
-                        relative_path = os.path.relpath(file_path, AI_PLAYGROUND_PATH)
-                        # Detect file type for syntax highlighting
-                        ext = file_ext[1:]  # Remove the dot
-                        codebase_prompt.append(f"\n### {relative_path}\n```{ext}\n{content}\n```\n")
-                except Exception as e:
-                    logger.error(f"Error reading {file_path}: {str(e)}")
-                    
+    wait_for_playground()
+    codebase_prompt = codebase_snapshot.render()
     logger.debug("Successfully generated codebase")
-    return "\n".join(codebase_prompt)
+    return codebase_prompt
+
+def _complete_structured(text_model, name: str, schema: dict):
+    """Completion function for structured_call: the structured model if enabled, else the text model"""
+    def complete(prompt: str, structured: bool) -> str:
+        if structured_model is None or not structured:
+            return text_model(prompt)
+        return message_text(structured_model.structured([{"role": "user", "content": prompt}], name, schema))
+    return complete
 
 @tool
 def generate_plan(prompt: str) -> str:
@@ -238,7 +439,8 @@ def generate_plan(prompt: str) -> str:
         prompt: The user's coding task request
         
     Returns:
-        str: A detailed plan outlining the steps to complete the task
+        str: A detailed plan outlining the steps to complete the task, with the planning prompt
+            before it and the structured plan ({"summary", "steps"}, None without structured outputs) after it
     """
     logger.debug("Generating plan")
     planning_prompt = f"""
@@ -251,9 +453,16 @@ Codebase:
 {get_codebase()}
 """
 
-    plan = planning_model(planning_prompt)
-    logger.debug("Successfully generated plan")
-    return planning_prompt, plan
+    if not use_structured_outputs:
+        plan = planning_model(planning_prompt)
+        logger.debug("Successfully generated plan")
+        return planning_prompt, plan, None
+
+    planning_prompt += plan_format_instructions
+    structured_plan = structured_call(_complete_structured(planning_model, "plan", PLAN_SCHEMA), planning_prompt,
+                                      "plan", PLAN_SCHEMA, coerce_plan, fallback_plan)
+    logger.debug(f"Successfully generated plan with {len(structured_plan['steps'])} steps")
+    return planning_prompt, render_plan(structured_plan), structured_plan
 
 @tool
 def ask_clarifying_questions(prompt: str) -> list:
@@ -269,8 +478,8 @@ def ask_clarifying_questions(prompt: str) -> list:
     logger.debug("Generating clarifying questions")
     clarifying_prompt = f"""
 Given this coding task, what clarifying questions would you ask to better understand the requirements?
-Please respond with a JSON array containing 3 key questions that would help clarify any ambiguities.
-Format the response as: ["question 1", "question 2", "question 3"]
+Please respond with a JSON object listing 3 key questions that would help clarify any ambiguities.
+Format the response as: {{"questions": ["question 1", "question 2", "question 3"]}}
 
 Task:
 {prompt}
@@ -279,15 +488,84 @@ Codebase:
 {get_codebase()}
 """
 
-    questions_json = clarifying_model(clarifying_prompt)
-    import json
-    questions = json.loads(questions_json)
+    # A malformed reply is repaired rather than failing the run after the expensive call
+    questions = structured_call(_complete_structured(clarifying_model, "clarifying_questions", QUESTIONS_SCHEMA),
+                                clarifying_prompt, "clarifying_questions", QUESTIONS_SCHEMA,
+                                coerce_questions, fallback_questions)
     logger.debug("Successfully generated clarifying questions")
     return clarifying_prompt, questions
 
+def make_workspace_tools(workspace: Workspace, written: set) -> list:
+    """
+    File tools for a sub-agent that works in its own workspace instead of the playground.
+    
+    Args:
+        workspace: The sub-agent's workspace
+        written: Set that collects the paths the sub-agent writes
+        
+    Returns:
+        list: read_file, read_directory and write_file tools bound to the workspace
+    """
+    @tool
+    def read_file(filepath: str) -> str:
+        """
+        Reads and returns the contents of a file.
+        Args:
+            filepath: Path to the file to read
+        Returns:
+            str: Contents of the file if successful, error message if failed
+        """
+        try:
+            with open(workspace.resolve(filepath), 'r') as f:
+                return f.read()
+        except Exception as e:
+            return f"Error reading file: {str(e)}"
+
+    @tool
+    def read_directory(dirpath: str = "") -> str:
+        """
+        Lists contents of a directory.
+        Args:
+            dirpath: Path to the directory to read. If empty, returns contents of entire project directory.
+        Returns:
+            str: List of files and folders in the directory if successful, error message if failed
+        """
+        try:
+            workspace.wait()
+            return "\n".join(os.listdir(os.path.join(workspace.path, dirpath)))
+        except Exception as e:
+            return f"Error reading directory: {str(e)}"
+
+    @tool
+    def write_file(filepath: str, content: str) -> str:
+        """
+        Writes content to a file.
+        Args:
+            filepath: Path where to write the file
+            content: Content to write to the file
+        Returns:
+            str: Success message if written, error message if failed
+        """
+        try:
+            replace_file(os.path.join(workspace.path, filepath), content)
+            written.add(os.path.normpath(filepath))
+            message = f"Successfully wrote to {filepath}"
+            if use_static_checks:
+                diagnostics = check_source(filepath, content)
+                if diagnostics:
+                    message += f"\nStatic check found {len(diagnostics)} problem(s):\n"
+                    message += format_diagnostics(diagnostics)
+            return message
+        except Exception as e:
+            return f"Error writing file: {str(e)}"
+
+    return [read_file, read_directory, write_file]
+
 class MultiAgentCoding:
     def __init__(self):
         logger.info("Initializing MultiAgentCoding")
+        # Connect to the gateway while the rest is set up and the user types the first request
+        prewarm()
         self.model = PortkeyModel(model)
         
         # Initialize Zep memory
@@ -339,6 +617,8 @@ Codebase:
         code_review_agent_system_prompt = os.getenv('CODE_REVIEW_AGENT_SYSTEM_PROMPT', """
 You are an expert code reviewer. Your task is to review and fix the code provided to you. Make sure the code compiles functions correctly. When you are done fixing the code, send the final code back. Don't try to do too many changes, just make sure the code compiles and functions correctly. 
 
+Use the run_tests tool to check the code against the project's tests.
+
 Don't be too harsh, you're not making production level code, just minimal changes to get the code to work.
 """) 
         
@@ -348,6 +628,14 @@ Don't be too harsh, you're not making production level code, just minimal change
         tools = [read_file, read_directory, write_file]
         if use_web_search:
             tools.append(DuckDuckGoSearchTool())
+        if use_test_runner:
+            tools.append(run_tests)
+        if use_static_checks:
+            tools.append(check_code)
+        if use_code_search:
+            tools.extend([find_symbol, find_references, grep])
+        if playground_git is not None:
+            tools.append(get_changes_since_head)
         # if use_clarifying_questions:
         #     tools.append(ask_clarifying_questions)
         # if use_planning:
@@ -363,11 +651,23 @@ Don't be too harsh, you're not making production level code, just minimal change
             planning_interval=planning_interval
         )
         
-        self.managed_code_review_agent = ManagedAgent(
-            agent=self.code_review_agent,
-            name="code_review_agent",
-            description="This is an agent that can review code and provide feedback."
-        )
+        if use_sharded_review:
+            # Changes to several files are reviewed in parallel shards before one fix pass
+            self.managed_code_review_agent = ShardedReviewAgent(
+                agent=self.code_review_agent,
+                name="code_review_agent",
+                description="This is an agent that can review code and provide feedback.",
+                make_reviewer=self._make_reviewer,
+                changed_files=lambda: list(changed_files),
+                root=AI_PLAYGROUND_PATH,
+                static_checks=use_static_checks
+            )
+        else:
+            self.managed_code_review_agent = ManagedAgent(
+                agent=self.code_review_agent,
+                name="code_review_agent",
+                description="This is an agent that can review code and provide feedback."
+            )
 
         logger.info("Initializing code writing agent")
         self.code_writing_agent = CodeAgent(
@@ -380,13 +680,49 @@ Don't be too harsh, you're not making production level code, just minimal change
             planning_interval=planning_interval
         )
 
-        self.ui = GradioUI(self.code_writing_agent)
+        # Run generated code in resource-limited worker processes instead of in-process
+        self.sandbox = None
+        if use_sandboxed_execution:
+            logger.info("Starting sandbox worker pool")
+            self.sandbox = SandboxPool(AI_PLAYGROUND_PATH)
+            use_sandbox(self.code_review_agent, self.sandbox)
+            use_sandbox(self.code_writing_agent, self.sandbox)
+        else:
+            # Snippets run in this process; writing a playground file hardlinked to a workspace copies it first
+            guard_links(AI_PLAYGROUND_PATH)
+
+        # Send compacted memory instead of every past tool output verbatim
+        if use_memory_compaction:
+            compactor = MemoryCompactor()
+            use_compaction(self.code_review_agent, compactor)
+            use_compaction(self.code_writing_agent, compactor)
+
+        # Keep only recent steps in memory and spill older ones to disk
+        if use_step_spilling:
+            use_step_store(self.code_review_agent)
+            use_step_store(self.code_writing_agent)
+
+        # Cut repeated actions and stalls short, stopping early once the checks pass
+        if use_step_controller:
+            StepController(run_checks, planning_interval).attach(self.code_review_agent)
+            StepController(run_checks, planning_interval).attach(self.code_writing_agent)
+
+        # Record every step of the code writing agent so crashed runs can be resumed
+        self.checkpoint = None
+        self.code_writing_agent.step_callbacks.append(self._checkpoint_step)
+
+        # Stream steps to the web UI and stop agents of a cancelled run
+        self.on_event = None
+        self.code_review_agent.step_callbacks.append(self._on_agent_step)
+        self.code_writing_agent.step_callbacks.append(self._on_agent_step)
         
         # Initialize instance variables
         self.questions = None
         self.plan = None
+        self.structured_plan = None
         self.prompt = None
         self.result = None
+        self.timings = {}
 
     def save_logs(self, base_path, agent):
         """Save agent logs with incrementing number if file exists.
@@ -409,14 +745,17 @@ Don't be too harsh, you're not making production level code, just minimal change
             counter += 1
             
         try:
+            with timer("save_logs.serialize"):
+                text = str(agent.memory.steps)
             with open(log_file, 'w') as f:
-                f.write(str(agent.memory.steps))
+                f.write(text)
             logger.info(f"Logs saved to: {log_file}")
             return log_file
         except Exception as e:
             logger.error(f"Error saving logs: {str(e)}")
             return None
 
+    @timed("store_knowledge_and_memory")
     def _store_agent_knowledge_and_memory(self):
         """Store agent interactions and knowledge for future reference"""
         turns = []
@@ -454,9 +793,10 @@ Don't be too harsh, you're not making production level code, just minimal change
             "result": self.result
         })
 
-        # Convert agent memory steps to turns
+        # Convert agent memory steps to turns; each step's inputs are only the messages it added,
+        # the earlier ones are in the turns before it
         if hasattr(self.code_writing_agent, 'memory') and self.code_writing_agent.memory:
-            for step in self.code_writing_agent.memory.steps:
+            for step, new_inputs in input_deltas(self.code_writing_agent.memory.steps):
                 turn_counter += 1
                 
                 if isinstance(step, TaskStep):
@@ -469,13 +809,6 @@ Don't be too harsh, you're not making production level code, just minimal change
                     })
                 
                 elif isinstance(step, ActionStep):
-                    # Extract input messages
-                    inputs = []
-                    for msg in step.model_input_messages:
-                        for content in msg['content']:
-                            if content['type'] == 'text':
-                                inputs.append(content['text'])
-                    
                     # Extract tool calls
                     tool_info = []
                     if step.tool_calls:
@@ -488,7 +821,7 @@ Don't be too harsh, you're not making production level code, just minimal change
                     
                     turns.append({
                         "turn": turn_counter,
-                        "inputs": "\n".join(inputs),
+                        "inputs": "\n".join(new_inputs),
                         "decision": json.dumps(tool_info) if tool_info else step.model_output,
                         "memory": f"Step {step.step_number} execution",
                         "result": step.action_output
@@ -497,8 +830,10 @@ Don't be too harsh, you're not making production level code, just minimal change
         # Save turns to file for debugging
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         turns_file = os.path.join(TESTS_PATH, f"turns_{timestamp}.txt")
+        with timer("store.serialize_turns"):
+            turns_text = str(turns)
         with open(turns_file, 'w') as f:
-            f.write(str(turns))
+            f.write(turns_text)
         
         # Add user prompt first
         self.memory.add_memory(
@@ -506,83 +841,421 @@ Don't be too harsh, you're not making production level code, just minimal change
             messages=[{"role": "user", "content": self.prompt}]
         )
         
-        # Split turns into chunks and add separately because of 2500 character limit
-        for turn in turns:
-            turn_str = str(turn)
-            chunk_size = 2000
-            
-            # Split turn into chunks if needed
-            if len(turn_str) > chunk_size:
-                chunks = [turn_str[i:i+chunk_size] for i in range(0, len(turn_str), chunk_size)]
-                for chunk in chunks:
-                    self.memory.add_memory(
-                        session_id=self.session_id,
-                        messages=[{"role": "assistant", "content": chunk}]
-                    )
-            else:
+        # Send turn inputs as the part that differs from the previous turn, and large texts
+        # once per session as a blob the turns refer to by hash
+        memory_turns, blobs = turns, {}
+        blob_destination = f"zep:{self.session_id}"
+        with timer("store.encode_turns"):
+            if use_delta_payloads:
+                memory_turns, blobs = encode_turns(turns, default_registry(), blob_destination)
+            texts = [f"{BLOB_PREFIX}{sha}\n{text}" for sha, text in blobs.items()]
+            texts.extend(str(turn) for turn in memory_turns)
+
+        # Split texts into chunks because of 2500 character limit, sending several chunks per call
+        chunk_size = 2000
+        messages_per_call = 30
+        messages = [
+            {"role": "assistant", "content": text[i:i+chunk_size]}
+            for text in texts
+            for i in range(0, len(text), chunk_size)
+        ]
+        with timer("store.upload_chunks"):
+            for i in range(0, len(messages), messages_per_call):
                 self.memory.add_memory(
-                    session_id=self.session_id, 
-                    messages=[{"role": "assistant", "content": turn_str}]
+                    session_id=self.session_id,
+                    messages=messages[i:i+messages_per_call]
                 )
+        if blobs:
+            default_registry().mark_uploaded(blob_destination, list(blobs))
         
         # Store the knowledge in Osmosis
-        store_knowledge(
-            query=self.prompt,
-            turns=turns,
-            success=True,
-            agent_type="code_writing"
-        )
+        with timer("store.knowledge"):
+            store_knowledge(
+                query=self.prompt,
+                turns=turns,
+                success=True,
+                agent_type="code_writing"
+            )
+
+    def _checkpoint_step(self, memory_step):
+        """Step callback: append new agent steps and changed files to the run's checkpoint"""
+        if self.checkpoint is None:
+            return
+        try:
+            self.checkpoint.record_steps("code_writing_agent", self.code_writing_agent.memory.steps)
+            self.checkpoint.record_files(AI_PLAYGROUND_PATH, changed_files)
+        except Exception as e:
+            logger.error(f"Error writing checkpoint: {str(e)}")
+
+    def _report(self, message):
+        """Print a progress message and send it to the web UI"""
+        print(message)
+        if self.on_event is not None:
+            self.on_event({"type": "message", "content": message.strip()})
+
+    def _on_agent_step(self, memory_step, agent):
+        """Step callback: stream the step to the web UI and abort if the run was cancelled"""
+        if self.on_event is not None:
+            name = "code_review_agent" if agent is self.code_review_agent else "code_writing_agent"
+            self.on_event({"type": "step", "agent": name, "step": memory_step})
+        check_cancelled()
 
-    def run_terminal(self, prompt):
+    def run_terminal(self, prompt, ask_user=None):
         logger.info("Running terminal with prompt")
+        changed_files.clear()
+        original_contents.clear()
+        self.checkpoint = None
+        if use_checkpoints:
+            self.checkpoint = RunCheckpoint.create(RUNS_PATH)
+            self.checkpoint.record_stage("prompt", prompt)
+            logger.info(f"Checkpointing run {self.checkpoint.run_id}")
+        return self._run_pipeline(prompt, ask_user=ask_user)
+
+    def resume_terminal(self, run_id):
+        """Continue a checkpointed run from its last completed stage or step
+
+        Args:
+            run_id (str): Id of the run, printed when the run was interrupted
+
+        Returns:
+            The result of the code writing agent
+        """
+        logger.info(f"Resuming run {run_id}")
+        changed_files.clear()
+        original_contents.clear()
+        self.checkpoint = RunCheckpoint.load(RUNS_PATH, run_id)
+        if "prompt" not in self.checkpoint.stages:
+            raise ValueError(f"Checkpoint of run {run_id} does not contain a prompt")
+
+        self._restore_checkpoint_files()
+        return self._run_pipeline(self.checkpoint.stages["prompt"])
+
+    def run_batch_task(self, prompt, answers=None, run_id=None):
+        """Run one task without reading from stdin
+
+        Args:
+            prompt (str): The user's coding task request
+            answers (list): Answers to the clarifying questions, in order. Without answers
+                no clarifying questions are asked
+            run_id (str): Checkpoint id of the task; an existing checkpoint with this id is resumed
+
+        Returns:
+            The result of the code writing agent
+        """
+        logger.info("Running batch task")
+        changed_files.clear()
+        original_contents.clear()
+        self.checkpoint = None
+        if use_checkpoints and run_id is not None:
+            self.checkpoint = RunCheckpoint(RUNS_PATH, run_id)
+            if "prompt" in self.checkpoint.stages:
+                self._restore_checkpoint_files()
+            else:
+                self.checkpoint.record_stage("prompt", prompt)
+        return self._run_pipeline(prompt, answers=answers or [])
+
+    def _restore_checkpoint_files(self):
+        """Put the playground back into the state of the last completed step"""
+        for rel_path in self.checkpoint.restore_files(AI_PLAYGROUND_PATH):
+            changed_files.add(rel_path)
+            playground_watcher.notify(rel_path)
+
+    def _run_pipeline(self, prompt, answers=None, ask_user=None):
+        """Enhance, clarify, plan and implement, skipping stages the checkpoint already holds
+
+        Args:
+            prompt (str): The user's coding task request
+            answers (list): Answers to the clarifying questions. None asks the user;
+                an empty list skips the questions
+            ask_user (callable): Called with the number and text of a question to get the user's
+                answer; reads from stdin if not given
+
+        Returns:
+            The result of the code writing agent
+        """
+        stages = self.checkpoint.stages if self.checkpoint is not None else {}
         self.planning_prompt = prompt
         self.questions = None
         self.plan = None
+        self.structured_plan = None
         self.prompt = prompt
-    
-        memory = self.memory.search_memory(self.session_id) or ""
+        # Seconds spent in each stage of this run
+        self.timings = {}
+        stage_start = time.time()
 
-        enhanced = enhance_task(
-                input_text=prompt,
-                context={"codebase": get_codebase(), "memory": memory},
-                agent_type="code_writing",
-            )
+        # A near-duplicate of a cached task reuses its plan if the files it changed are still as they were
+        # before it ran (compared by blob id); a similar one starts from it
+        if "cached" in stages:
+            cached = stages["cached"]
+        else:
+            cached = task_cache.lookup(prompt, cache_playground()) if use_task_cache else None
+            if self.checkpoint is not None:
+                self.checkpoint.record_stage("cached", cached)
+        reuse_plan = (cached is not None and cached["success"] and bool(cached["plan"]) and use_planning
+                      and cached["similarity"] >= task_cache_reuse_threshold
+                      and plan_still_applies(cached, current_blob_ids(cached.get("base_blobs", {}))))
+        if cached is not None:
+            task_cache.touch(cached["id"])
+
+        if reuse_plan:
+            enhanced = None
+        elif "enhanced" in stages:
+            enhanced = stages["enhanced"]
+        else:
+            memory = self.memory.search_memory(self.session_id) or ""
+
+            # File names and content hashes instead of the whole codebase
+            wait_for_playground()
+            enhanced = enhance_task(
+                    input_text=prompt,
+                    context={"codebase": codebase_snapshot.digest(), "memory": memory},
+                    agent_type="code_writing",
+                )
+            if self.checkpoint is not None:
+                self.checkpoint.record_stage("enhanced", enhanced)
         
         # Update prompts with enhanced knowledge if available
         if enhanced and "enhanced_response" in enhanced:
             self.planning_prompt = enhanced["enhanced_response"]
             self.prompt = enhanced["enhanced_response"]
+        if cached is not None and not reuse_plan:
+            self._report(f"\nStarting from a similar earlier task ({cached['similarity']:.0%} similar)\n")
+            self.prompt += "\n\n" + format_cached_task(cached)
+            self.planning_prompt += "\n\n" + format_cached_task(cached)
+        stage_start = self._record_timing("enhance", stage_start)
         
         # First ask clarifying questions
-        if use_clarifying_questions:
-            print("Figuring out clarifying questions...\n")
-            self.clarifying_prompt, self.questions = ask_clarifying_questions(prompt)
+        if use_clarifying_questions and not reuse_plan and (answers is None or answers):
+            if "clarifying" in stages:
+                self.clarifying_prompt, self.questions = stages["clarifying"]
+            else:
+                self._report("Figuring out clarifying questions...\n")
+                self.clarifying_prompt, self.questions = ask_clarifying_questions(prompt)
+                if self.checkpoint is not None:
+                    self.checkpoint.record_stage("clarifying", [self.clarifying_prompt, self.questions])
             
+            recorded_answers = self.checkpoint.answers if self.checkpoint is not None else []
             print(f"Clarifying Questions:")
             for i, question in enumerate(self.questions, 1):
                 print(f"\n{i}. {question}")
-                answer = input(f"\nYour answer to question {i}: \n").strip()
+                if i <= len(recorded_answers):
+                    answer = recorded_answers[i - 1]
+                    print(f"\nYour answer to question {i}: \n{answer}")
+                else:
+                    if answers is None and ask_user is not None:
+                        answer = ask_user(i, question)
+                    elif answers is None:
+                        answer = input(f"\nYour answer to question {i}: \n").strip()
+                    elif i <= len(answers):
+                        answer = answers[i - 1]
+                    else:
+                        answer = "No answer given, use your best judgement."
+                    if self.checkpoint is not None:
+                        self.checkpoint.record_answer(answer)
                 self.prompt += f"\nQ: {question}\nA: {answer}"
                 self.planning_prompt += f"\nClarifying Question: {question}\nAnswer from the user: {answer}"
+        stage_start = self._record_timing("clarify", stage_start)
         
         # Generate and execute plan
-        if use_planning:
-            print("\nGenerating plan...\n")
-            self.planning_prompt, self.plan = generate_plan(self.planning_prompt)
-            print(f"\nPlan: {self.plan}")
-            self.result = self.code_writing_agent.run(self.plan)
+        if reuse_plan:
+            self._report(f"\nReusing the plan of an earlier task ({cached['similarity']:.0%} similar)\n")
+            self.planning_prompt, self.plan = cached["planning_prompt"], cached["plan"]
+            self._report(f"\nPlan: {self.plan}")
+            task = f"{self.plan}\n\n{format_cached_task(cached, include_plan=False)}"
+        elif use_planning:
+            if "plan" in stages:
+                # Checkpoints written before plans were structured hold only the prompt and the plan
+                self.planning_prompt, self.plan, self.structured_plan = (stages["plan"] + [None])[:3]
+            else:
+                self._report("\nGenerating plan...\n")
+                self.planning_prompt, self.plan, self.structured_plan = generate_plan(self.planning_prompt)
+                if self.checkpoint is not None:
+                    self.checkpoint.record_stage("plan", [self.planning_prompt, self.plan, self.structured_plan])
+            self._report(f"\nPlan: {self.plan}")
+            task = self.plan
         else:
             logger.info("Running code writing agent without plan")
-            self.result = self.code_writing_agent.run(self.prompt)
+            task = self.prompt
+        stage_start = self._record_timing("plan", stage_start)
+
+        if "result" in stages:
+            self.result = stages["result"]
+        else:
+            self.result = None
+            if use_parallel_implementation and self.plan:
+                self.result = self._implement_in_parallel(self.plan, stages, self.structured_plan)
+            if self.result is None:
+                self.result = self._run_code_writing_agent(task)
+            if self.checkpoint is not None:
+                self.checkpoint.record_stage("result", make_json_serializable(self.result))
+        stage_start = self._record_timing("implement", stage_start)
 
         # Store knowledge and save logs
         self._store_agent_knowledge_and_memory()
+        if use_task_cache and not reuse_plan:
+            try:
+                task_cache.add(prompt, cache_playground(), self.planning_prompt, self.plan,
+                               diff_files(AI_PLAYGROUND_PATH, original_contents), sorted(changed_files),
+                               success=self.result is not None, result=str(self.result),
+                               base_blobs=base_blob_ids(original_contents))
+            except Exception as e:
+                logger.error(f"Error caching task: {str(e)}")
         logger.info("Saving logs")
         log_file = self.save_logs(TESTS_PATH, self.code_writing_agent)
+        if self.checkpoint is not None:
+            self.checkpoint.mark_finished()
+        self._record_timing("store", stage_start)
         
         return self.result
 
-    def launch_with_ui(self):
+    def _implement_in_parallel(self, plan, stages, structured_plan=None):
+        """Split the plan into file-level work items, implement them in parallel and review the merge once
+
+        Args:
+            plan (str): Plan from generate_plan
+            stages (dict): Stages recorded in the run's checkpoint
+            structured_plan (dict): Structured plan from generate_plan; when every step names its files,
+                the steps are the work items and no model call is needed to split the plan
+
+        Returns:
+            The result of the review, or None if the plan could not be split into several items
+        """
+        if "fanout" in stages:
+            review_task = stages["fanout"]
+        else:
+            wait_for_playground()
+            files = sorted(rel for _, rel, _ in iter_code_files(AI_PLAYGROUND_PATH, gitignore_matcher))
+            items = merge_overlapping(plan_work_items(structured_plan)) if structured_plan else []
+            if not items:
+                items = split_plan(plan, files, planning_model)
+            if len(items) < 2:
+                logger.info("Plan has a single work item, implementing it sequentially")
+                return None
+
+            self._report(f"\nImplementing {len(items)} parts of the plan in parallel...\n")
+            run_dir = os.path.join(CACHE_PATH, "fanout", datetime.now().strftime("%Y%m%d_%H%M%S_%f"))
+            outcomes = run_work_items(items, AI_PLAYGROUND_PATH, run_dir, self._run_sub_agent)
+            for outcome in outcomes:
+                for change in outcome["workspace"].diff():
+                    remember_original(change["path"])
+            merge = merge_workspaces(outcomes)
+            for change in merge["applied"]:
+                if change["status"] == "deleted":
+                    changed_files.discard(change["path"])
+                    playground_watcher.notify(change["path"], DELETED)
+                else:
+                    changed_files.add(change["path"])
+                    playground_watcher.notify(change["path"])
+
+            review_task = "Several developers implemented parts of this plan in parallel and their changes were merged:\n"
+            review_task += f"\n{plan}\n"
+            for i, outcome in enumerate(outcomes):
+                review_task += f"\nPart {i + 1} ({', '.join(outcome['item']['files'])}): "
+                review_task += f"failed with {outcome['error']}" if outcome["error"] else str(outcome["output"])
+            changed = sorted({change["path"] for change in merge["applied"]})
+            review_task += f"\n\nChanged files: {', '.join(changed) if changed else 'none'}\n"
+            if merge["unplanned"]:
+                review_task += "\nThese files were changed by a part they do not belong to; check they fit the other parts:\n"
+                review_task += "".join(f"- {entry['path']} (part {entry['item'] + 1})\n" for entry in merge["unplanned"])
+            if merge["conflicts"]:
+                review_task += "\nThese changes conflicted and were NOT merged. Apply what is needed by hand:\n"
+                for conflict in merge["conflicts"]:
+                    review_task += f"\n{conflict['path']} (parts {', '.join(str(i + 1) for i in conflict['items'])}):\n"
+                    review_task += f"```diff\n{conflict['diff']}```\n"
+            review_task += "\nReview the merged code, fix anything that is missing or broken, and return the final result."
+            if self.checkpoint is not None:
+                self.checkpoint.record_files(AI_PLAYGROUND_PATH, changed_files)
+                self.checkpoint.record_stage("fanout", review_task)
+
+        self._report("\nReviewing the merged changes...\n")
+        if use_sharded_review:
+            result = self.managed_code_review_agent.review(review_task, self.code_review_agent.run)
+        else:
+            result = self.code_review_agent.run(review_task)
+        return result if result is not None else ""
+
+    def _run_sub_agent(self, item, workspace, written):
+        """Implement one work item in its own workspace with a fresh agent, collecting the paths it writes in written"""
+        sub_agent_system_prompt = os.getenv('SUB_AGENT_SYSTEM_PROMPT', """
+You are an expert programmer implementing one part of a larger plan. Other developers implement the other parts at the same time.
+Only change the files of your part, and save every file with the write_file tool.
+When you are done, return a short summary of what you changed.
+""")
+        agent = CodeAgent(
+            tools=make_workspace_tools(workspace, written),
+            model=PortkeyModel(model),
+            system_prompt=CODE_SYSTEM_PROMPT + sub_agent_system_prompt,
+            additional_authorized_imports=authorized_imports,
+            max_steps=fanout_max_steps,
+            verbosity_level=0
+        )
+        if use_memory_compaction:
+            use_compaction(agent, MemoryCompactor())
+        if use_step_spilling:
+            use_step_store(agent)
+        if self.sandbox is not None:
+            # Code the sub-agent runs sees its workspace, not the main playground
+            use_sandbox(agent, self.sandbox, workspace.path)
+        task = f"Overall plan:\n{self.plan}\n\nYour part, in the files {', '.join(item['files'])}:\n{item['instructions']}"
+        return agent.run(task)
+
+    def _make_reviewer(self):
+        """Create a read-only reviewer for one shard of the changed files"""
+        reviewer_system_prompt = os.getenv('REVIEWER_AGENT_SYSTEM_PROMPT', """
+You are an expert code reviewer checking some of the files of a larger change. Other reviewers check the other files at the same time.
+Read the code and report the problems you find; do not try to fix them. Only report problems that stop the code from working.
+""")
+        tools = [read_file, read_directory]
+        if use_static_checks:
+            tools.append(check_code)
+        if use_code_search:
+            tools.extend([find_symbol, find_references, grep])
+        if playground_git is not None:
+            tools.append(get_changes_since_head)
+        reviewer = CodeAgent(
+            tools=tools,
+            model=PortkeyModel(model),
+            system_prompt=CODE_SYSTEM_PROMPT + reviewer_system_prompt,
+            additional_authorized_imports=authorized_imports,
+            max_steps=review_max_steps,
+            verbosity_level=0
+        )
+        if use_memory_compaction:
+            use_compaction(reviewer, MemoryCompactor())
+        if use_step_spilling:
+            use_step_store(reviewer)
+        if self.sandbox is not None:
+            use_sandbox(reviewer, self.sandbox)
+        return reviewer
+
+    def _record_timing(self, stage, stage_start):
+        """Record the duration of a pipeline stage and return the start time of the next one"""
+        now = time.time()
+        self.timings[stage] = round(now - stage_start, 3)
+        return now
+
+    def _run_code_writing_agent(self, task):
+        """Run the code writing agent, continuing from checkpointed steps if there are any"""
+        restored_steps = self.checkpoint.restore_steps("code_writing_agent") if self.checkpoint is not None else []
+        if not restored_steps:
+            return self.code_writing_agent.run(task)
+
+        completed = self.checkpoint.completed_action_steps("code_writing_agent")
+        self._report(f"\nResuming after {completed} completed step(s)...\n")
+        self.code_writing_agent.memory.reset()
+        self.code_writing_agent.memory.steps.extend(restored_steps)
+        # The step budget covers the whole run, not each resumption
+        self.code_writing_agent.max_steps = max(1, max_steps - completed)
+        try:
+            return self.code_writing_agent.run(
+                "The run was interrupted. Continue the task from where you left off: the files you wrote "
+                "are in place and the steps above show your progress so far.",
+                reset=False
+            )
+        finally:
+            self.code_writing_agent.max_steps = max_steps
+
+    def launch_with_ui(self, **kwargs):
         """Launch the Gradio UI interface"""
         logger.info("Launching Gradio UI")
-        self.ui.launch()
\ No newline at end of file
+        launch_web_ui(self, **kwargs)
\ No newline at end of file
@@ -1,10 +1,28 @@
 import os
 from dataclasses import dataclass
-from portkey_ai import Portkey
 from typing import Dict, List, Optional
 
 from smolagents.models import Model, ChatMessage, Tool, parse_tool_args_if_needed
 
+from core.portkey_failover import (
+    provider_for_model,
+    virtual_key_for_model,
+    fallback_models_from_env,
+    call_with_failover,
+)
+from core.http_transport import portkey_client
+from core.model_calls import call_model, record_usage
+from core.rate_limit import estimate_tokens
+from core.structured_output import structured_output_kwargs
+
+
+def _create_completion(client, completion_kwargs):
+    model_id = completion_kwargs["model"]
+    return call_model(lambda: client.chat.completions.create(**completion_kwargs),
+                      model=model_id, virtual_key=getattr(client, "virtual_key", None),
+                      provider=provider_for_model(model_id),
+                      tokens=estimate_tokens(completion_kwargs["messages"], completion_kwargs.get("max_tokens")))
+
 
 class PortkeyModel(Model):
     """This model connects to Portkey.ai as a gateway to multiple LLM providers.
@@ -16,6 +34,9 @@ class PortkeyModel(Model):
             The Portkey API key. If not provided, will try to read from PORTKEY_API_KEY env var.
         virtual_key (`str`, *optional*): 
             The Portkey virtual key for the specific provider. If not provided, will try to read from env var.
+        fallback_model_ids (`List[str]`, *optional*):
+            Models to fail over to, in order, when the primary is down or slow. If not provided, will try to
+            read a comma separated list from PORTKEY_FALLBACK_MODELS env var.
         **kwargs:
             Additional keyword arguments to pass to the Portkey API.
     """
@@ -25,6 +46,7 @@ class PortkeyModel(Model):
         model_id: str,
         api_key: Optional[str] = None,
         virtual_key: Optional[str] = None,
+        fallback_model_ids: Optional[List[str]] = None,
         **kwargs,
     ):
         super().__init__(**kwargs)
@@ -34,18 +56,27 @@ class PortkeyModel(Model):
             api_key = os.getenv("PORTKEY_API_KEY")
         if virtual_key is None:
             # Try to get virtual key from env based on model
-            if "claude" in model_id.lower():
-                virtual_key = os.getenv("PORTKEY_VIRTUAL_KEY_ANTHROPIC")
-            elif "gpt" in model_id.lower():
-                virtual_key = os.getenv("PORTKEY_VIRTUAL_KEY_OPENAI") 
-            elif "gemini" in model_id.lower():
-                virtual_key = os.getenv("PORTKEY_VIRTUAL_KEY_GOOGLE")
-
-        self.client = Portkey(
+            virtual_key = virtual_key_for_model(model_id)
+        if fallback_model_ids is None:
+            fallback_model_ids = fallback_models_from_env()
+
+        # Clients are shared per virtual key, with one connection pool for all of them
+        self.client = portkey_client(
             api_key=api_key,
             virtual_key=virtual_key
         )
 
+        # Fallback chain of (model_id, provider, client); the primary model comes first
+        self.chain = [(model_id, provider_for_model(model_id) or model_id, self.client)]
+        for fallback_id in fallback_model_ids:
+            if fallback_id == model_id:
+                continue
+            self.chain.append((
+                fallback_id,
+                provider_for_model(fallback_id) or fallback_id,
+                portkey_client(api_key=api_key, virtual_key=virtual_key_for_model(fallback_id)),
+            ))
+
     def __call__(
         self,
         messages: List[Dict[str, str]],
@@ -63,7 +94,36 @@ class PortkeyModel(Model):
             **kwargs,
         )
 
-        response = self.client.chat.completions.create(**completion_kwargs)
+        message = self._complete(completion_kwargs)
+        if tools_to_call_from is not None:
+            return parse_tool_args_if_needed(message)
+        return message
+
+    def structured(self, messages: List[Dict[str, str]], name: str, schema: Dict) -> ChatMessage:
+        """Call the model for a reply in a JSON schema, asked for the way each model of the chain supports
+
+        Args:
+            messages: Messages of the call
+            name: Name of the schema
+            schema: JSON schema of the reply
+
+        Returns:
+            The reply; its JSON is in the tool call arguments or the content, see message_text
+        """
+        completion_kwargs = self._prepare_completion_kwargs(messages=messages, model=self.model_id)
+        return self._complete(completion_kwargs, lambda provider: structured_output_kwargs(provider, name, schema))
+
+    def _complete(self, completion_kwargs: Dict, provider_kwargs=None) -> ChatMessage:
+        """Run a completion through the fallback chain, with provider_kwargs(provider) added per model"""
+        targets = []
+        for model_id, provider, client in self.chain:
+            target_kwargs = {**completion_kwargs, "model": model_id}
+            if provider_kwargs is not None:
+                target_kwargs.update(provider_kwargs(provider))
+            targets.append((provider, lambda client=client, target_kwargs=target_kwargs:
+                            _create_completion(client, target_kwargs)))
+        response, _ = call_with_failover(targets)
+        record_usage(response)
 
         self.last_input_token_count = response.usage.prompt_tokens if response.usage.prompt_tokens is not None else 0
         self.last_output_token_count = response.usage.completion_tokens if response.usage.completion_tokens is not None else 0
@@ -72,7 +132,4 @@ class PortkeyModel(Model):
             response.choices[0].message.model_dump(include={"role", "content", "tool_calls"})
         )
         message.raw = response
-
-        if tools_to_call_from is not None:
-            return parse_tool_args_if_needed(message)
         return message
@@ -0,0 +1,236 @@
+import os
+import ast
+import json
+import hashlib
+import builtins
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pyflakes import api as pyflakes_api
+    from pyflakes import reporter as pyflakes_reporter
+except ImportError:
+    pyflakes_api = None
+
+BUILTIN_NAMES = set(dir(builtins)) | {'__file__', '__name__', '__doc__', '__builtins__', '__spec__',
+                                      '__loader__', '__package__', '__path__', '__annotations__'}
+
+# Files whose diagnostics are cached; the least recently checked are forgotten
+MAX_CACHED_FILES = 2000
+
+# Path -> (content hash, diagnostics) of its last checked version, so unchanged files are never re-checked
+_cache: "OrderedDict[str, Tuple[str, List[Dict]]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _diagnostic(path: str, line: int, col: int, severity: str, code: str, message: str) -> Dict:
+    return {"file": path, "line": line, "col": col, "severity": severity, "code": code, "message": message}
+
+
+def _bound_names(tree: ast.AST) -> set:
+    """Every name bound anywhere in a module, ignoring scopes"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                names.add((alias.asname or alias.name).split('.')[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+
+def _lint(path: str, tree: ast.Module) -> List[Dict]:
+    """Scope-insensitive undefined-name and unused-import checks"""
+    diagnostics = []
+    has_star_import = any(isinstance(node, ast.ImportFrom) and any(a.name == '*' for a in node.names)
+                          for node in ast.walk(tree))
+    bound = _bound_names(tree)
+    loaded = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            loaded.add(node.id)
+            if not has_star_import and node.id not in bound and node.id not in BUILTIN_NAMES:
+                diagnostics.append(_diagnostic(path, node.lineno, node.col_offset, "error", "F821",
+                                               f"undefined name '{node.id}'"))
+        elif isinstance(node, ast.Attribute):
+            # `import a.b` is used through `a.b`
+            base = node
+            while isinstance(base, ast.Attribute):
+                base = base.value
+            if isinstance(base, ast.Name):
+                loaded.add(base.id)
+
+    exported = set()
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == '__all__' for t in node.targets):
+            if isinstance(node.value, (ast.List, ast.Tuple)):
+                exported.update(e.value for e in node.value.elts if isinstance(e, ast.Constant))
+    if not os.path.basename(path) == '__init__.py':
+        for node in tree.body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    name = (alias.asname or alias.name).split('.')[0]
+                    if name != '*' and name not in loaded and name not in exported:
+                        diagnostics.append(_diagnostic(path, node.lineno, node.col_offset, "warning", "F401",
+                                                       f"'{alias.name}' imported but unused"))
+    return diagnostics
+
+
+def _check_call_arity(path: str, tree: ast.Module) -> List[Dict]:
+    """Flag calls to module-level functions with too many positional arguments or a required argument missing"""
+    signatures = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            args = node.args
+            if args.vararg or args.kwarg:
+                continue
+            positional = args.posonlyargs + args.args
+            required = len(positional) - len(args.defaults)
+            required_keyword_only = [a.arg for a, default in zip(args.kwonlyargs, args.kw_defaults) if default is None]
+            signatures[node.name] = (positional, required, {a.arg for a in args.posonlyargs}, required_keyword_only)
+    redefined = {n.id for n in ast.walk(tree) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store)}
+
+    diagnostics = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)):
+            continue
+        name = node.func.id
+        if name not in signatures or name in redefined:
+            continue
+        if any(isinstance(a, ast.Starred) for a in node.args) or any(k.arg is None for k in node.keywords):
+            continue
+        positional, required, positional_only, required_keyword_only = signatures[name]
+        keywords = {k.arg for k in node.keywords}
+        if len(node.args) > len(positional):
+            diagnostics.append(_diagnostic(path, node.lineno, node.col_offset, "error", "T001",
+                                           f"'{name}' called with {len(node.args)} positional argument(s), "
+                                           f"takes at most {len(positional)}"))
+            continue
+        # Positional parameters not filled by position must come by keyword, unless positional-only
+        missing = [a.arg for a in positional[len(node.args):required]
+                   if a.arg in positional_only or a.arg not in keywords]
+        missing += [arg for arg in required_keyword_only if arg not in keywords]
+        if missing:
+            diagnostics.append(_diagnostic(path, node.lineno, node.col_offset, "error", "T001",
+                                           f"'{name}' called without required argument(s) {', '.join(missing)}"))
+    return diagnostics
+
+
+def _check_python(path: str, source: str) -> List[Dict]:
+    try:
+        tree = ast.parse(source, filename=path)
+    except SyntaxError as e:
+        return [_diagnostic(path, e.lineno or 0, e.offset or 0, "error", "E999", f"SyntaxError: {e.msg}")]
+    try:
+        # Catches errors the parser accepts, such as 'return' outside a function
+        compile(tree, path, 'exec', dont_inherit=True)
+    except SyntaxError as e:
+        return [_diagnostic(path, e.lineno or 0, e.offset or 0, "error", "E999", f"SyntaxError: {e.msg}")]
+
+    if pyflakes_api is not None:
+        diagnostics = _run_pyflakes(path, source)
+    else:
+        diagnostics = _lint(path, tree)
+    diagnostics += _check_call_arity(path, tree)
+    return sorted(diagnostics, key=lambda d: (d["line"], d["col"]))
+
+
+def _run_pyflakes(path: str, source: str) -> List[Dict]:
+    diagnostics = []
+
+    class Collector(pyflakes_reporter.Reporter):
+        def __init__(self):
+            pass
+
+        def flake(self, message):
+            severity = "error" if type(message).__name__ in ('UndefinedName', 'UndefinedLocal',
+                                                              'UndefinedExport') else "warning"
+            diagnostics.append(_diagnostic(path, message.lineno, getattr(message, 'col', 0), severity,
+                                           type(message).__name__, message.message % message.message_args))
+
+        def syntaxError(self, filename, msg, lineno, offset, text):
+            diagnostics.append(_diagnostic(path, lineno or 0, offset or 0, "error", "E999", msg))
+
+        def unexpectedError(self, filename, msg):
+            diagnostics.append(_diagnostic(path, 0, 0, "error", "E902", msg))
+
+    pyflakes_api.check(source, path, Collector())
+    return diagnostics
+
+
+def _check_json(path: str, source: str) -> List[Dict]:
+    try:
+        json.loads(source)
+    except json.JSONDecodeError as e:
+        return [_diagnostic(path, e.lineno, e.colno, "error", "J001", e.msg)]
+    return []
+
+
+CHECKERS = {'.py': _check_python, '.json': _check_json}
+
+
+def check_source(path: str, source: str) -> List[Dict]:
+    """Statically check a file's contents, reusing earlier results for identical contents
+
+    Args:
+        path: Path of the file, used for choosing the checker and in diagnostics
+        source: Contents of the file
+
+    Returns:
+        List of diagnostics with file, line, col, severity, code and message
+    """
+    checker = CHECKERS.get(os.path.splitext(path)[1])
+    if checker is None:
+        return []
+    content_hash = hashlib.sha256(source.encode('utf-8', 'replace')).hexdigest()
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == content_hash:
+            _cache.move_to_end(path)
+            return cached[1]
+    diagnostics = checker(path, source)
+    with _cache_lock:
+        # A new version of a file replaces the old one's entry
+        _cache[path] = (content_hash, diagnostics)
+        _cache.move_to_end(path)
+        while len(_cache) > MAX_CACHED_FILES:
+            _cache.popitem(last=False)
+    return diagnostics
+
+
+def check_files(root: str, rel_paths: Iterable[str]) -> List[Dict]:
+    """Statically check files relative to root"""
+    diagnostics = []
+    for rel_path in sorted(set(rel_paths)):
+        try:
+            with open(os.path.join(root, rel_path), 'r') as f:
+                source = f.read()
+        except Exception as e:
+            diagnostics.append(_diagnostic(rel_path, 0, 0, "error", "E902", f"Could not read file: {str(e)}"))
+            continue
+        diagnostics.extend(check_source(rel_path, source))
+    return diagnostics
+
+
+def format_diagnostics(diagnostics: List[Dict], limit: Optional[int] = 20) -> str:
+    """Render diagnostics one per line as path:line:col: code message"""
+    lines = [f"{d['file']}:{d['line']}:{d['col']}: {d['code']} {d['message']}" for d in diagnostics[:limit]]
+    if limit is not None and len(diagnostics) > limit:
+        lines.append(f"... and {len(diagnostics) - limit} more")
+    return "\n".join(lines)
@@ -0,0 +1,180 @@
+import os
+import re
+import hashlib
+import logging
+from collections import Counter
+from typing import Callable, Optional, Tuple
+
+from smolagents.memory import ActionStep
+from smolagents.utils import AgentMaxStepsError
+
+from core.compaction import file_accesses, truncate_middle
+
+logger = logging.getLogger(__name__)
+
+step_repeat_limit = int(os.getenv('STEP_REPEAT_LIMIT', '3'))
+step_stall_limit = int(os.getenv('STEP_STALL_LIMIT', '4'))
+
+# Length of the last output quoted in an early result
+MAX_RESULT_CHARS = 2000
+
+
+def _fingerprint(text: str) -> str:
+    return hashlib.sha1(re.sub(r'\s+', ' ', text).strip().encode('utf-8', 'replace')).hexdigest()
+
+
+class StepController:
+    """Watches an agent's steps and cuts loops short
+
+    Attached to a CodeAgent through a step callback, it tracks three signs of
+    a stuck agent: the same action repeated (identical code, or reading the
+    same files again without writing anything in between), the same error
+    repeated, and steps without progress (no file written and no new
+    observation). When one of them reaches its limit the controller runs the
+    project checks: if they pass the run stops right away with the best
+    result so far. Otherwise the agent gets a note on what it is repeating and
+    a fresh planning step; if it is still stuck after that, the run stops.
+
+    Scheduled planning steps are skipped while the agent is making progress,
+    and run as soon as it stalls.
+    """
+
+    def __init__(self, check: Callable[[], Tuple[bool, str]], planning_interval: Optional[int] = None,
+                 repeat_limit: int = step_repeat_limit, stall_limit: int = step_stall_limit):
+        """
+        Args:
+            check: Runs the project checks and returns (passed, report)
+            planning_interval: Planning interval of the agent; planning happens at most this often while progressing
+            repeat_limit: Number of identical actions or errors that count as a loop
+            stall_limit: Number of steps without progress that count as stalled
+        """
+        self.check = check
+        self.planning_interval = planning_interval
+        self.repeat_limit = repeat_limit
+        self.stall_limit = stall_limit
+        self.agent = None
+        self.saved_max_steps = None
+        self.reset()
+
+    def reset(self) -> None:
+        if self.saved_max_steps is not None:
+            # The last run ended on its own after the controller had stopped it
+            self.agent.max_steps = self.saved_max_steps
+        self.last_step_number = 0
+        self.actions = Counter()
+        self.observations = set()
+        self.last_error = None
+        self.repeated_errors = 0
+        self.stalled_steps = 0
+        self.progressing = True
+        self.replan = False
+        self.nudged = False
+        self.stopped = None
+        self.last_output = None
+        self.saved_max_steps = None
+
+    def attach(self, agent) -> None:
+        """Install the controller on an agent"""
+        self.agent = agent
+        agent.step_callbacks.append(self.on_step)
+        planning_step = agent.planning_step
+        provide_final_answer = agent.provide_final_answer
+
+        def controlled_planning_step(task, is_first_step, step):
+            scheduled = self.planning_interval is not None and step % self.planning_interval == 0
+            if self.replan or (scheduled and not self.progressing):
+                self.replan = False
+                return planning_step(task, is_first_step=is_first_step, step=step)
+            logger.debug(f"Skipping planning at step {step}")
+
+        def controlled_final_answer(task, images):
+            if self.stopped is None:
+                return provide_final_answer(task, images)
+            result = self.stopped
+            agent.max_steps = self.saved_max_steps
+            self.stopped = None
+            return result
+
+        # Asked every step; the controller decides whether a plan is due
+        agent.planning_interval = 1 if self.planning_interval else None
+        agent.planning_step = controlled_planning_step
+        agent.provide_final_answer = controlled_final_answer
+
+    def _action_key(self, code: str) -> str:
+        reads, writes, codebase = file_accesses(code)
+        if reads and not writes and not codebase and "write_file" not in code:
+            # Re-reading the same files is a repeat even when the code around the reads differs
+            return "read:" + ",".join(sorted(reads))
+        return _fingerprint(code)
+
+    def on_step(self, memory_step) -> None:
+        """Step callback: update the loop signals and intervene when one reaches its limit"""
+        if not isinstance(memory_step, ActionStep) or isinstance(memory_step.error, AgentMaxStepsError):
+            return
+        if memory_step.step_number <= self.last_step_number:
+            # A new run of the agent
+            self.reset()
+        self.last_step_number = memory_step.step_number
+
+        code = ""
+        if memory_step.tool_calls and isinstance(memory_step.tool_calls[0].arguments, str):
+            code = memory_step.tool_calls[0].arguments
+        wrote = bool(file_accesses(code)[1]) or "write_file" in code
+        error = memory_step.error.message if memory_step.error is not None else None
+        observation = _fingerprint(memory_step.observations or "")
+
+        if wrote and error is None:
+            # The files changed: earlier reads and runs may be worth repeating now
+            self.actions.clear()
+        if code:
+            self.actions[self._action_key(code)] += 1
+        if error is not None and error == self.last_error:
+            self.repeated_errors += 1
+        else:
+            self.repeated_errors = 1 if error is not None else 0
+        self.last_error = error
+
+        progress = error is None and (wrote or observation not in self.observations)
+        self.observations.add(observation)
+        self.stalled_steps = 0 if progress else self.stalled_steps + 1
+        self.progressing = progress
+        if memory_step.action_output is not None and error is None:
+            self.last_output = memory_step.action_output
+
+        reason = None
+        if self.actions and max(self.actions.values()) >= self.repeat_limit:
+            reason = "repeated the same action"
+        elif self.repeated_errors >= self.repeat_limit:
+            reason = "hit the same error repeatedly"
+        elif self.stalled_steps >= self.stall_limit:
+            reason = f"made no progress for {self.stalled_steps} steps"
+        if reason is not None and self.stopped is None:
+            self._intervene(memory_step, reason)
+
+    def _intervene(self, memory_step: ActionStep, reason: str) -> None:
+        passed, report = self.check()
+        if passed:
+            self._stop(memory_step, f"the agent {reason} and the checks pass", report)
+        elif not self.nudged:
+            logger.info(f"Step {memory_step.step_number}: agent {reason}, replanning")
+            self.nudged = True
+            self.replan = True
+            self.actions.clear()
+            self.repeated_errors = 0
+            self.stalled_steps = 0
+            memory_step.observations = (memory_step.observations or "") + (
+                f"\n\nNote: you {reason}. Do not repeat it. Current check results:\n{report}\n"
+                "Change your approach, or give your final answer if the task is done."
+            )
+        else:
+            self._stop(memory_step, f"the agent still {reason} after replanning", report)
+
+    def _stop(self, memory_step: ActionStep, reason: str, report: str) -> None:
+        logger.info(f"Stopping after step {memory_step.step_number}: {reason}")
+        result = f"Stopped after step {memory_step.step_number} because {reason}.\n\nChecks:\n{report}"
+        if self.last_output is not None:
+            result += f"\n\nLast output:\n{truncate_middle(str(self.last_output), MAX_RESULT_CHARS)}"
+        self.stopped = result
+        self.saved_max_steps = self.agent.max_steps
+        # The agent's loop ends once the step number passes max_steps
+        self.agent.max_steps = memory_step.step_number
@@ -0,0 +1,240 @@
+import os
+import json
+import mmap
+import hashlib
+import logging
+import tempfile
+import threading
+from collections.abc import MutableSequence
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from smolagents.memory import ActionStep
+
+from core.checkpoint import serialize_step, deserialize_step
+
+logger = logging.getLogger(__name__)
+
+step_store_keep_recent = int(os.getenv('STEP_STORE_KEEP_RECENT', '4'))
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8', 'replace')).hexdigest()
+
+
+def _input_texts(step) -> List[Tuple[str, str]]:
+    """(role, text) of every text part of a step's model input"""
+    texts = []
+    for message in getattr(step, "model_input_messages", None) or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append((str(message["role"]), content))
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                texts.append((str(message["role"]), part["text"]))
+    return texts
+
+
+class _Spilled:
+    """Location of a step written to the store's log, and its model input as (role, text hash) pairs"""
+    __slots__ = ("offset", "length", "inputs")
+
+    def __init__(self, offset: int, length: int, inputs: List[Tuple[str, str]]):
+        self.offset = offset
+        self.length = length
+        self.inputs = inputs
+
+
+class StepStore(MutableSequence):
+    """Agent memory steps with bounded memory use, a drop-in for AgentMemory.steps
+
+    The most recent steps stay in memory as they are. Older steps are written
+    to an append-only log in a temporary file and read back through mmap when
+    accessed, so a long run keeps only a few steps in RAM. Each step's model
+    input is a copy of the whole conversation so far; the log stores every
+    distinct text of it once, by content hash, and a spilled step only refers
+    to the hashes. Texts repeated across the steps still in memory are
+    interned to one string object.
+
+    Steps read back from the log are rebuilt like checkpointed steps: their
+    model input is left out and available through input_texts.
+    """
+
+    def __init__(self, directory: Optional[str] = None, keep_recent: int = step_store_keep_recent):
+        """
+        Args:
+            directory: Directory of the log file; the system temporary directory by default
+            keep_recent: Number of most recent steps kept in memory
+        """
+        self.directory = directory
+        self.keep_recent = max(1, keep_recent)
+        self.items: List[Any] = []
+        # Text hash -> location in the log
+        self.texts: Dict[str, Tuple[int, int]] = {}
+        self.interned: Dict[str, str] = {}
+        self.lock = threading.RLock()
+        self.log = None
+        self.map = None
+        self.size = 0
+
+    def _write(self, data: Any) -> Tuple[int, int]:
+        if self.log is None:
+            if self.directory:
+                os.makedirs(self.directory, exist_ok=True)
+            # Deleted automatically when closed, and by the OS if the process dies
+            self.log = tempfile.TemporaryFile(prefix="steps_", suffix=".log", dir=self.directory)
+        record = json.dumps(data).encode('utf-8')
+        self.log.seek(self.size)
+        self.log.write(record)
+        offset = self.size
+        self.size += len(record)
+        return offset, len(record)
+
+    def _read(self, offset: int, length: int) -> Any:
+        if self.map is None or len(self.map) < offset + length:
+            self.log.flush()
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.log.fileno(), self.size, access=mmap.ACCESS_READ)
+        return json.loads(self.map[offset:offset + length])
+
+    def _intern(self, step) -> None:
+        for message in getattr(step, "model_input_messages", None) or []:
+            content = message.get("content")
+            if isinstance(content, str):
+                message["content"] = self.interned.setdefault(content, content)
+                continue
+            for part in content or []:
+                if part.get("type") == "text":
+                    part["text"] = self.interned.setdefault(part["text"], part["text"])
+
+    def _spill(self) -> None:
+        """Write every step older than the most recent ones to the log"""
+        for index in range(len(self.items) - self.keep_recent):
+            step = self.items[index]
+            if isinstance(step, _Spilled):
+                continue
+            data = serialize_step(step)
+            if data is None:
+                # A step cut short without output; rare, and small without its model input
+                if isinstance(step, ActionStep):
+                    step.model_input_messages = None
+                continue
+            hashes = []
+            for role, text in _input_texts(step):
+                sha = _text_hash(text)
+                if sha not in self.texts:
+                    self.texts[sha] = self._write(text)
+                hashes.append((role, sha))
+            self.items[index] = _Spilled(*self._write(data), hashes)
+        # Only texts of the steps still in memory stay interned
+        self.interned = {}
+        for step in self.items:
+            if not isinstance(step, _Spilled):
+                self._intern(step)
+
+    def _load(self, item) -> Any:
+        if isinstance(item, _Spilled):
+            return deserialize_step(self._read(item.offset, item.length))
+        return item
+
+    def __getitem__(self, index):
+        with self.lock:
+            if isinstance(index, slice):
+                return [self._load(item) for item in self.items[index]]
+            return self._load(self.items[index])
+
+    def __setitem__(self, index, value) -> None:
+        with self.lock:
+            for step in (value if isinstance(index, slice) else [value]):
+                self._intern(step)
+            self.items[index] = list(value) if isinstance(index, slice) else value
+            self._spill()
+
+    def __delitem__(self, index) -> None:
+        with self.lock:
+            del self.items[index]
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def insert(self, index: int, value) -> None:
+        with self.lock:
+            self._intern(value)
+            self.items.insert(index, value)
+            self._spill()
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def input_texts(self, index: int, start: int = 0) -> List[Tuple[str, str]]:
+        """(role, text) of the text parts of a step's model input from the start-th on, also for spilled steps"""
+        with self.lock:
+            item = self.items[index]
+            if not isinstance(item, _Spilled):
+                return _input_texts(item)[start:]
+            return [(role, self._read(*self.texts[sha])) for role, sha in item.inputs[start:]]
+
+    def input_hashes(self, index: int) -> List[str]:
+        with self.lock:
+            item = self.items[index]
+            if not isinstance(item, _Spilled):
+                return [_text_hash(text) for _, text in _input_texts(item)]
+            return [sha for _, sha in item.inputs]
+
+    def close(self) -> None:
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+            self.items = []
+            self.texts = {}
+            self.interned = {}
+            self.size = 0
+
+
+def input_deltas(steps) -> Iterator[Tuple[Any, List[str]]]:
+    """Each step with the texts its model input adds to the previous step's
+
+    An action step's model input repeats the whole conversation before it;
+    the new part is what follows the longest run of texts it shares with the
+    previous action step's input. Other steps yield no texts. Works on a
+    StepStore or a plain list of steps.
+    """
+    previous: List[str] = []
+    for index in range(len(steps)):
+        step = steps[index]
+        if not isinstance(step, ActionStep):
+            yield step, []
+            continue
+        if isinstance(steps, StepStore):
+            hashes = steps.input_hashes(index)
+        else:
+            hashes = [_text_hash(text) for _, text in _input_texts(step)]
+        shared = 0
+        while shared < min(len(hashes), len(previous)) and hashes[shared] == previous[shared]:
+            shared += 1
+        if isinstance(steps, StepStore):
+            texts = [text for _, text in steps.input_texts(index, shared)]
+        else:
+            texts = [text for _, text in _input_texts(step)[shared:]]
+        previous = hashes
+        yield step, texts
+
+
+def use_step_store(agent, directory: Optional[str] = None, keep_recent: int = step_store_keep_recent) -> None:
+    """Keep an agent's memory steps in a StepStore, also after the memory is reset"""
+    memory = agent.memory
+
+    def reset():
+        if isinstance(memory.steps, StepStore):
+            memory.steps.close()
+        memory.steps = StepStore(directory, keep_recent)
+
+    memory.reset = reset
+    existing = list(memory.steps)
+    reset()
+    memory.steps.extend(existing)
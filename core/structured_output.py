@@ -0,0 +1,324 @@
+import os
+import re
+import ast
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+use_structured_outputs = os.getenv('USE_STRUCTURED_OUTPUTS', 'true').lower() == 'true'
+structured_output_model = os.getenv('STRUCTURED_OUTPUT_MODEL', "o3-mini-2025-01-31")
+
+QUESTIONS_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["questions"],
+    "properties": {
+        "questions": {"type": "array", "items": {"type": "string"}},
+    },
+}
+
+PLAN_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["summary", "steps"],
+    "properties": {
+        "summary": {"type": "string"},
+        "steps": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["title", "files", "instructions"],
+                "properties": {
+                    "title": {"type": "string"},
+                    "files": {"type": "array", "items": {"type": "string"}},
+                    "instructions": {"type": "string"},
+                },
+            },
+        },
+    },
+}
+
+REPAIR_PROMPT = """
+The reply below was meant to be JSON matching this JSON schema but could not be parsed.
+Rewrite it as JSON matching the schema, keeping its content. Respond with only the JSON.
+
+Schema:
+{schema}
+
+Reply:
+{reply}
+"""
+
+# Quotes some models put around JSON strings
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+
+def structured_output_kwargs(provider: Optional[str], name: str, schema: Dict) -> Dict:
+    """Completion arguments asking a provider for a reply in a JSON schema, in the way it supports
+
+    OpenAI models get a strict JSON schema response format, Anthropic models a
+    forced call of a tool taking the schema as its parameters and Google
+    models JSON mode. Other providers get nothing and rely on the prompt.
+
+    Args:
+        provider: Provider of the model, see provider_for_model
+        name: Name of the schema, also used as the tool name
+        schema: JSON schema of the reply
+
+    Returns:
+        Arguments to add to the chat completion request
+    """
+    if provider == "openai":
+        return {"response_format": {"type": "json_schema",
+                                    "json_schema": {"name": name, "schema": schema, "strict": True}}}
+    if provider == "anthropic":
+        return {"tools": [{"type": "function",
+                           "function": {"name": name, "description": f"Submit the {name}", "parameters": schema}}],
+                "tool_choice": {"type": "function", "function": {"name": name}}}
+    if provider == "google":
+        return {"response_format": {"type": "json_object"}}
+    return {}
+
+
+def message_text(message) -> str:
+    """JSON text of a structured reply: the arguments of its tool call, else its content"""
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        arguments = tool_call.function.arguments
+        return arguments if isinstance(arguments, str) else json.dumps(arguments)
+    return message.content or ""
+
+
+def _drop_trailing_comma(out: List[str]) -> None:
+    """Remove a comma, and the whitespace after it, from the end of the text built so far"""
+    end = len(out)
+    while end and out[end - 1].isspace():
+        end -= 1
+    if end and out[end - 1] == ",":
+        del out[end - 1:]
+
+
+# JSON literals and the Python ones literal_eval takes in their place
+PYTHON_LITERALS = {"true": "True", "false": "False", "null": "None"}
+
+
+def _to_python_literal(out: List[str]) -> None:
+    """Turn a JSON literal at the end of the text built so far into its Python spelling"""
+    end = start = len(out)
+    while start and (out[start - 1].isalnum() or out[start - 1] == "_"):
+        start -= 1
+    word = "".join(out[start:end])
+    if word in PYTHON_LITERALS:
+        out[start:end] = PYTHON_LITERALS[word]
+
+
+def _json_span(text: str, python: bool = False) -> Optional[str]:
+    """The first JSON object or array in the text
+
+    Trailing commas before a closing bracket are dropped (outside strings
+    only), and missing closing brackets are added if the text is cut off.
+    With python, true, false and null outside strings are spelled as
+    Python literals for ast.literal_eval.
+    """
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        return None
+    out: List[str] = []
+    closers = []
+    quote = None
+    escaped = False
+    for char in text[start:]:
+        if quote is not None:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+            out.append(char)
+            continue
+        if python and not (char.isalnum() or char == "_"):
+            _to_python_literal(out)
+        if char in "\"'":
+            quote = char
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        elif char in "}]":
+            _drop_trailing_comma(out)
+            if closers:
+                closers.pop()
+            if not closers:
+                return "".join(out) + char
+        out.append(char)
+    # Cut off: close the open string and brackets
+    if quote is not None:
+        out.append(quote)
+    elif python:
+        _to_python_literal(out)
+    _drop_trailing_comma(out)
+    return "".join(out) + "".join(reversed(closers))
+
+
+def _parse_span(text: str) -> Any:
+    span = _json_span(text)
+    if span is None:
+        raise ValueError("No JSON found in the reply")
+    try:
+        return json.loads(span)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return ast.literal_eval(_json_span(text, python=True))
+    except Exception as e:
+        # literal_eval raises all sorts, e.g. TypeError for {[1]: 2}; callers only handle ValueError
+        raise ValueError(f"Reply is not valid JSON: {type(e).__name__}: {str(e)}")
+
+
+def parse_json(text: str) -> Any:
+    """Parse JSON from a model reply, repairing the usual mistakes locally
+
+    Handles code fences, text around the JSON, smart quotes, trailing commas,
+    Python literals (single quotes, True, None) and replies cut off before
+    their closing brackets. The reply is read as it is first and only then
+    from inside its code fence, so a fence quoted in a string does not cut
+    the JSON short.
+
+    Raises:
+        ValueError: If no JSON can be recovered
+    """
+    text = (text or "").strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    text = text.translate(SMART_QUOTES)
+    try:
+        return _parse_span(text)
+    except ValueError as e:
+        error = e
+    # Up to the last closing fence, or to the end of a reply cut off inside the fence
+    fenced = (re.search(r"```(?:json)?\s*(.*)```", text, re.DOTALL)
+              or re.search(r"```(?:json)?\s*(.*)$", text, re.DOTALL))
+    if fenced is None:
+        raise error
+    return _parse_span(fenced.group(1))
+
+
+def coerce_questions(value: Any) -> List[str]:
+    """Questions from a parsed clarifier reply, a {"questions": [...]} object or a bare list
+
+    Raises:
+        ValueError: If the reply holds no questions
+    """
+    if isinstance(value, dict):
+        value = value.get("questions")
+    if not isinstance(value, list):
+        raise ValueError("Reply has no list of questions")
+    questions = [q.strip() for q in value if isinstance(q, str) and q.strip()]
+    if not questions:
+        raise ValueError("Reply has no questions")
+    return questions
+
+
+def coerce_plan(value: Any) -> Dict:
+    """Plan from a parsed planner reply: {"summary", "steps": [{"title", "files", "instructions"}]}
+
+    Steps given as bare strings, or without a title or instructions, are
+    completed from what they have. File paths are normalised.
+
+    Raises:
+        ValueError: If the reply holds no steps
+    """
+    if isinstance(value, list):
+        value = {"steps": value}
+    if not isinstance(value, dict) or not isinstance(value.get("steps"), list):
+        raise ValueError("Reply has no list of steps")
+    steps = []
+    for raw in value["steps"]:
+        if isinstance(raw, str):
+            raw = {"instructions": raw}
+        if not isinstance(raw, dict):
+            continue
+        title = str(raw.get("title") or "").strip()
+        instructions = str(raw.get("instructions") or raw.get("description") or "").strip()
+        files = raw.get("files") or []
+        files = [os.path.normpath(f.strip()) for f in (files if isinstance(files, list) else [files])
+                 if isinstance(f, str) and f.strip()]
+        if title or instructions:
+            steps.append({"title": title or instructions.splitlines()[0][:80],
+                          "files": files, "instructions": instructions or title})
+    if not steps:
+        raise ValueError("Reply has no steps")
+    return {"summary": str(value.get("summary") or "").strip(), "steps": steps}
+
+
+def fallback_questions(text: str) -> List[str]:
+    """Questions read line by line from a reply that is not JSON at all"""
+    questions = []
+    for line in (text or "").splitlines():
+        line = re.sub(r"^\s*(?:[-*]|\d+[.)])\s*", "", line).strip().strip('",')
+        if line.endswith("?"):
+            questions.append(line)
+    return questions
+
+
+def fallback_plan(text: str) -> Dict:
+    """A single-step plan holding a reply that is not JSON at all"""
+    return {"summary": "", "steps": [{"title": "Implement the task", "files": [], "instructions": text.strip()}]}
+
+
+def render_plan(plan: Dict) -> str:
+    """Markdown of a structured plan, for the agents and the logs"""
+    lines = [plan["summary"], ""] if plan.get("summary") else []
+    for i, step in enumerate(plan["steps"], 1):
+        files = f" ({', '.join(step['files'])})" if step["files"] else ""
+        lines.append(f"{i}. **{step['title']}**{files}")
+        lines.extend(f"   {line}" if line else "" for line in step["instructions"].splitlines())
+    return "\n".join(lines)
+
+
+def plan_work_items(plan: Dict) -> List[Dict]:
+    """Fan-out work items straight from a structured plan, empty if a step names no files
+
+    Each step becomes a {"files", "instructions"} item as split_plan returns
+    them; steps sharing files still need merging, see merge_overlapping.
+    """
+    steps = plan.get("steps") or []
+    if not steps or any(not step["files"] for step in steps):
+        return []
+    return [{"files": step["files"], "instructions": f"{step['title']}\n{step['instructions']}"} for step in steps]
+
+
+def structured_call(complete: Callable[[str, bool], str], prompt: str, name: str, schema: Dict,
+                    coerce: Callable[[Any], Any], fallback: Callable[[str], Any]) -> Any:
+    """Make one model call for a structured reply, repairing it rather than asking again
+
+    The reply is parsed with parse_json and checked by coerce. Only if that
+    fails is the model asked to fix the reply, with a short prompt holding the
+    reply and the schema, not the original prompt. If that fails too, fallback
+    salvages what it can from the first reply.
+
+    Args:
+        complete: Takes a prompt and whether to ask for the schema, returns the reply's JSON text
+        prompt: Prompt of the call
+        name: Name of the schema
+        schema: JSON schema of the reply
+        coerce: Turns the parsed reply into the result, raising ValueError if it does not fit
+        fallback: Turns a reply that cannot be repaired into the result
+
+    Returns:
+        The coerced reply
+    """
+    reply = complete(prompt, True)
+    try:
+        return coerce(parse_json(reply))
+    except ValueError as e:
+        logger.warning(f"Could not read the {name} reply ({str(e)}), asking the model to repair it")
+    try:
+        repaired = complete(REPAIR_PROMPT.format(schema=json.dumps(schema), reply=reply), True)
+        return coerce(parse_json(repaired))
+    except ValueError as e:
+        logger.warning(f"Could not repair the {name} reply ({str(e)}), reading it as text")
+    return fallback(reply)
@@ -0,0 +1,342 @@
+import os
+import re
+import ast
+import json
+import fnmatch
+import logging
+import threading
+import subprocess
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.codebase import (CODE_EXTENSIONS, GitignoreMatcher, iter_code_files, git_code_files, path_skip_reason,
+                           read_source)
+from core.git_snapshot import GitTree, file_blob_id
+
+logger = logging.getLogger(__name__)
+
+# Bump when the on-disk layout of the index changes
+INDEX_VERSION = 2
+
+# Maximum number of matches returned by a single query
+MAX_RESULTS = 50
+
+# Maximum number of lines shown for a definition
+MAX_SNIPPET_LINES = 30
+
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+# Tolerant definition patterns for the non-Python languages in CODE_EXTENSIONS
+DEFINITION_PATTERNS = {
+    ('.js', '.jsx', '.ts', '.tsx', '.vue'): [
+        (re.compile(r'^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)'), 'function'),
+        (re.compile(r'^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+([A-Za-z_$][\w$]*)'), 'class'),
+        (re.compile(r'^\s*(?:export\s+)?(?:interface|type|enum)\s+([A-Za-z_$][\w$]*)'), 'type'),
+        (re.compile(r'^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)'), 'variable'),
+        (re.compile(r'^\s*(?:public\s+|private\s+|protected\s+|static\s+|async\s+)*([A-Za-z_$][\w$]*)\s*\([^)]*\)\s*(?::\s*[^{]+)?\{\s*$'), 'method'),
+    ],
+    ('.go',): [
+        (re.compile(r'^func\s+(?:\([^)]*\)\s*)?([A-Za-z_]\w*)'), 'function'),
+        (re.compile(r'^type\s+([A-Za-z_]\w*)'), 'type'),
+        (re.compile(r'^(?:var|const)\s+([A-Za-z_]\w*)'), 'variable'),
+    ],
+    ('.java', '.c', '.cpp', '.h'): [
+        (re.compile(r'^\s*(?:(?:public|private|protected|static|final|abstract)\s+)*(?:class|interface|enum|struct|union)\s+([A-Za-z_]\w*)'), 'class'),
+        (re.compile(r'^\s*(?:(?:public|private|protected|static|final|abstract|inline|virtual|extern|const|unsigned|signed)\s+)*[A-Za-z_][\w:<>,\s\*&]*?[\s\*&]([A-Za-z_]\w*)\s*\([^;]*$'), 'function'),
+        (re.compile(r'^\s*#define\s+([A-Za-z_]\w*)'), 'macro'),
+    ],
+    ('.rs',): [
+        (re.compile(r'^\s*(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?(?:unsafe\s+)?fn\s+([A-Za-z_]\w*)'), 'function'),
+        (re.compile(r'^\s*(?:pub(?:\([^)]*\))?\s+)?(?:struct|enum|trait|type|union)\s+([A-Za-z_]\w*)'), 'type'),
+        (re.compile(r'^\s*(?:pub(?:\([^)]*\))?\s+)?(?:const|static)\s+([A-Za-z_]\w*)'), 'variable'),
+        (re.compile(r'^\s*macro_rules!\s+([A-Za-z_]\w*)'), 'macro'),
+    ],
+    ('.sql',): [
+        (re.compile(r'^\s*create\s+(?:or\s+replace\s+)?(?:table|view|function|procedure|index|type)\s+(?:if\s+not\s+exists\s+)?([\w\.]+)', re.I), 'table'),
+    ],
+}
+
+IMPORT_PATTERNS = {
+    ('.js', '.jsx', '.ts', '.tsx', '.vue'): re.compile(r'''(?:import\s+(?:[^'"]*\s+from\s+)?|require\s*\(\s*)['"]([^'"]+)['"]'''),
+    ('.go',): re.compile(r'^\s*(?:import\s+)?(?:[A-Za-z_]\w*\s+)?"([^"]+)"\s*$'),
+    ('.java',): re.compile(r'^\s*import\s+(?:static\s+)?([\w\.\*]+)\s*;'),
+    ('.c', '.cpp', '.h'): re.compile(r'^\s*#include\s*[<"]([^>"]+)[>"]'),
+    ('.rs',): re.compile(r'^\s*(?:pub\s+)?use\s+([\w:]+)'),
+}
+
+
+def _patterns_for(ext: str, table: Dict):
+    for extensions, patterns in table.items():
+        if ext in extensions:
+            return patterns
+    return None
+
+
+def index_python(source: str) -> Dict:
+    """Definitions, referenced names and imports of a python file, using ast"""
+    tree = ast.parse(source)
+    definitions = []
+    references: Dict[str, List[int]] = {}
+    imports = []
+
+    def visit_definitions(body, kind_prefix=""):
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                definitions.append([node.name, kind_prefix + ("method" if kind_prefix else "function"),
+                                    node.lineno, node.end_lineno])
+            elif isinstance(node, ast.ClassDef):
+                definitions.append([node.name, "class", node.lineno, node.end_lineno])
+                visit_definitions(node.body, kind_prefix=f"{node.name}.")
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)) and not kind_prefix:
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                for target in targets:
+                    if isinstance(target, ast.Name):
+                        definitions.append([target.id, "variable", node.lineno, node.end_lineno])
+
+    visit_definitions(tree.body)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            references.setdefault(node.id, []).append(node.lineno)
+        elif isinstance(node, ast.Attribute):
+            references.setdefault(node.attr, []).append(node.lineno)
+        elif isinstance(node, ast.Import):
+            imports.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            imports.append("." * node.level + (node.module or ""))
+    return {"definitions": definitions, "references": references, "imports": imports}
+
+
+def index_text(source: str, ext: str) -> Dict:
+    """Definitions, referenced names and imports of a non-python file, using regexes"""
+    definition_patterns = _patterns_for(ext, DEFINITION_PATTERNS) or []
+    import_pattern = _patterns_for(ext, IMPORT_PATTERNS)
+    definitions = []
+    references: Dict[str, List[int]] = {}
+    imports = []
+    for lineno, line in enumerate(source.splitlines(), 1):
+        for pattern, kind in definition_patterns:
+            match = pattern.match(line)
+            if match and match.group(1) not in ('if', 'for', 'while', 'switch', 'return', 'catch', 'else'):
+                definitions.append([match.group(1), kind, lineno, lineno])
+                break
+        if import_pattern is not None:
+            imports.extend(import_pattern.findall(line))
+        for name in set(IDENTIFIER.findall(line)):
+            references.setdefault(name, []).append(lineno)
+    return {"definitions": definitions, "references": references, "imports": imports}
+
+
+class SymbolIndex:
+    """Persistent index of definitions, references and imports over a project
+
+    Entries are kept per file together with its modification time and size, or
+    its git blob id when given the root's GitTree, so a refresh only
+    re-indexes files that changed. The index is saved as JSON to `index_path`
+    and reloaded on start-up.
+    """
+
+    def __init__(self, root: str, index_path: str, matcher: Optional[GitignoreMatcher] = None,
+                 git: Optional[GitTree] = None):
+        self.root = root
+        self.index_path = index_path
+        self.matcher = matcher
+        self.git = git
+        # Set when a watcher feeds on_change, making full refreshes unnecessary after the first
+        self.watched = False
+        self.synced = False
+        self.lock = threading.RLock()
+        self.files: Dict[str, Dict] = {}
+        self.dirty = False
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.index_path, 'r') as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION and data.get("root") == os.path.abspath(self.root):
+                self.files = data["files"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error loading symbol index {self.index_path}: {str(e)}")
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"version": INDEX_VERSION, "root": os.path.abspath(self.root), "files": self.files}, f)
+            os.replace(tmp_path, self.index_path)
+            self.dirty = False
+
+    def _key(self, path: str):
+        """Change key of a file: its blob id in git mode, else its modification time and size"""
+        if self.git is not None:
+            blob = file_blob_id(path)
+            if blob is None:
+                raise FileNotFoundError(path)
+            return blob
+        stat = os.stat(path)
+        return [stat.st_mtime, stat.st_size]
+
+    def update_file(self, rel_path: str, key=None) -> None:
+        """(Re-)index a single file, or drop it from the index if it no longer exists"""
+        rel_path = os.path.normpath(rel_path)
+        path = os.path.join(self.root, rel_path)
+        ext = os.path.splitext(rel_path)[1]
+        if ext not in CODE_EXTENSIONS:
+            return
+        with self.lock:
+            try:
+                if key is None:
+                    key = self._key(path)
+                source, reason = read_source(path, ext)
+                if reason is None:
+                    reason = path_skip_reason(rel_path)
+            except OSError:
+                source, reason = None, "unreadable"
+            if reason is not None:
+                if self.files.pop(rel_path, None) is not None:
+                    self.dirty = True
+                return
+            try:
+                entry = index_python(source) if ext == '.py' else index_text(source, ext)
+            except SyntaxError:
+                # Half-written python files are still searchable through the regex indexer
+                entry = index_text(source, ext)
+            entry["key"] = key
+            self.files[rel_path] = entry
+            self.dirty = True
+
+    def remove_file(self, rel_path: str) -> None:
+        with self.lock:
+            if self.files.pop(os.path.normpath(rel_path), None) is not None:
+                self.dirty = True
+
+    def refresh(self) -> None:
+        """Re-index files whose modification time or size changed and drop deleted ones"""
+        with self.lock:
+            seen = set()
+            for rel_path, key in self._listing():
+                seen.add(rel_path)
+                entry = self.files.get(rel_path)
+                if entry is None or entry.get("key") != key:
+                    self.update_file(rel_path, key)
+            for rel_path in set(self.files) - seen:
+                self.remove_file(rel_path)
+            self.save()
+
+    def _listing(self) -> List[Tuple[str, Any]]:
+        """(path relative to root, change key) of every indexable file"""
+        if self.git is not None:
+            try:
+                return [(rel_path, blob) for _, rel_path, _, blob in git_code_files(self.git)]
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.error(f"Error listing files with git, walking the tree instead: {str(e)}")
+        listing = []
+        for file_path, rel_path, _ in iter_code_files(self.root, self.matcher):
+            try:
+                listing.append((rel_path, self._key(file_path)))
+            except OSError:
+                continue
+        return listing
+
+    def ensure_fresh(self) -> None:
+        """Bring the index up to date before a query"""
+        if self.watched and self.synced:
+            self.save()
+        else:
+            self.refresh()
+            self.synced = True
+
+    def on_change(self, kind: str, rel_path: Optional[str]) -> None:
+        """Watcher callback: re-index or drop the changed file"""
+        if rel_path is None or os.path.basename(rel_path) == '.gitignore':
+            self.refresh()
+            return
+        with self.lock:
+            prefix = rel_path + os.sep
+            for indexed in [p for p in self.files if p == rel_path or p.startswith(prefix)]:
+                self.remove_file(indexed)
+            if kind == "deleted":
+                return
+            path = os.path.join(self.root, rel_path)
+            if os.path.isfile(path) and not (self.matcher and self.matcher.is_ignored(path)):
+                self.update_file(rel_path)
+
+    def _read_lines(self, rel_path: str) -> List[str]:
+        try:
+            with open(os.path.join(self.root, rel_path), 'r') as f:
+                return f.read().splitlines()
+        except (OSError, UnicodeDecodeError):
+            return []
+
+    def find_symbol(self, name: str) -> List[Dict]:
+        """Definitions whose name matches exactly, with their source snippet"""
+        results = []
+        with self.lock:
+            for rel_path, entry in sorted(self.files.items()):
+                for def_name, kind, start, end in entry["definitions"]:
+                    if def_name == name:
+                        results.append({"file": rel_path, "kind": kind, "line": start, "end_line": end})
+        for result in results[:MAX_RESULTS]:
+            lines = self._read_lines(result["file"])
+            end = min(result["end_line"], result["line"] + MAX_SNIPPET_LINES - 1)
+            if end == result["line"]:
+                # Regex matches only know their first line
+                end = min(len(lines), result["line"] + 9)
+            result["snippet"] = "\n".join(lines[result["line"] - 1:end])
+        return results[:MAX_RESULTS]
+
+    def find_references(self, name: str) -> List[Dict]:
+        """Lines that use a name, excluding its definition lines"""
+        results = []
+        with self.lock:
+            candidates = [(rel_path, entry) for rel_path, entry in sorted(self.files.items())
+                          if name in entry["references"]]
+        for rel_path, entry in candidates:
+            definition_lines = {start for def_name, _, start, _ in entry["definitions"] if def_name == name}
+            lines = self._read_lines(rel_path)
+            for lineno in sorted(set(entry["references"][name]) - definition_lines):
+                if lineno <= len(lines):
+                    results.append({"file": rel_path, "line": lineno, "text": lines[lineno - 1].strip()})
+                if len(results) >= MAX_RESULTS:
+                    return results
+        return results
+
+    def grep(self, pattern: str, path_glob: str = "") -> List[Dict]:
+        """Regex search over the indexed files"""
+        regex = re.compile(pattern)
+        results = []
+        with self.lock:
+            paths = sorted(self.files)
+        for rel_path in paths:
+            if path_glob and not fnmatch.fnmatch(rel_path, path_glob):
+                continue
+            for lineno, line in enumerate(self._read_lines(rel_path), 1):
+                if regex.search(line):
+                    results.append({"file": rel_path, "line": lineno, "text": line.strip()})
+                    if len(results) >= MAX_RESULTS:
+                        return results
+        return results
+
+    def imports_of(self, rel_path: str) -> List[str]:
+        with self.lock:
+            entry = self.files.get(os.path.normpath(rel_path))
+            return list(entry["imports"]) if entry else []
+
+
+def format_matches(matches: List[Dict]) -> str:
+    """Render query results as compact file:line entries"""
+    if not matches:
+        return "No matches found."
+    lines = []
+    for match in matches:
+        if "snippet" in match:
+            lines.append(f"### {match['file']}:{match['line']} ({match['kind']})\n{match['snippet']}")
+        else:
+            lines.append(f"{match['file']}:{match['line']}: {match['text']}")
+    if len(matches) >= MAX_RESULTS:
+        lines.append(f"(showing the first {MAX_RESULTS} matches)")
+    return "\n".join(lines)
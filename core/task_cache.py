@@ -0,0 +1,229 @@
+import os
+import re
+import json
+import math
+import time
+import uuid
+import difflib
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from core.git_snapshot import git_blob_id
+
+logger = logging.getLogger(__name__)
+
+task_cache_max_entries = int(os.getenv('TASK_CACHE_MAX_ENTRIES', '200'))
+task_cache_reuse_threshold = float(os.getenv('TASK_CACHE_REUSE_THRESHOLD', '0.95'))
+task_cache_hint_threshold = float(os.getenv('TASK_CACHE_HINT_THRESHOLD', '0.75'))
+task_cache_half_life_hours = float(os.getenv('TASK_CACHE_HALF_LIFE_HOURS', '168'))
+task_cache_max_diff_chars = int(os.getenv('TASK_CACHE_MAX_DIFF_CHARS', '20000'))
+
+# Bump when the on-disk layout of the cache changes
+CACHE_VERSION = 1
+
+WORD = re.compile(r'[a-z0-9_]+')
+
+
+def embed(text: str) -> Dict[str, float]:
+    """Sparse term vector of a task: word unigrams and bigrams with sublinear counts"""
+    words = WORD.findall(text.lower())
+    terms = Counter(words)
+    terms.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return {term: 1.0 + math.log(count) for term, count in terms.items()}
+
+
+def cosine(a: Dict[str, float], b: Dict[str, float], idf: Optional[Dict[str, float]] = None) -> float:
+    weight = (lambda term: idf.get(term, 1.0)) if idf else (lambda term: 1.0)
+    dot = sum(value * b[term] * weight(term) ** 2 for term, value in a.items() if term in b)
+    norm_a = math.sqrt(sum((value * weight(term)) ** 2 for term, value in a.items()))
+    norm_b = math.sqrt(sum((value * weight(term)) ** 2 for term, value in b.items()))
+    return dot / (norm_a * norm_b) if norm_a and norm_b else 0.0
+
+
+def diff_files(root: str, originals: Dict[str, Optional[str]], max_chars: int = task_cache_max_diff_chars) -> str:
+    """Unified diff of files against their contents before the run
+
+    Args:
+        root: Directory the paths are relative to
+        originals: rel_path -> contents before the run, None for files that did not exist
+        max_chars: Length at which the diff is cut off
+    """
+    lines = []
+    for rel_path in sorted(originals):
+        try:
+            with open(os.path.join(root, rel_path), 'r') as f:
+                current = f.read()
+        except (OSError, UnicodeDecodeError):
+            current = None
+        before = originals[rel_path]
+        if before == current:
+            continue
+        lines.extend(difflib.unified_diff(
+            (before or "").splitlines(keepends=True),
+            (current or "").splitlines(keepends=True),
+            fromfile=f"a/{rel_path}" if before is not None else "/dev/null",
+            tofile=f"b/{rel_path}" if current is not None else "/dev/null",
+        ))
+    diff = "".join(line if line.endswith("\n") else line + "\n" for line in lines)
+    return diff if len(diff) <= max_chars else diff[:max_chars] + "\n... (diff cut off)\n"
+
+
+class TaskCache:
+    """Persistent cache of completed tasks, looked up by similarity of their prompts
+
+    Each entry keeps the prompt's term vector, the playground it ran on, the
+    planning prompt and plan, the diff the run made and its outcome. Only
+    entries of the same playground are matched. Terms are weighted by how rare they
+    are across the cached tasks, so a match needs the distinctive words of a
+    task, not just "add" and "file". When the cache is full the entries with
+    the lowest value are evicted, where the value grows with the number of
+    times an entry was reused, halves every `half_life_hours` since it was last
+    used and is lower for failed runs.
+    """
+
+    def __init__(self, path: str, max_entries: int = task_cache_max_entries,
+                 half_life_hours: float = task_cache_half_life_hours):
+        self.path = path
+        self.max_entries = max_entries
+        self.half_life_hours = half_life_hours
+        self.lock = threading.RLock()
+        self.entries: Dict[str, Dict] = {}
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get("version") == CACHE_VERSION:
+                self.entries = data["entries"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error loading task cache {self.path}: {str(e)}")
+
+    def save(self) -> None:
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"version": CACHE_VERSION, "entries": self.entries}, f)
+            os.replace(tmp_path, self.path)
+
+    def _idf(self) -> Dict[str, float]:
+        document_frequency = Counter(term for entry in self.entries.values() for term in entry["vector"])
+        total = len(self.entries) + 1
+        return {term: math.log(total / (count + 1)) + 1.0 for term, count in document_frequency.items()}
+
+    def _value(self, entry: Dict, now: float) -> float:
+        age_hours = (now - entry["last_used"]) / 3600
+        outcome = 1.0 if entry["success"] else 0.25
+        return (1 + entry["hits"]) * outcome * 0.5 ** (age_hours / self.half_life_hours)
+
+    def lookup(self, prompt: str, playground: str, threshold: float = task_cache_hint_threshold) -> Optional[Dict]:
+        """Most similar cached task of the playground at or above threshold
+
+        Args:
+            prompt: The user's request
+            playground: Root of the playground the request runs on
+            threshold: Least similarity of a match
+
+        Returns:
+            dict: The entry with its "similarity", or None
+        """
+        playground = os.path.realpath(playground)
+        with self.lock:
+            candidates = [entry for entry in self.entries.values() if entry.get("playground") == playground]
+            if not candidates:
+                return None
+            vector = embed(prompt)
+            idf = self._idf()
+            best = max(candidates, key=lambda entry: cosine(vector, entry["vector"], idf))
+            similarity = cosine(vector, best["vector"], idf)
+            if similarity < threshold:
+                return None
+            logger.info(f"Task cache match {best['id']} with similarity {similarity:.2f}")
+            return {**{k: v for k, v in best.items() if k != "vector"}, "similarity": similarity}
+
+    def touch(self, entry_id: str) -> None:
+        """Count a reuse of an entry, keeping it in the cache longer"""
+        with self.lock:
+            entry = self.entries.get(entry_id)
+            if entry is None:
+                return
+            entry["hits"] += 1
+            entry["last_used"] = time.time()
+            self.save()
+
+    def add(self, prompt: str, playground: str, planning_prompt: Optional[str], plan: Optional[str], diff: str,
+            changed_files: List[str], success: bool, result: Optional[str] = None,
+            base_blobs: Optional[Dict[str, Optional[str]]] = None) -> str:
+        """Store a completed task, evicting the least valuable entries if the cache is full
+
+        Args:
+            prompt: The user's original request
+            playground: Root of the playground the task ran on
+            planning_prompt: Prompt the plan was generated from
+            plan: The implementation plan
+            diff: Unified diff of the changes the run made
+            changed_files: Files the run changed
+            success: Whether the run completed
+            result: Final answer of the run
+            base_blobs: Git blob id of each changed file before the run, None for new files; see base_blob_ids
+
+        Returns:
+            str: Id of the new entry
+        """
+        now = time.time()
+        entry = {
+            "id": uuid.uuid4().hex[:12],
+            "prompt": prompt,
+            "vector": embed(prompt),
+            "playground": os.path.realpath(playground),
+            "planning_prompt": planning_prompt,
+            "plan": plan,
+            "diff": diff,
+            "changed_files": sorted(changed_files),
+            "success": success,
+            "result": result,
+            "base_blobs": base_blobs or {},
+            "created": now,
+            "last_used": now,
+            "hits": 0,
+        }
+        with self.lock:
+            self.entries[entry["id"]] = entry
+            while len(self.entries) > max(1, self.max_entries):
+                evicted = min(self.entries.values(), key=lambda e: self._value(e, now))
+                del self.entries[evicted["id"]]
+                logger.debug(f"Evicted task cache entry {evicted['id']}")
+            self.save()
+        return entry["id"]
+
+
+def base_blob_ids(original_contents: Dict[str, Optional[str]]) -> Dict[str, Optional[str]]:
+    """Git blob ids of files as they were before a run, None for files the run created"""
+    return {rel_path: git_blob_id(content.encode('utf-8')) if content is not None else None
+            for rel_path, content in original_contents.items()}
+
+
+def plan_still_applies(entry: Dict, current_blobs: Dict[str, Optional[str]]) -> bool:
+    """Whether the files a cached task changed are still as they were before it ran
+
+    Args:
+        entry: Cached task
+        current_blobs: Current blob id of each file in the entry's "base_blobs", None for missing files
+    """
+    return all(current_blobs.get(rel_path) == blob for rel_path, blob in entry.get("base_blobs", {}).items())
+
+
+def format_cached_task(entry: Dict, include_plan: bool = True) -> str:
+    """Describe a cached task as a starting point for a new one"""
+    text = f"A similar earlier request was:\n{entry['prompt']}\n"
+    if include_plan and entry.get("plan"):
+        text += f"\nIts plan was:\n{entry['plan']}\n"
+    if entry.get("diff"):
+        text += f"\nIts changes were:\n```diff\n{entry['diff']}```\n"
+    text += "\nUse this as a starting point only: check the current code, parts of it may already be in place."
+    return text
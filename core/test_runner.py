@@ -0,0 +1,207 @@
+import os
+import re
+import ast
+import sys
+import logging
+import subprocess
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+# Load environment variables
+load_dotenv()
+
+from core import link_guard
+from core.sandbox import SANDBOX_DIRNAME
+
+logger = logging.getLogger(__name__)
+
+test_runner_workers = int(os.getenv('TEST_RUNNER_WORKERS', '4'))
+test_runner_timeout = float(os.getenv('TEST_RUNNER_TIMEOUT', '120'))
+
+# Directories never searched for modules or tests
+SKIPPED_DIRS = {SANDBOX_DIRNAME, '.git', '__pycache__', 'node_modules', '.venv', 'venv', '.tox', '.pytest_cache'}
+
+# Maximum characters of output kept per failing test file
+MAX_FAILURE_CHARS = 1500
+
+
+def is_test_file(rel_path: str) -> bool:
+    """Whether a file follows the pytest naming convention for test modules"""
+    name = os.path.basename(rel_path)
+    return name.endswith('.py') and (name.startswith('test_') or name.endswith('_test.py'))
+
+
+def module_name(rel_path: str) -> str:
+    """Dotted module name of a python file relative to the project root"""
+    parts = rel_path[:-3].replace(os.sep, '/').split('/')
+    if parts[-1] == '__init__':
+        parts = parts[:-1]
+    return '.'.join(parts)
+
+
+def parse_imports(source: str, rel_path: str) -> Set[str]:
+    """Return the absolute module names imported by a python source file"""
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return set()
+
+    package = module_name(rel_path).split('.')
+    if not rel_path.endswith('__init__.py'):
+        package = package[:-1]
+
+    imports = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = package[:len(package) - node.level + 1]
+                prefix = '.'.join(base + ([node.module] if node.module else []))
+            else:
+                prefix = node.module or ''
+            imports.add(prefix)
+            # `from package import module` imports a submodule
+            imports.update(f"{prefix}.{alias.name}" if prefix else alias.name for alias in node.names)
+    return imports
+
+
+class ImportGraph:
+    """Incrementally maintained import graph over the python files of a project
+
+    Files are re-parsed only when their modification time or size changes.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        # rel_path -> ((mtime, size), imported module names)
+        self.entries: Dict[str, Tuple[Tuple[float, int], Set[str]]] = {}
+
+    def python_files(self) -> Iterable[str]:
+        for dirpath, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if d not in SKIPPED_DIRS and not d.startswith('.')]
+            for file in files:
+                if file.endswith('.py'):
+                    yield os.path.relpath(os.path.join(dirpath, file), self.root)
+
+    def refresh(self) -> None:
+        seen = set()
+        for rel_path in self.python_files():
+            seen.add(rel_path)
+            try:
+                stat = os.stat(os.path.join(self.root, rel_path))
+            except OSError:
+                continue
+            key = (stat.st_mtime, stat.st_size)
+            entry = self.entries.get(rel_path)
+            if entry is not None and entry[0] == key:
+                continue
+            try:
+                with open(os.path.join(self.root, rel_path), 'r') as f:
+                    imports = parse_imports(f.read(), rel_path)
+            except Exception as e:
+                logger.error(f"Error reading {rel_path}: {str(e)}")
+                imports = set()
+            self.entries[rel_path] = (key, imports)
+        for rel_path in set(self.entries) - seen:
+            del self.entries[rel_path]
+
+    def dependencies(self) -> Dict[str, Set[str]]:
+        """Map each file to the project files it imports directly"""
+        modules = {module_name(rel_path): rel_path for rel_path in self.entries}
+        graph = {}
+        for rel_path, (_, imports) in self.entries.items():
+            graph[rel_path] = {modules[name] for name in imports if name in modules} - {rel_path}
+        return graph
+
+    def affected_tests(self, changed: Iterable[str]) -> List[str]:
+        """Return the test files that import any changed file, directly or transitively"""
+        self.refresh()
+        graph = self.dependencies()
+        changed = {os.path.normpath(path) for path in changed}
+
+        dependents: Dict[str, Set[str]] = {}
+        for rel_path, deps in graph.items():
+            for dep in deps:
+                dependents.setdefault(dep, set()).add(rel_path)
+
+        affected = set(changed)
+        frontier = list(changed)
+        while frontier:
+            for dependent in dependents.get(frontier.pop(), ()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    frontier.append(dependent)
+        return sorted(path for path in affected if path in graph and is_test_file(path))
+
+    def all_tests(self) -> List[str]:
+        self.refresh()
+        return sorted(path for path in self.entries if is_test_file(path))
+
+
+_graphs: Dict[str, ImportGraph] = {}
+
+
+def get_import_graph(root: str) -> ImportGraph:
+    root = os.path.abspath(root)
+    if root not in _graphs:
+        _graphs[root] = ImportGraph(root)
+    return _graphs[root]
+
+
+def _summarise_output(output: str) -> str:
+    """Keep the failure summary lines and the end of a test run's output"""
+    summary = [line for line in output.splitlines()
+               if line.startswith(('FAILED', 'ERROR')) or re.match(r'^\S+\.py:\d+:', line)]
+    text = "\n".join(summary) if summary else output.strip()
+    if len(text) > MAX_FAILURE_CHARS:
+        text = "..." + text[-MAX_FAILURE_CHARS:]
+    return text
+
+
+def _run_test_file(root: str, rel_path: str, timeout: float) -> Tuple[str, bool, str]:
+    if importlib.util.find_spec('pytest') is not None:
+        module_args = ['pytest', '-q', '--tb=line', '-rfE', '-p', 'no:cacheprovider', rel_path]
+    else:
+        module_args = ['unittest', module_name(rel_path)]
+    # Project files may be hardlinked to a workspace or its base; a test writing one copies it first
+    command = [sys.executable, link_guard.__file__, os.path.abspath(root), '-m', *module_args]
+    try:
+        # Keep bytecode and caches out of the project, whose files may be shared with a workspace base
+        env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+        completed = subprocess.run(command, cwd=root, capture_output=True, text=True, timeout=timeout, env=env)
+    except subprocess.TimeoutExpired:
+        return rel_path, False, f"Timed out after {timeout} seconds"
+    # pytest exits with 5 when a file has no tests, which is not a failure
+    passed = completed.returncode in (0, 5)
+    return rel_path, passed, "" if passed else _summarise_output(completed.stdout + completed.stderr)
+
+
+def run_affected_tests(root: str, changed: Optional[Iterable[str]] = None,
+                       workers: int = test_runner_workers, timeout: float = test_runner_timeout) -> str:
+    """Run the tests affected by the changed files in parallel and summarise failures
+
+    Args:
+        root: Project root the tests are discovered in and run from
+        changed: Paths relative to root that changed; if None, every test is run
+        workers: Number of test files run concurrently
+        timeout: Seconds allowed per test file
+
+    Returns:
+        str: Compact summary listing only failing test files and their errors
+    """
+    graph = get_import_graph(root)
+    tests = graph.all_tests() if changed is None else graph.affected_tests(changed)
+    if not tests:
+        return "No tests found." if changed is None else "No tests are affected by the changed files."
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(lambda path: _run_test_file(root, path, timeout), tests))
+
+    failures = [(path, output) for path, passed, output in results if not passed]
+    lines = [f"Ran {len(tests)} test file(s): {len(tests) - len(failures)} passed, {len(failures)} failed."]
+    for path, output in failures:
+        lines.append(f"\n### {path}\n{output}")
+    return "\n".join(lines)
@@ -0,0 +1,236 @@
+import os
+import sys
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from core.sandbox import SANDBOX_DIRNAME
+
+logger = logging.getLogger(__name__)
+
+# Event kinds passed to subscribers
+MODIFIED = "modified"
+DELETED = "deleted"
+RESCAN = "rescan"
+
+# Directories whose contents never matter to the agents
+IGNORED_DIRS = {SANDBOX_DIRNAME, '.git', '__pycache__'}
+
+# inotify constants from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ATTRIB
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class PlaygroundWatcher:
+    """Pushes file change events under a directory to subscribers
+
+    Uses inotify on Linux and falls back to polling modification times elsewhere
+    (or when inotify is unavailable). If a directory cannot be watched, for
+    example once the inotify watch limit is reached, the watcher switches to
+    polling so no change goes unnoticed. Tools that write files should also call
+    `notify` so subscribers see their own writes immediately instead of waiting
+    for the kernel event, which then arrives as a harmless duplicate.
+
+    Subscribers are called as `callback(kind, rel_path)` with kind one of
+    "modified", "deleted" (for files and whole directories) or "rescan" (rel_path
+    None, sent when events may have been lost).
+    """
+
+    def __init__(self, root: str, poll_interval: float = 2.0):
+        self.root = os.path.normpath(root)
+        self.poll_interval = poll_interval
+        self.subscribers: List[Callable[[str, Optional[str]], None]] = []
+        self.mode = None
+        self.stopped = threading.Event()
+        self.thread = None
+        self.fd = None
+        self.watches: Dict[int, str] = {}
+        # Set when a directory could not be watched; inotify then gives way to polling
+        self.watch_failed = False
+        self.states: Dict[str, Tuple[float, int]] = {}
+
+    @property
+    def active(self) -> bool:
+        """Whether change events are currently being delivered"""
+        return self.thread is not None and self.thread.is_alive()
+
+    def subscribe(self, callback: Callable[[str, Optional[str]], None]) -> None:
+        self.subscribers.append(callback)
+
+    def notify(self, rel_path: Optional[str], kind: str = MODIFIED) -> None:
+        """Deliver an event to every subscriber"""
+        if rel_path is not None:
+            rel_path = os.path.normpath(rel_path)
+        for callback in self.subscribers:
+            try:
+                callback(kind, rel_path)
+            except Exception as e:
+                logger.error(f"Error handling {kind} event for {rel_path}: {str(e)}")
+
+    def start(self) -> None:
+        if self.active:
+            return
+        self.stopped.clear()
+        if sys.platform.startswith('linux') and self._init_inotify():
+            self.mode = "inotify"
+            target = self._inotify_loop
+        else:
+            self.mode = "polling"
+            # Take the baseline before returning so no write after start() is missed
+            self.states = self._scan()
+            target = self._poll_loop
+        self.thread = threading.Thread(target=target, name="playground-watcher", daemon=True)
+        self.thread.start()
+        logger.info(f"Watching {self.root} using {self.mode}")
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(self.poll_interval + 1)
+        self._close_inotify()
+
+    def _rel(self, path: str) -> str:
+        return os.path.relpath(path, self.root)
+
+    # inotify backend
+
+    def _init_inotify(self) -> bool:
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable, falling back to polling: {str(e)}")
+            return False
+        self.fd = fd
+        self.watches = {}
+        self.watch_failed = False
+        self._add_watches(self.root)
+        if self.watch_failed:
+            logger.warning("Not every directory could be watched with inotify, falling back to polling")
+            self._close_inotify()
+            return False
+        return True
+
+    def _close_inotify(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.watches = {}
+
+    def _add_watches(self, directory: str) -> List[str]:
+        """Watch a directory tree and return the files already in it"""
+        files = []
+        for dirpath, dirs, filenames in os.walk(directory):
+            dirs[:] = [d for d in dirs if d not in IGNORED_DIRS]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    logger.warning("inotify watch limit reached, some directories are not watched")
+                else:
+                    logger.warning(f"Could not watch {dirpath}: {os.strerror(err)}")
+                self.watch_failed = True
+                continue
+            self.watches[wd] = dirpath
+            files.extend(os.path.join(dirpath, name) for name in filenames)
+        return files
+
+    def _inotify_loop(self) -> None:
+        while not self.stopped.is_set():
+            ready, _, _ = select.select([self.fd], [], [], self.poll_interval)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += EVENT_HEADER.size + length
+                self._handle_inotify_event(wd, mask, os.fsdecode(name))
+            if self.watch_failed:
+                self._switch_to_polling()
+                return
+
+    def _switch_to_polling(self) -> None:
+        """Continue in polling mode after a directory could not be watched"""
+        logger.warning(f"A new directory under {self.root} could not be watched, switching to polling")
+        self._close_inotify()
+        self.mode = "polling"
+        self.states = self._scan()
+        # Changes in the unwatched directory may have been missed before the baseline
+        self.notify(None, RESCAN)
+        self._poll_loop()
+
+    def _handle_inotify_event(self, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            self.notify(None, RESCAN)
+            return
+        if mask & (IN_IGNORED | IN_DELETE_SELF):
+            self.watches.pop(wd, None)
+            return
+        directory = self.watches.get(wd)
+        if directory is None or not name:
+            return
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if name in IGNORED_DIRS:
+                return
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # Files may have been written before the watch was in place
+                for file_path in self._add_watches(path):
+                    self.notify(self._rel(file_path))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.notify(self._rel(path), DELETED)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.notify(self._rel(path), DELETED)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_ATTRIB | IN_CREATE):
+            self.notify(self._rel(path))
+
+    # polling backend
+
+    def _scan(self) -> Dict[str, Tuple[float, int]]:
+        states = {}
+        for dirpath, dirs, filenames in os.walk(self.root):
+            dirs[:] = [d for d in dirs if d not in IGNORED_DIRS]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                states[self._rel(path)] = (stat.st_mtime, stat.st_size)
+        return states
+
+    def _poll_loop(self) -> None:
+        while not self.stopped.wait(self.poll_interval):
+            current = self._scan()
+            for rel_path, state in current.items():
+                if self.states.get(rel_path) != state:
+                    self.notify(rel_path)
+            for rel_path in self.states.keys() - current.keys():
+                self.notify(rel_path, DELETED)
+            self.states = current
@@ -0,0 +1,251 @@
+import os
+import queue
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+from core.model_calls import RunCancelled, set_cancel_event, CANCEL_POLL_SECONDS
+from core.profiling import maybe_profile
+
+logger = logging.getLogger(__name__)
+
+web_queue_size = int(os.getenv('WEB_QUEUE_SIZE', '20'))
+web_answer_timeout = float(os.getenv('WEB_ANSWER_TIMEOUT', '600'))
+
+# Answer used when the user does not answer a clarifying question in time, as in batch mode
+NO_ANSWER = "No answer given, use your best judgement."
+
+
+class Job:
+    """One web request: its prompt, the events of its run and the user's answers"""
+
+    def __init__(self, prompt: str):
+        self.id = uuid.uuid4().hex[:8]
+        self.prompt = prompt
+        self.events: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self.answers: "queue.Queue[str]" = queue.Queue()
+        self.cancelled = threading.Event()
+        self.status = "queued"
+        self.waiting_for_answer = False
+
+    def ask(self, index: int, question: str, timeout: float = web_answer_timeout) -> str:
+        """Send a clarifying question to the UI and block until the user answers it
+
+        A user who left the page never answers, and the pipeline worker serves
+        the whole queue, so after timeout seconds the run goes on without an
+        answer.
+        """
+        self.events.put({"type": "question", "index": index, "question": question})
+        self.waiting_for_answer = True
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                try:
+                    return self.answers.get(timeout=CANCEL_POLL_SECONDS)
+                except queue.Empty:
+                    if self.cancelled.is_set():
+                        raise RunCancelled("The run was cancelled")
+                    if time.monotonic() >= deadline:
+                        logger.info(f"No answer to question {index} of web request {self.id} in {timeout:.0f}s")
+                        self.events.put({"type": "answer", "content": NO_ANSWER})
+                        return NO_ANSWER
+        finally:
+            self.waiting_for_answer = False
+
+    def answer(self, text: str) -> None:
+        self.events.put({"type": "answer", "content": text})
+        self.answers.put(text)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "cancelled", "error")
+
+
+class PipelineRunner:
+    """Runs web requests through the full pipeline in a background worker, one at a time
+
+    The playground and the agents are shared, so requests wait in a queue
+    while another one runs. Each job gets the progress messages and agent
+    steps of its run as events. Cancelling a queued job removes it from the
+    queue; cancelling the running job abandons its in-flight model calls and
+    stops its agents after their current step. With profile set, every job
+    writes a profile, see core.profiling.
+    """
+
+    def __init__(self, coding, max_queue: int = web_queue_size, profile: bool = False):
+        self.coding = coding
+        self.profile = profile
+        self.max_queue = max_queue
+        self.pending = deque()
+        self.current: Optional[Job] = None
+        self.condition = threading.Condition()
+        self.worker = threading.Thread(target=self._work, name="web-pipeline", daemon=True)
+        self.worker.start()
+
+    def submit(self, prompt: str) -> Job:
+        with self.condition:
+            if len(self.pending) >= self.max_queue:
+                raise ValueError(f"The queue is full ({self.max_queue} requests), try again later")
+            job = Job(prompt)
+            self.pending.append(job)
+            self.condition.notify()
+        return job
+
+    def position(self, job: Job) -> Optional[int]:
+        """Number of requests ahead of the job plus one, 0 while it runs and None once it finished"""
+        with self.condition:
+            if job is self.current:
+                return 0
+            if job in self.pending:
+                return self.pending.index(job) + 1 + (self.current is not None)
+        return None
+
+    def cancel(self, job: Job) -> None:
+        job.cancelled.set()
+        with self.condition:
+            if job in self.pending:
+                self.pending.remove(job)
+                job.status = "cancelled"
+                job.events.put({"type": "cancelled"})
+
+    def _work(self) -> None:
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                self.current = self.pending.popleft()
+            try:
+                self._run(self.current)
+            finally:
+                with self.condition:
+                    self.current = None
+
+    def _run(self, job: Job) -> None:
+        job.status = "running"
+        job.events.put({"type": "started"})
+        set_cancel_event(job.cancelled)
+        self.coding.on_event = job.events.put
+        try:
+            with maybe_profile(self.profile, f"web_{job.id}"):
+                result = self.coding.run_terminal(job.prompt, ask_user=job.ask)
+            job.status = "done"
+            job.events.put({"type": "done", "result": result})
+        except RunCancelled:
+            job.status = "cancelled"
+            job.events.put({"type": "cancelled"})
+        except Exception as e:
+            logger.error(f"Error running web request {job.id}: {str(e)}", exc_info=True)
+            job.status = "error"
+            job.events.put({"type": "error", "error": f"{type(e).__name__}: {str(e)}"})
+        finally:
+            self.coding.on_event = None
+            set_cancel_event(None)
+
+
+def launch_web_ui(coding, profile: bool = False, **launch_kwargs) -> None:
+    """Serve the Gradio front-end of the pipeline
+
+    Each request runs the same stages as the terminal interface. Progress
+    messages and agent steps are streamed into the chat as they happen,
+    clarifying questions are answered in the chat, and the Cancel button stops
+    the running request. With profile set, each request writes a profile.
+    """
+    import gradio as gr
+    from smolagents.gradio_ui import pull_messages_from_step
+
+    runner = PipelineRunner(coding, profile=profile)
+
+    def event_messages(event):
+        kind = event["type"]
+        if kind == "message":
+            return [gr.ChatMessage(role="assistant", content=event["content"])]
+        if kind == "question":
+            return [gr.ChatMessage(role="assistant", content=f"**Question {event['index']}:** {event['question']}\n\n"
+                                                             "Type your answer in the box below.")]
+        if kind == "answer":
+            return [gr.ChatMessage(role="user", content=event["content"])]
+        if kind == "step":
+            return list(pull_messages_from_step(event["step"]))
+        if kind == "done":
+            return [gr.ChatMessage(role="assistant", content=f"**Result:**\n\n{event['result']}")]
+        if kind == "cancelled":
+            return [gr.ChatMessage(role="assistant", content="Cancelled.")]
+        if kind == "error":
+            return [gr.ChatMessage(role="assistant", content=f"**Error:** {event['error']}")]
+        return []
+
+    def send(text, history, job):
+        text = (text or "").strip()
+        if not text:
+            yield gr.update(), job, ""
+            return
+        if job is not None and job.waiting_for_answer:
+            # The running request's stream shows the answer
+            job.answer(text)
+            yield gr.update(), job, ""
+            return
+        if job is not None and not job.finished:
+            yield history + [gr.ChatMessage(role="assistant", content="A request is still running; cancel it first.")], job, text
+            return
+
+        history = history + [gr.ChatMessage(role="user", content=text)]
+        try:
+            job = runner.submit(text)
+        except ValueError as e:
+            yield history + [gr.ChatMessage(role="assistant", content=str(e))], None, ""
+            return
+
+        try:
+            yield from stream(job, history)
+        finally:
+            # The stream closes early when the page is closed; nobody is left to watch the job
+            if not job.finished:
+                logger.info(f"Stream of web request {job.id} closed, cancelling it")
+                runner.cancel(job)
+
+    def stream(job, history):
+        status_index = None
+        last_position = None
+        while True:
+            position = runner.position(job)
+            if position and position != last_position:
+                status = gr.ChatMessage(role="assistant", content=f"Waiting in queue: position {position}")
+                if status_index is None:
+                    status_index = len(history)
+                    history = history + [status]
+                else:
+                    history = history[:status_index] + [status] + history[status_index + 1:]
+                last_position = position
+                yield history, job, ""
+            try:
+                event = job.events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if event["type"] == "started" and status_index is not None:
+                history = history[:status_index] + history[status_index + 1:]
+                status_index = None
+            history = history + event_messages(event)
+            yield history, job, ""
+            if event["type"] in ("done", "cancelled", "error"):
+                return
+
+    def cancel(job):
+        if job is not None and not job.finished:
+            runner.cancel(job)
+
+    with gr.Blocks(title="MultiAgent Coding") as demo:
+        chatbot = gr.Chatbot(type="messages", height=650, label="MultiAgent Coding")
+        job_state = gr.State(None)
+        with gr.Row():
+            text_input = gr.Textbox(scale=8, show_label=False,
+                                    placeholder="Describe a coding task, or answer a question")
+            cancel_button = gr.Button("Cancel", scale=1, variant="stop")
+        # Runs are queued by the runner; answers must get through while a request streams
+        text_input.submit(send, [text_input, chatbot, job_state], [chatbot, job_state, text_input],
+                          concurrency_limit=None)
+        cancel_button.click(cancel, [job_state], None, concurrency_limit=None)
+
+    demo.queue(default_concurrency_limit=None).launch(**launch_kwargs)
@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import shutil
+import difflib
+import logging
+import threading
+import uuid
+from typing import Dict, List, Optional, Tuple, Union
+
+from core.sandbox import SANDBOX_DIRNAME
+
+logger = logging.getLogger(__name__)
+
+# Never linked into a workspace: git updates its files in place
+WORKSPACE_SKIPPED_DIRS = {SANDBOX_DIRNAME, '.git', '__pycache__'}
+
+# Workspaces opened in this process, by path
+_open_workspaces: Dict[str, "Workspace"] = {}
+_open_lock = threading.Lock()
+
+
+def replace_file(path: str, content: Union[str, bytes]) -> None:
+    """Write a file by renaming a new file over it
+
+    Other workspaces hardlinked to the old file keep the old contents, and
+    readers never see a half-written file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f".{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with open(temp_path, 'xb' if isinstance(content, bytes) else 'x') as f:
+            f.write(content)
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _stat_key(stat: os.stat_result) -> Tuple[int, int, int]:
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _read_bytes(path: str) -> Optional[bytes]:
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+class Workspace:
+    """Private copy-on-write view of a playground
+
+    The workspace is a real directory that starts empty and is filled with
+    hardlinks to the base files by a background thread, so creating one takes
+    milliseconds whatever the size of the base, and no file contents are ever
+    copied. Until the links are in place `resolve` falls through to the base
+    for reads. Writes must replace files (see `replace_file`) rather than
+    change them in place, which keeps them private to the workspace. Code
+    that may write files in place (sandboxed snippets, tests) runs with
+    `core.link_guard`, which copies a linked file up when it is opened for
+    writing, in the workspace or in the base.
+
+    `diff` lists what the workspace changed, `commit` writes the changes back
+    to the base (leaving out files the base changed in the meantime) and
+    `discard` deletes the workspace. Metadata lives next to the workspace in
+    `<path>.workspace.json`, so a workspace can be reopened by another process.
+    """
+
+    def __init__(self, path: str, base: str):
+        self.path = os.path.normpath(path)
+        self.base = os.path.abspath(base)
+        self.meta_path = self.path + ".workspace.json"
+        # rel_path -> stat key of the base file when it was linked
+        self.base_state: Dict[str, Tuple[int, int, int]] = {}
+        self.deleted = set()
+        self.materialized = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.created = time.time()
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.normpath(path) + ".workspace.json")
+
+    @classmethod
+    def create(cls, base: str, path: str) -> "Workspace":
+        """Create a workspace of base at path and start linking the base files into it"""
+        workspace = cls(path, base)
+        os.makedirs(workspace.path, exist_ok=True)
+        workspace._save_meta()
+        with _open_lock:
+            _open_workspaces[workspace.path] = workspace
+        workspace._start_materializing()
+        logger.debug(f"Created workspace {workspace.path} of {workspace.base}")
+        return workspace
+
+    @classmethod
+    def open(cls, path: str) -> "Workspace":
+        """Open an existing workspace, finishing its links if they were interrupted"""
+        path = os.path.normpath(path)
+        with _open_lock:
+            if path in _open_workspaces:
+                return _open_workspaces[path]
+            with open(path + ".workspace.json", 'r') as f:
+                meta = json.load(f)
+            workspace = cls(path, meta["base"])
+            workspace.created = meta.get("created", workspace.created)
+            workspace.base_state = {rel: tuple(key) for rel, key in meta.get("base_state", {}).items()}
+            workspace.deleted = set(meta.get("deleted", []))
+            _open_workspaces[path] = workspace
+        if meta.get("materialized"):
+            workspace.materialized.set()
+        else:
+            workspace._start_materializing()
+        return workspace
+
+    def _save_meta(self) -> None:
+        meta = {
+            "base": self.base,
+            "created": self.created,
+            "materialized": self.materialized.is_set(),
+            "base_state": self.base_state,
+            "deleted": sorted(self.deleted),
+        }
+        temp_path = self.meta_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, self.meta_path)
+
+    def _start_materializing(self) -> None:
+        self.thread = threading.Thread(target=self._materialize, name="workspace-materialize", daemon=True)
+        self.thread.start()
+
+    def _materialize(self) -> None:
+        try:
+            for directory, dirs, files in os.walk(self.base):
+                dirs[:] = [d for d in dirs if d not in WORKSPACE_SKIPPED_DIRS]
+                rel_dir = os.path.relpath(directory, self.base)
+                os.makedirs(os.path.join(self.path, rel_dir), exist_ok=True)
+                for name in files:
+                    self._link(os.path.normpath(os.path.join(rel_dir, name)))
+            with self.lock:
+                self.materialized.set()
+                self._save_meta()
+        except Exception as e:
+            logger.error(f"Error filling workspace {self.path}: {str(e)}")
+            # Unblock waiters; resolve keeps falling through to the base
+            self.materialized.set()
+
+    def _link(self, rel_path: str) -> None:
+        source = os.path.join(self.base, rel_path)
+        target = os.path.join(self.path, rel_path)
+        with self.lock:
+            if rel_path in self.deleted or rel_path in self.base_state:
+                return
+            try:
+                stat = os.stat(source)
+            except OSError:
+                return
+            try:
+                os.link(source, target)
+            except FileExistsError:
+                # Written in the workspace before the link was made
+                pass
+            except OSError:
+                # Different filesystem
+                shutil.copy2(source, target)
+            self.base_state[rel_path] = _stat_key(stat)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until every base file is linked into the workspace"""
+        return self.materialized.wait(timeout)
+
+    def resolve(self, rel_path: str) -> str:
+        """Path to read rel_path from: the workspace copy, or the base file while it is not linked yet"""
+        rel_path = os.path.normpath(rel_path)
+        path = os.path.join(self.path, rel_path)
+        if self.materialized.is_set() or os.path.exists(path) or rel_path in self.deleted:
+            return path
+        base_path = os.path.join(self.base, rel_path)
+        return base_path if os.path.exists(base_path) else path
+
+    def delete(self, rel_path: str) -> None:
+        """Delete a file from the workspace only"""
+        rel_path = os.path.normpath(rel_path)
+        with self.lock:
+            self.deleted.add(rel_path)
+            path = os.path.join(self.path, rel_path)
+            if os.path.exists(path):
+                os.remove(path)
+            self._save_meta()
+
+    def diff(self) -> List[Dict[str, str]]:
+        """Files the workspace added, modified or deleted relative to the base
+
+        Returns:
+            List of {"path", "status"} with status "added", "modified" or "deleted"
+        """
+        self.wait()
+        changes = []
+        seen = set()
+        for directory, dirs, files in os.walk(self.path):
+            dirs[:] = [d for d in dirs if d not in WORKSPACE_SKIPPED_DIRS]
+            for name in files:
+                path = os.path.join(directory, name)
+                rel_path = os.path.relpath(path, self.path)
+                seen.add(rel_path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                known = self.base_state.get(rel_path)
+                if known is not None and stat.st_ino == known[0]:
+                    # Still the linked base file
+                    continue
+                base_content = _read_bytes(os.path.join(self.base, rel_path)) if known is not None else None
+                if known is None:
+                    changes.append({"path": rel_path, "status": "added"})
+                elif base_content != _read_bytes(path):
+                    changes.append({"path": rel_path, "status": "modified"})
+        for rel_path in set(self.base_state) - seen:
+            changes.append({"path": rel_path, "status": "deleted"})
+        return sorted(changes, key=lambda change: change["path"])
+
+    def diff_text(self, paths: Optional[List[str]] = None) -> str:
+        """Unified diff of the workspace against the base, optionally limited to some paths"""
+        lines = []
+        for change in self.diff():
+            if paths is not None and change["path"] not in paths:
+                continue
+            rel_path = change["path"]
+            before = _read_bytes(os.path.join(self.base, rel_path)) if change["status"] != "added" else None
+            after = _read_bytes(os.path.join(self.path, rel_path)) if change["status"] != "deleted" else None
+            lines.extend(difflib.unified_diff(
+                (before or b"").decode('utf-8', 'replace').splitlines(keepends=True),
+                (after or b"").decode('utf-8', 'replace').splitlines(keepends=True),
+                fromfile=f"a/{rel_path}" if change["status"] != "added" else "/dev/null",
+                tofile=f"b/{rel_path}" if change["status"] != "deleted" else "/dev/null",
+            ))
+        return "".join(line if line.endswith("\n") else line + "\n" for line in lines)
+
+    def conflicts(self, changes: Optional[List[Dict[str, str]]] = None) -> List[str]:
+        """Changed files whose base file also changed since the workspace saw it"""
+        conflicts = []
+        for change in changes if changes is not None else self.diff():
+            rel_path = change["path"]
+            try:
+                current = _stat_key(os.stat(os.path.join(self.base, rel_path)))
+            except OSError:
+                current = None
+            if current != self.base_state.get(rel_path):
+                conflicts.append(rel_path)
+        return conflicts
+
+    def commit(self, force: bool = False, paths: Optional[List[str]] = None) -> Tuple[List[Dict[str, str]], List[str]]:
+        """Write the workspace's changes back to the base
+
+        Args:
+            force: Also overwrite base files that changed since the workspace saw them
+            paths: Only commit changes to these paths
+
+        Returns:
+            (applied changes, conflicting paths that were left out)
+        """
+        changes = [change for change in self.diff() if paths is None or change["path"] in paths]
+        conflicts = [] if force else self.conflicts(changes)
+        applied = []
+        with self.lock:
+            for change in changes:
+                rel_path = change["path"]
+                if rel_path in conflicts:
+                    continue
+                base_path = os.path.join(self.base, rel_path)
+                if change["status"] == "deleted":
+                    if os.path.exists(base_path):
+                        os.remove(base_path)
+                    self.base_state.pop(rel_path, None)
+                    self.deleted.discard(rel_path)
+                else:
+                    replace_file(base_path, _read_bytes(os.path.join(self.path, rel_path)))
+                    self.base_state[rel_path] = _stat_key(os.stat(base_path))
+                applied.append(change)
+            self._save_meta()
+        logger.info(f"Committed {len(applied)} change(s) from {self.path}, {len(conflicts)} conflict(s)")
+        return applied, conflicts
+
+    def discard(self) -> None:
+        """Delete the workspace and its changes"""
+        self.wait()
+        with _open_lock:
+            _open_workspaces.pop(self.path, None)
+        shutil.rmtree(self.path, ignore_errors=True)
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)